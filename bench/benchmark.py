@@ -0,0 +1,413 @@
+"""Replay a corpus through the local pipeline and report throughput and latency.
+
+    python bench/benchmark.py --synthetic 500 --rate 50
+    python bench/benchmark.py --corpus path/to/emails --rate 0
+
+Two passes are made. The throughput pass injects emails at --rate (0 means
+as fast as possible) with every stage polling concurrently, and reports
+per-stage invocation latency and overall messages per second. The allocation
+pass pushes --alloc-sample emails through one stage at a time with
+tracemalloc running, so each stage's peak allocation can be attributed to it.
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+from corpus import corpus_recipients, load_eml_corpus, recipients, synthetic_corpus, write_corpus
+from harness import SANITIZED_BUCKET, Pipeline
+
+STAGES = ("sanitizer", "classifier", "chat", "notifier", "urlvisitor", "webhook", "updates")
+
+# Update ids of /link updates start here, clear of the per-email status updates
+LINK_UPDATE_BASE = 1_000_000
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def pipeline_options(args):
+    return {
+        "bedrock_latency_seconds": args.bedrock_latency_ms / 1000,
+        "telegram_latency_seconds": args.telegram_latency_ms / 1000,
+        "chat_history_enabled": args.chat_history,
+        "inline_classify": args.inline,
+        "classifier_batch_size": args.batch_size,
+        "classifier_concurrency": args.classifier_concurrency,
+        "digest_window_seconds": args.digest_window,
+        "fast_tier": args.fast_tier,
+        "stream_responses": args.stream,
+        "prompt_cache": args.prompt_cache,
+        "fast_ack": args.fast_ack,
+        "prefilter_mode": args.prefilter,
+        "prefilter_model": args.prefilter_model or "",
+    }
+
+
+def webhook_update(chat_id, n, text=None):
+    return {
+        "update_id": n,
+        "message": {"message_id": n, "chat": {"id": int(chat_id)}, "text": text or f"status? {n}"},
+    }
+
+
+def link_updates(pipeline, count):
+    """Pending /link updates for count new users, from chats of their own."""
+    codes = pipeline.seed_link_codes([f"link{n}@bench.needl.email" for n in range(count)])
+    return [
+        webhook_update(200000 + n, LINK_UPDATE_BASE + n, f"/link {code}")
+        for n, code in enumerate(codes.values())
+    ]
+
+
+def run_throughput(args, corpus, users):
+    with Pipeline(**pipeline_options(args)) as pipeline:
+        pipeline.seed_users(users)
+        chat_ids = [
+            item["telegram_id"]
+            for item in pipeline.aws.dynamodb.items["users"].values()
+            if "telegram_id" in item
+        ]
+        rng = random.Random(args.seed)
+        links = link_updates(pipeline, args.link_users)
+        pipeline.start(args.pollers)
+
+        webhook_threads = []
+
+        def deliver(update):
+            # Telegram redelivers an update when the webhook is slow to answer
+            copies = 2 if rng.random() < args.webhook_retry_ratio else 1
+            for _ in range(copies):
+                thread = threading.Thread(target=pipeline.invoke_webhook, args=(update,))
+                thread.start()
+                webhook_threads.append(thread)
+
+        started = time.perf_counter()
+        interval = 1 / args.rate if args.rate else 0
+        for n, (name, raw) in enumerate(corpus):
+            if interval:
+                delay = started + n * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pipeline.inject(f"{name}-{n}", raw)
+            if chat_ids and rng.random() < args.webhook_ratio:
+                deliver(webhook_update(rng.choice(chat_ids), n))
+            if links and rng.random() < len(links) / max(len(corpus) - n, 1):
+                deliver(links.pop())
+        for update in links:
+            deliver(update)
+        injected = time.perf_counter()
+
+        for thread in webhook_threads:
+            thread.join()
+        drained = pipeline.drain(timeout=args.timeout)
+        finished = time.perf_counter()
+        pipeline.stop()
+        if args.export_training:
+            export_training(pipeline, args.export_training)
+
+        return {
+            "messages": len(corpus),
+            "drained": drained,
+            "inject_seconds": injected - started,
+            "total_seconds": finished - started,
+            "messages_per_second": len(corpus) / (finished - started),
+            "stages": stage_report(pipeline.timings),
+            "end_to_end": summarize(pipeline.metrics["notifier"].get("EndToEndLatency", [])),
+            "operations": operation_report(pipeline),
+            "bedrock_tokens": {
+                name: sum(pipeline.metrics["classifier"].get(name, []))
+                for name in (
+                    "BedrockInputTokens",
+                    "BedrockOutputTokens",
+                    "BedrockCacheReadTokens",
+                    "BedrockCacheWriteTokens",
+                )
+            },
+            "tiers": tier_report(pipeline.metrics["classifier"]),
+            "prefilter": prefilter_report(pipeline.metrics["classifier"]),
+            "telegram_messages": len(pipeline.http.messages),
+            "gmail_confirmations": len(pipeline.http.confirmations),
+            "gmail_already_confirmed": len(pipeline.metrics["urlvisitor"].get("GmailAlreadyConfirmed", [])),
+            "linked_users": sum(
+                1
+                for item in pipeline.aws.dynamodb.items["users"].values()
+                if item["email"].startswith("link") and "telegram_id" in item
+            ),
+            "duplicate_updates_suppressed": sum(
+                len(pipeline.metrics[stage].get("DuplicateSuppressed", []))
+                for stage in ("webhook", "updates")
+            ),
+            "bedrock_calls": sum(pipeline.aws.bedrock.calls.values()),
+            "redeliveries": dict(pipeline.redeliveries),
+            "dead_letters": dict(pipeline.dead_letters),
+            "aws_calls": {
+                "s3": dict(pipeline.aws.s3.calls),
+                "sqs": dict(pipeline.aws.sqs.calls),
+                "dynamodb": dict(pipeline.aws.dynamodb.calls),
+            },
+        }
+
+
+def summarize(millis):
+    if not millis:
+        return None
+    return {
+        "count": len(millis),
+        "p50_ms": percentile(millis, 50),
+        "p95_ms": percentile(millis, 95),
+        "p99_ms": percentile(millis, 99),
+    }
+
+
+def operation_report(pipeline):
+    """Percentiles of each timed operation the handlers reported as EMF metrics."""
+    report = {}
+    for stage in STAGES:
+        for name, values in sorted(pipeline.metrics.get(stage, {}).items()):
+            if pipeline.metric_units.get(name) == "Milliseconds" and name != "EndToEndLatency":
+                report[f"{stage}.{name}"] = summarize(values)
+    return report
+
+
+def tier_report(classifier_metrics):
+    """Calls and tokens per model tier, and how often the fast tier escalated."""
+    tiers = {}
+    for tier in ("Fast", "Primary"):
+        calls = classifier_metrics.get(f"BedrockCall{tier}", [])
+        if calls:
+            tiers[tier] = {
+                "calls": len(calls),
+                "p50_ms": percentile(calls, 50),
+                "input_tokens": sum(classifier_metrics.get(f"BedrockInputTokens{tier}", [])),
+                "output_tokens": sum(classifier_metrics.get(f"BedrockOutputTokens{tier}", [])),
+            }
+    accepted = len(classifier_metrics.get("FastTierAccepted", []))
+    escalated = len(classifier_metrics.get("Escalations", []))
+    if accepted + escalated:
+        tiers["escalation_rate"] = escalated / (accepted + escalated)
+    return tiers
+
+
+def prefilter_report(classifier_metrics):
+    """How often the prefilter agreed with Bedrock, and how often it decided alone."""
+    agreement = classifier_metrics.get("PrefilterAgreement", [])
+    confident = classifier_metrics.get("PrefilterConfidentAgreement", [])
+    decisions = len(classifier_metrics.get("PrefilterDecisions", []))
+    if not agreement and not decisions:
+        return {}
+    return {
+        "compared": len(agreement),
+        "agreement": sum(agreement) / len(agreement) if agreement else None,
+        "coverage": len(confident) / len(agreement) if agreement else None,
+        "confident_agreement": sum(confident) / len(confident) if confident else None,
+        "decisions": decisions,
+        "predict": summarize(classifier_metrics.get("PrefilterPredict", [])),
+    }
+
+
+def export_training(pipeline, directory):
+    """Copy the classifier's logged training examples out of the fake S3."""
+    bucket = pipeline.aws.s3.buckets[SANITIZED_BUCKET]
+    for key, data in bucket.items():
+        if key.startswith("training/"):
+            path = os.path.join(directory, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+
+def stage_report(timings):
+    report = {}
+    for stage in STAGES:
+        samples = timings.get(stage, [])
+        if not samples:
+            continue
+        millis = [seconds * 1000 for seconds, _ in samples]
+        records = sum(count for _, count in samples)
+        report[stage] = {
+            "invocations": len(samples),
+            "records": records,
+            "p50_ms": percentile(millis, 50),
+            "p95_ms": percentile(millis, 95),
+            "p99_ms": percentile(millis, 99),
+            "ms_per_record": sum(millis) / records,
+        }
+    return report
+
+
+def run_allocations(args, corpus, users):
+    """Push a sample through the pipeline sequentially with tracemalloc on."""
+    sample = corpus[: args.alloc_sample]
+    with Pipeline(**pipeline_options(args)) as pipeline:
+        pipeline.seed_users(users)
+        tracemalloc.start()
+        try:
+            for n, (name, raw) in enumerate(sample):
+                pipeline.inject(f"{name}-{n}", raw)
+                pipeline.run_to_completion(trace_allocations=True)
+            for n in range(min(len(sample), 10)):
+                pipeline.invoke_webhook(webhook_update(100000, n), trace_allocations=True)
+        finally:
+            tracemalloc.stop()
+
+        report = {}
+        for stage in STAGES:
+            samples = pipeline.allocations.get(stage, [])
+            if samples:
+                records = sum(count for _, count in samples)
+                report[stage] = {
+                    "records": records,
+                    "peak_kib_per_record": sum(peak for peak, _ in samples) / records / 1024,
+                    "max_peak_kib": max(peak for peak, _ in samples) / 1024,
+                }
+        return report
+
+
+def print_report(throughput, allocations):
+    print(
+        f"\n{throughput['messages']} messages in {throughput['total_seconds']:.2f}s "
+        f"({throughput['messages_per_second']:.1f} msg/s)"
+        + ("" if throughput["drained"] else "  [timed out before draining]")
+    )
+    print(
+        f"Telegram messages: {throughput['telegram_messages']}  "
+        f"Gmail confirmations: {throughput['gmail_confirmations']} "
+        f"({throughput['gmail_already_confirmed']} already confirmed)  "
+        f"Bedrock calls: {throughput['bedrock_calls']}"
+    )
+    print(
+        f"Linked users: {throughput['linked_users']}  "
+        f"Duplicate webhook updates suppressed: {throughput['duplicate_updates_suppressed']}"
+    )
+    if throughput["redeliveries"] or throughput["dead_letters"]:
+        print(f"Redeliveries: {throughput['redeliveries']}  Dead letters: {throughput['dead_letters']}")
+
+    print(
+        f"\n{'stage':<12}{'invokes':>8}{'records':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'ms/rec':>9}{'KiB/rec':>10}"
+    )
+    for stage in STAGES:
+        row = throughput["stages"].get(stage)
+        if not row:
+            continue
+        alloc = allocations.get(stage, {}).get("peak_kib_per_record")
+        print(
+            f"{stage:<12}{row['invocations']:>8}{row['records']:>9}"
+            f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+            f"{row['ms_per_record']:>9.2f}"
+            + (f"{alloc:>10.1f}" if alloc is not None else f"{'-':>10}")
+        )
+    print("\nKiB/rec is the tracemalloc peak above baseline per record, from the allocation pass.")
+
+    print(f"\n{'operation':<30}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    rows = list(throughput["operations"].items())
+    if throughput["end_to_end"]:
+        rows.append(("receive-to-notify", throughput["end_to_end"]))
+    for name, row in rows:
+        print(
+            f"{name:<30}{row['count']:>7}{row['p50_ms']:>9.1f}"
+            f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+        )
+    tokens = throughput["bedrock_tokens"]
+    print(
+        f"\nBedrock tokens: {tokens['BedrockInputTokens']:.0f} in, "
+        f"{tokens['BedrockOutputTokens']:.0f} out"
+        + (
+            f", {tokens['BedrockCacheReadTokens']:.0f} cache read, "
+            f"{tokens['BedrockCacheWriteTokens']:.0f} cache write"
+            if tokens["BedrockCacheReadTokens"] or tokens["BedrockCacheWriteTokens"]
+            else ""
+        )
+    )
+    tiers = throughput["tiers"]
+    for tier in ("Fast", "Primary"):
+        if tier in tiers and "escalation_rate" in tiers:
+            row = tiers[tier]
+            print(
+                f"  {tier:<8}{row['calls']:>6} calls  p50 {row['p50_ms']:.1f} ms  "
+                f"{row['input_tokens']:.0f} in, {row['output_tokens']:.0f} out"
+            )
+    if "escalation_rate" in tiers:
+        print(f"  Escalation rate: {tiers['escalation_rate']:.1%}")
+    prefilter = throughput["prefilter"]
+    if prefilter.get("compared"):
+        print(
+            f"\nPrefilter: {prefilter['compared']} compared, {prefilter['agreement']:.1%} agreement, "
+            f"{prefilter['coverage']:.1%} confident"
+            + (
+                f" at {prefilter['confident_agreement']:.1%} agreement"
+                if prefilter["confident_agreement"] is not None
+                else ""
+            )
+        )
+    if prefilter.get("decisions"):
+        print(f"Prefilter decided {prefilter['decisions']} emails without Bedrock")
+    if prefilter.get("predict"):
+        print(f"  predict p50 {prefilter['predict']['p50_ms'] * 1000:.0f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--corpus", help="directory of .eml files to replay")
+    source.add_argument("--synthetic", type=int, default=500, help="generate this many emails")
+    parser.add_argument("--users", type=int, default=50, help="recipients for synthetic emails")
+    parser.add_argument("--write-corpus", help="also write the synthetic corpus here as .eml")
+    parser.add_argument("--rate", type=float, default=50, help="emails per second; 0 for unthrottled")
+    parser.add_argument("--pollers", type=int, default=1, help="concurrent invocations per stage")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=300)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--batch-size", type=int, default=1, help="CLASSIFIER_BATCH_SIZE")
+    parser.add_argument("--classifier-concurrency", type=int, default=10)
+    parser.add_argument("--inline", action="store_true", help="INLINE_CLASSIFY")
+    parser.add_argument("--chat-history", action="store_true", help="CHAT_HISTORY_ENABLED")
+    parser.add_argument("--digest-window", type=int, default=0, help="DIGEST_WINDOW_SECONDS")
+    parser.add_argument("--fast-tier", action="store_true", help="set BEDROCK_FAST_MODEL_ID")
+    parser.add_argument("--stream", action="store_true", help="BEDROCK_STREAM_RESPONSES")
+    parser.add_argument("--prompt-cache", action="store_true", help="BEDROCK_PROMPT_CACHE_MODELS")
+    parser.add_argument("--webhook-ratio", type=float, default=0.05, help="webhook updates per email")
+    parser.add_argument("--webhook-retry-ratio", type=float, default=0.1,
+                        help="share of webhook updates Telegram delivers twice")
+    parser.add_argument("--link-users", type=int, default=10, help="/link commands sent during the run")
+    parser.add_argument("--fast-ack", action="store_true", help="WEBHOOK_FAST_ACK")
+    parser.add_argument("--prefilter", choices=("off", "shadow", "enforce"), default="off",
+                        help="PREFILTER_MODE")
+    parser.add_argument("--prefilter-model", help="PREFILTER_MODEL_URI; a local path works")
+    parser.add_argument("--export-training", help="write logged prefilter training examples here")
+    parser.add_argument("--alloc-sample", type=int, default=50, help="emails in the allocation pass; 0 to skip")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_eml_corpus(args.corpus)
+        users = corpus_recipients(corpus)
+    else:
+        users = recipients(args.users)
+        corpus = synthetic_corpus(args.synthetic, users, args.seed)
+        if args.write_corpus:
+            write_corpus(corpus, args.write_corpus)
+
+    throughput = run_throughput(args, corpus, users)
+    allocations = run_allocations(args, corpus, users) if args.alloc_sample else {}
+    print_report(throughput, allocations)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"throughput": throughput, "allocations": allocations}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Measure each Lambda's cold-start import and init time.
+
+    python bench/coldstart.py                  # current tree
+    python bench/coldstart.py --git-ref HEAD~1 # compare with another revision
+    python bench/coldstart.py --importtime     # also list the slowest imports
+
+Every run imports a handler in a fresh interpreter with real boto3 (and dummy
+credentials; nothing is called), which is the work Lambda does during INIT.
+Reported per handler are the median import+init time, the number of boto3
+clients and resources already built once the module is loaded, and peak RSS.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from harness import ROOT, lambda_environment
+
+HANDLERS = ("sanitizer", "classifier", "chat", "notifier", "urlvisitor", "webhook")
+
+PROBE = """
+import gc, json, resource, sys, time
+started = time.perf_counter()
+import handler
+init = time.perf_counter() - started
+clients = resources = 0
+if "botocore.client" in sys.modules:
+    from botocore.client import BaseClient
+    clients = sum(isinstance(o, BaseClient) for o in gc.get_objects())
+if "boto3.resources.base" in sys.modules:
+    from boto3.resources.base import ServiceResource
+    resources = sum(isinstance(o, ServiceResource) for o in gc.get_objects())
+print(json.dumps({
+    "init_ms": init * 1000,
+    "clients": clients,
+    "resources": resources,
+    "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def export_revision(ref, directory):
+    """Extract src/ at a git revision into directory."""
+    archive = os.path.join(directory, "src.tar")
+    subprocess.run(
+        ["git", "-C", ROOT, "archive", "--format=tar", "-o", archive, ref, "src"],
+        check=True,
+    )
+    with tarfile.open(archive) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, "src")
+
+
+def probe_environment(src, name):
+    path = [os.path.join(src, "lambda", name), os.path.join(src, "shared")]
+    if os.environ.get("PYTHONPATH"):
+        path.append(os.environ["PYTHONPATH"])
+    env = dict(os.environ, **lambda_environment(name))
+    env.update(
+        {
+            "PYTHONPATH": os.pathsep.join(path),
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_EC2_METADATA_DISABLED": "true",
+            "PYTHONDONTWRITEBYTECODE": "1",
+        }
+    )
+    return env
+
+
+def measure(src, name, runs):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            env=probe_environment(src, name),
+            capture_output=True,
+            text=True,
+            cwd=tempfile.gettempdir(),
+        )
+        if result.returncode:
+            raise RuntimeError(f"{name} failed to import:\n{result.stderr}")
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        "init_ms": statistics.median(s["init_ms"] for s in samples),
+        "clients": samples[0]["clients"],
+        "resources": samples[0]["resources"],
+        "max_rss_mib": statistics.median(s["max_rss_mib"] for s in samples),
+        "modules": samples[0]["modules"],
+    }
+
+
+def slowest_imports(src, name, count):
+    """Return the top-level imports with the largest cumulative import time."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import handler"],
+        env=probe_environment(src, name),
+        capture_output=True,
+        text=True,
+        cwd=tempfile.gettempdir(),
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        if not module.startswith("  "):  # top-level imports only
+            imports.append((int(cumulative) / 1000, module.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def report(src, runs, importtime):
+    results = {}
+    print(f"{'handler':<12}{'init ms':>9}{'clients':>9}{'resources':>11}{'RSS MiB':>9}{'modules':>9}")
+    for name in HANDLERS:
+        row = results[name] = measure(src, name, runs)
+        print(
+            f"{name:<12}{row['init_ms']:>9.1f}{row['clients']:>9}{row['resources']:>11}"
+            f"{row['max_rss_mib']:>9.1f}{row['modules']:>9}"
+        )
+        if importtime:
+            for millis, module in slowest_imports(src, name, importtime):
+                print(f"{'':<14}{millis:>8.1f} ms  {module}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per handler")
+    parser.add_argument("--git-ref", help="also measure src/ at this revision")
+    parser.add_argument("--importtime", type=int, nargs="?", const=8, default=0,
+                        help="list this many slowest top-level imports per handler")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    if args.git_ref:
+        with tempfile.TemporaryDirectory() as directory:
+            print(f"src/ at {args.git_ref}:")
+            results[args.git_ref] = report(
+                export_revision(args.git_ref, directory), args.runs, args.importtime
+            )
+        print("\nWorking tree:")
+    results["working tree"] = report(os.path.join(ROOT, "src"), args.runs, args.importtime)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
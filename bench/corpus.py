@@ -0,0 +1,166 @@
+"""Benchmark corpora: .eml files from disk, or a generated synthetic mix."""
+
+import os
+import random
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from email.utils import getaddresses, make_msgid
+from pathlib import Path
+
+DOMAIN = "needl.email"
+
+PERSONAL_SUBJECTS = [
+    "Dinner tonight?",
+    "Can you reply about the school pickup",
+    "Urgent: water outage in the building",
+    "Meeting moved to 3pm",
+    "Quick question, please call me asap",
+]
+ROUTINE_SUBJECTS = [
+    "Your order has shipped",
+    "Your monthly statement is ready",
+    "Weekly digest",
+    "Receipt for your purchase",
+]
+MARKETING_SUBJECTS = [
+    "48 hours only: 40% off everything",
+    "New arrivals picked for you",
+    "Don't miss our biggest sale of the year",
+]
+
+LOREM = (
+    "Thanks again for getting back to me so quickly. I looked through the notes "
+    "from last week and I think we are mostly aligned on the plan, with a couple "
+    "of open questions about timing and who owns the follow-up. "
+)
+
+
+def recipients(count: int) -> list[str]:
+    return [f"user{i}@{DOMAIN}" for i in range(count)]
+
+
+def load_eml_corpus(directory: str) -> list[tuple[str, bytes]]:
+    """Read every .eml file under directory as (name, raw bytes)."""
+    paths = sorted(Path(directory).rglob("*.eml"))
+    if not paths:
+        raise SystemExit(f"No .eml files found under {directory}")
+    return [(path.stem, path.read_bytes()) for path in paths]
+
+
+def corpus_recipients(corpus) -> set[str]:
+    """Return the lowercase To addresses found in a corpus."""
+    parser = BytesHeaderParser()
+    found = set()
+    for _, raw in corpus:
+        for _, address in getaddresses([str(parser.parsebytes(raw).get("To", ""))]):
+            if address:
+                found.add(address.strip().lower())
+    return found
+
+
+def _message(sender, to, subject, n):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = f"{subject} [{n}]"
+    msg["Message-ID"] = make_msgid(domain="bench.local")
+    return msg
+
+
+def personal(rng, to, n):
+    name = rng.choice(["alice", "bob", "carol", "dave"])
+    msg = _message(f"{name.title()} <{name}@example.org>", to, rng.choice(PERSONAL_SUBJECTS), n)
+    body = f"Hi,\n\n{LOREM * rng.randint(1, 4)}\n\nCould you reply when you get a chance?\n\n"
+    body += "On Mon, someone wrote:\n> " + "\n> ".join([LOREM] * rng.randint(0, 6))
+    msg.set_content(body)
+    return msg
+
+
+def routine(rng, to, n):
+    msg = _message("Shop <orders@shop.example>", to, rng.choice(ROUTINE_SUBJECTS), n)
+    msg.set_content(f"Order #{rng.randint(10000, 99999)}\n\n{LOREM}\n")
+    return msg
+
+
+def marketing(rng, to, n):
+    msg = _message("Deals <deals@store.example>", to, rng.choice(MARKETING_SUBJECTS), n)
+    msg["List-Unsubscribe"] = "<https://store.example/unsubscribe>"
+    cards = "".join(
+        f'<div class="card"><img src="https://cdn.example/{i}.png">'
+        f"<h2>Product {i}</h2><p>{LOREM}</p><a href='#'>Shop now</a></div>"
+        for i in range(rng.randint(20, 80))
+    )
+    html = (
+        "<html><head><style>.card{padding:8px}</style></head><body>"
+        f"<table><tr><td>{cards}</td></tr></table>"
+        "<p>You are receiving this because you subscribed. Unsubscribe.</p></body></html>"
+    )
+    msg.set_content("Open this email in an HTML-capable client.")
+    msg.add_alternative(html, subtype="html")
+    # HTML-only marketing mail exercises the HTML extractor
+    msg.get_payload().pop(0)
+    return msg
+
+
+# Fake Gmail endpoints (see FakeHTTPServer) and how often each is linked
+GMAIL_LINK_KINDS = (("ok", 0.7), ("redirect-3", 0.2), ("slow-0.5", 0.1))
+
+
+def gmail_confirmation(rng, to, n):
+    # The URL visitor only confirms links for users it knows, so the request
+    # comes from the recipient's own account
+    requester = to
+    kind = rng.choices([k for k, _ in GMAIL_LINK_KINDS], [w for _, w in GMAIL_LINK_KINDS])[0]
+    msg = _message(
+        "Gmail Team <forwarding-noreply@google.com>",
+        to,
+        "Gmail Forwarding Confirmation - Receive Mail from " + requester,
+        n,
+    )
+    msg.set_content(
+        f"{requester} has requested to automatically forward mail to your email\n"
+        f"address {to}.\n\nTo allow {requester} to automatically forward mail to "
+        "your address, please click the link below to confirm the request:\n\n"
+        f"https://mail-settings.google.com/mail/vf-{kind}?id={n}\n\nThanks for using Gmail!\n"
+    )
+    return msg
+
+
+def with_attachment(rng, to, n):
+    msg = personal(rng, to, n)
+    size = rng.choice([64, 256, 1024]) * 1024
+    msg.add_attachment(
+        rng.randbytes(size), maintype="application", subtype="pdf", filename="report.pdf"
+    )
+    return msg
+
+
+KINDS = {
+    "personal": (personal, 0.3),
+    "routine": (routine, 0.25),
+    "marketing": (marketing, 0.3),
+    "gmail_confirmation": (gmail_confirmation, 0.05),
+    "attachment": (with_attachment, 0.1),
+}
+
+
+def synthetic_corpus(count: int, users: list[str], seed: int = 0) -> list[tuple[str, bytes]]:
+    """Generate count raw emails drawn from KINDS, addressed to users."""
+    rng = random.Random(seed)
+    names = list(KINDS)
+    weights = [KINDS[name][1] for name in names]
+    corpus = []
+    for n in range(count):
+        kind = rng.choices(names, weights)[0]
+        msg = KINDS[kind][0](rng, rng.choice(users), n)
+        corpus.append((f"{kind}-{n:06d}", msg.as_bytes()))
+    return corpus
+
+
+def write_corpus(corpus, directory: str):
+    """Write a corpus out as .eml files, e.g. to replay it later."""
+    os.makedirs(directory, exist_ok=True)
+    for name, raw in corpus:
+        with open(os.path.join(directory, f"{name}.eml"), "wb") as f:
+            f.write(raw)
+
@@ -0,0 +1,163 @@
+"""Compare the sanitizer's HTML text extractor with BeautifulSoup's get_text.
+
+    python bench/extractors.py
+    python bench/extractors.py --fixtures path/to/html --repeat 200 --verbose
+
+Each fixture is an .html file in bench/fixtures/html. The extractor must
+produce what clean_text produced with BeautifulSoup, get_text(separator=" ",
+strip=True) with whitespace collapsed, both in full and cut at each of
+--caps. The exception is hidden elements, whose text the extractor drops
+and get_text keeps: a fixture with hidden elements has a .txt file next to
+it holding the expected text, which is checked in place of get_text's.
+
+The sanitizer's streamed MIME parse stops reading once an HTML part fills
+the body cap, wherever the chunk ends. It is also checked with chunks that
+split the following part's headers at every offset: the body must still be
+the HTML part's text, never a fragment of the cut-off part.
+Exits non-zero if any fixture or split does not match.
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, "src", "lambda", "sanitizer"),
+    os.path.join(ROOT, "src", "shared"),
+]
+
+# The sanitizer is imported for its MIME parsing only; a small body cap makes
+# the HTML part below fill it
+os.environ.update(OUTPUT_S3_BUCKET="", USER_EMAILS_TABLE="", MAX_BODY_CHARS="2000")
+
+from htmltext import html_to_text  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "html")
+
+
+def bs4_text(document, max_chars=None):
+    """clean_text as it was before the extractor, for comparison."""
+    cleaned = BeautifulSoup(document, "html.parser").get_text(separator=" ", strip=True)
+    return re.sub(r"\s+", " ", cleaned).strip()[:max_chars]
+
+
+ENGINES = {"bs4": bs4_text, "stdlib": html_to_text}
+
+
+def expected_text(path, document):
+    """The .txt next to a fixture with hidden elements, else get_text's output."""
+    expected_path = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(expected_path):
+        with open(expected_path, encoding="utf-8") as f:
+            return f.read().strip(), True
+    return bs4_text(document), False
+
+
+def mismatches(document, expected, caps):
+    """Caps (None for the full text) at which the extractor's output differs."""
+    return [
+        cap
+        for cap in (None, *caps)
+        if html_to_text(document, cap) != (expected if cap is None else expected[:cap])
+    ]
+
+
+def split_messages():
+    """(name, raw message, offset of the part after the HTML part) to split at."""
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    html_part = MIMEText("<p>" + "Your order has shipped. " * 200 + "</p>", "html")
+    attachment = MIMEMultipart("mixed")
+    attachment.attach(html_part)
+    attachment.attach(MIMEApplication(b"%PDF-1.7" * 4000, "pdf", Name="invoice.pdf"))
+    alternative = MIMEMultipart("alternative")
+    alternative.attach(html_part)
+    alternative.attach(MIMEText("Your order has shipped.", "plain"))
+    for name, message in (("html then pdf", attachment), ("html then plain", alternative)):
+        raw = message.as_bytes()
+        yield name, raw, raw.index(b"</p>") + len(b"</p>")
+
+
+def streamed_mime_failures():
+    """Splits at which the streamed parse returns a body from neither a
+    stop at the HTML part nor a read to the end."""
+    import handler
+
+    failures = []
+    for name, raw, html_end in split_messages():
+        # Only an early stop is under test, so the HTML part must fill the cap
+        html_text = handler.clean_text(raw[:html_end].decode().rpartition("\n\n")[2])
+        if len(html_text) < handler.MAX_BODY_CHARS:
+            failures.append(f"{name}: HTML part does not fill the cap")
+            continue
+        read_whole = handler.extract_body(handler.parse_email_stream([raw]))
+        expected = {html_text[: handler.MAX_BODY_CHARS], read_whole}
+        for cut in range(html_end, min(html_end + 400, len(raw))):
+            body = handler.extract_body(handler.parse_email_stream([raw[:cut], raw[cut:]]))
+            if body not in expected:
+                failures.append(f"{name}, split at byte {cut}: {body[:40]!r}")
+                break
+    return failures
+
+
+def mean_millis(engine, document, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        engine(document)
+    return (time.perf_counter() - started) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", default=FIXTURES, help="directory of .html fixtures")
+    parser.add_argument("--caps", type=int, nargs="*", default=[1, 40, 100, 250, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--verbose", action="store_true", help="list each fixture's outcome")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.fixtures, "*.html")))
+    if not paths:
+        sys.exit(f"No .html fixtures in {args.fixtures}")
+
+    failed = 0
+    timings = {name: [] for name in ENGINES}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            document = f.read()
+        expected, hidden = expected_text(path, document)
+        bad = mismatches(document, expected, args.caps)
+        failed += bool(bad)
+        for name, engine in ENGINES.items():
+            timings[name].append(mean_millis(engine, document, args.repeat))
+        if args.verbose or bad:
+            note = " (hidden elements, checked against .txt)" if hidden else ""
+            print(f"  {'BAD' if bad else 'ok '} {os.path.basename(path)}{note}")
+            if bad:
+                caps = ", ".join("full" if cap is None else str(cap) for cap in bad)
+                print(f"      differs at: {caps}")
+                print(f"      expected: {expected[:300]!r}")
+                print(f"      got:      {html_to_text(document)[:300]!r}")
+
+    print(f"{len(paths) - failed}/{len(paths)} fixtures match")
+
+    split_failures = streamed_mime_failures()
+    for failure in split_failures:
+        print(f"  BAD streamed parse, {failure}")
+    print(f"Streamed MIME parse: {'ok' if not split_failures else 'BAD'}")
+    failed += len(split_failures)
+    print(f"{'engine':<10}{'mean ms':>10}{'max ms':>10}")
+    for name, values in timings.items():
+        print(f"{name:<10}{sum(values) / len(values):>10.3f}{max(values):>10.3f}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,918 @@
+"""In-memory stand-ins for the AWS services and HTTP endpoints the Lambdas use.
+
+Only the calls the handlers actually make are implemented. The fakes are
+thread-safe, since the classifier and notifier fan out over thread pools.
+"""
+
+import collections
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def client_error(code, message, operation):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class FakeExceptions:
+    """Mirror of client.exceptions for the error codes handlers catch."""
+
+    ClientError = ClientError
+
+    class ConditionalCheckFailedException(ClientError):
+        pass
+
+    class TransactionCanceledException(ClientError):
+        pass
+
+
+class StreamingBody:
+    """Minimal botocore StreamingBody."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._stream.read(amt)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+
+
+# --- S3 ---------------------------------------------------------------------
+
+
+class FakeS3:
+    def __init__(self):
+        self.buckets = collections.defaultdict(dict)
+        self.notifications = []  # (bucket, prefix, callback)
+        self._lock = threading.Lock()
+        self.calls = collections.Counter()
+
+    def on_put(self, bucket, prefix, callback):
+        """Call callback(bucket, key) for every object created under prefix."""
+        self.notifications.append((bucket, prefix, callback))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self._lock:
+            self.calls["put_object"] += 1
+            self.buckets[Bucket][Key] = data
+        for bucket, prefix, callback in self.notifications:
+            if bucket == Bucket and Key.startswith(prefix):
+                callback(Bucket, Key)
+        return {"ETag": uuid.uuid4().hex}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self.calls["get_object"] += 1
+            try:
+                data = self.buckets[Bucket][Key]
+            except KeyError:
+                raise client_error("NoSuchKey", Key, "GetObject")
+        return {"Body": StreamingBody(data), "ContentLength": len(data)}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        with self._lock:
+            keys = sorted(k for k in self.buckets[Bucket] if k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+        response = {
+            "Contents": [{"Key": k, "Size": len(self.buckets[Bucket][k])} for k in page],
+            "KeyCount": len(page),
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        s3 = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    page = s3.list_objects_v2(ContinuationToken=token, **kwargs)
+                    yield page
+                    token = page.get("NextContinuationToken")
+                    if not token:
+                        return
+
+        return Paginator()
+
+
+def s3_event(bucket, key):
+    """Build the S3 ObjectCreated event body S3 sends to SQS/SNS."""
+    event_time = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+    return {
+        "Records": [
+            {
+                "eventTime": event_time.replace("+00:00", "Z"),
+                "s3": {"bucket": {"name": bucket}, "object": {"key": key}},
+            }
+        ]
+    }
+
+
+# --- SQS --------------------------------------------------------------------
+
+
+class FakeSQS:
+    MAX_MESSAGE_BYTES = 256 * 1024
+
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self.calls = collections.Counter()
+
+    @staticmethod
+    def url(name):
+        return f"https://sqs.local/000000000000/{name}"
+
+    def _enqueue(self, QueueUrl, MessageBody, DelaySeconds=0):
+        if len(MessageBody.encode("utf-8")) > self.MAX_MESSAGE_BYTES:
+            raise client_error("InvalidParameterValue", "Message too long", "SendMessage")
+        message_id = str(uuid.uuid4())
+        self.queues[QueueUrl].append(
+            {
+                "messageId": message_id,
+                "body": MessageBody,
+                "visible_at": time.monotonic() + DelaySeconds,
+                "attributes": {"SentTimestamp": str(int(time.time() * 1000))},
+            }
+        )
+        return message_id
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        with self._lock:
+            self.calls["send_message"] += 1
+            return {"MessageId": self._enqueue(QueueUrl, MessageBody, DelaySeconds)}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        if len(Entries) > 10:
+            raise client_error("TooManyEntriesInBatchRequest", "Max 10", "SendMessageBatch")
+        successful, failed = [], []
+        with self._lock:
+            self.calls["send_message_batch"] += 1
+            for entry in Entries:
+                try:
+                    message_id = self._enqueue(
+                        QueueUrl, entry["MessageBody"], entry.get("DelaySeconds", 0)
+                    )
+                    successful.append({"Id": entry["Id"], "MessageId": message_id})
+                except ClientError as e:
+                    failed.append(
+                        {"Id": entry["Id"], "Code": e.response["Error"]["Code"], "SenderFault": True}
+                    )
+        return {"Successful": successful, "Failed": failed}
+
+    def receive_records(self, queue_url, max_records=10):
+        """Pop up to max_records visible messages as Lambda SQS event records."""
+        records = []
+        now = time.monotonic()
+        with self._lock:
+            queue = self.queues[queue_url]
+            for _ in range(len(queue)):
+                if len(records) == max_records:
+                    break
+                message = queue.popleft()
+                if message["visible_at"] > now:
+                    queue.append(message)
+                    continue
+                records.append(
+                    {
+                        "messageId": message["messageId"],
+                        "body": message["body"],
+                        "attributes": message["attributes"],
+                        "eventSourceARN": queue_url,
+                    }
+                )
+        return records
+
+    def requeue(self, queue_url, records):
+        """Put records back, as SQS does for batchItemFailures."""
+        with self._lock:
+            for record in records:
+                self.queues[queue_url].append(
+                    {
+                        "messageId": record["messageId"],
+                        "body": record["body"],
+                        "visible_at": time.monotonic(),
+                        "attributes": record["attributes"],
+                    }
+                )
+
+    def depth(self, queue_url):
+        with self._lock:
+            return len(self.queues[queue_url])
+
+
+# --- DynamoDB ---------------------------------------------------------------
+
+
+def _serialize_item(item):
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def _deserialize_item(item):
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+def _normalize(value):
+    """Store numbers as Decimal, the way DynamoDB hands them back."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class Expression:
+    """Evaluate the small subset of DynamoDB expressions the handlers use."""
+
+    def __init__(self, names=None, values=None):
+        self.names = names or {}
+        self.values = values or {}
+
+    def name(self, token):
+        return ".".join(self.names.get(part, part) for part in token.strip().split("."))
+
+    def operand(self, token, item):
+        token = token.strip()
+        if token.startswith(":"):
+            return self.values[token]
+        if token.startswith("if_not_exists("):
+            attr, default = token[len("if_not_exists(") : -1].split(",", 1)
+            name = self.name(attr)
+            return item[name] if name in item else self.operand(default, item)
+        if token.startswith("list_append("):
+            first, second = token[len("list_append(") : -1].split(",", 1)
+            return list(self.operand(first, item) or []) + list(self.operand(second, item) or [])
+        return item.get(self.name(token))
+
+    def condition(self, expression, item):
+        if not expression:
+            return True
+        expression = self._unwrap(expression.strip())
+        for keyword, combine in (("OR", any), ("AND", all)):
+            parts = self._split_keyword(expression, keyword)
+            if len(parts) > 1:
+                return combine(self.condition(part, item) for part in parts)
+        if expression.upper().startswith("NOT "):
+            return not self.condition(expression[4:], item)
+        return self._atom(expression, item)
+
+    @staticmethod
+    def _unwrap(expression):
+        """Strip parentheses that enclose the whole expression."""
+        while expression.startswith("(") and expression.endswith(")"):
+            depth = 0
+            for i, char in enumerate(expression):
+                depth += {"(": 1, ")": -1}.get(char, 0)
+                if depth == 0 and i < len(expression) - 1:
+                    return expression
+            expression = expression[1:-1].strip()
+        return expression
+
+    @staticmethod
+    def _split_keyword(expression, keyword):
+        """Split on keyword where it is outside any parentheses."""
+        parts, depth, start = [], 0, 0
+        pattern = re.compile(rf"\s+{keyword}\s+", re.IGNORECASE)
+        i = 0
+        while i < len(expression):
+            char = expression[i]
+            if char in "()":
+                depth += 1 if char == "(" else -1
+            elif depth == 0:
+                match = pattern.match(expression, i)
+                if match:
+                    parts.append(expression[start:i])
+                    start = i = match.end()
+                    continue
+            i += 1
+        parts.append(expression[start:])
+        return parts
+
+    def _atom(self, atom, item):
+        atom = atom.strip()
+        match = re.match(r"attribute_(not_)?exists\((.+)\)$", atom)
+        if match:
+            exists = self.name(match.group(2)) in item
+            result = not exists if match.group(1) else exists
+        else:
+            match = re.match(r"(.+?)\s*(<>|<=|>=|=|<|>)\s*(.+)$", atom)
+            left = self.operand(match.group(1), item)
+            right = self.operand(match.group(3), item)
+            op = match.group(2)
+            if left is None or right is None:
+                result = op == "<>" and left != right
+            else:
+                result = {
+                    "=": left == right,
+                    "<>": left != right,
+                    "<": left < right,
+                    "<=": left <= right,
+                    ">": left > right,
+                    ">=": left >= right,
+                }[op]
+        return result
+
+    def update(self, expression, item):
+        sections = re.split(r"\b(SET|REMOVE|ADD)\b", expression)
+        for i in range(1, len(sections), 2):
+            action, body = sections[i], sections[i + 1]
+            for clause in self._split_top_level(body):
+                if action == "SET":
+                    target, value = clause.split("=", 1)
+                    value = value.strip()
+                    match = re.match(r"(.+?)\s*([+-])\s*(:\w+)$", value)
+                    if match and not value.startswith(("if_not_exists", "list_append")):
+                        base = self.operand(match.group(1), item) or 0
+                        delta = self.values[match.group(3)]
+                        item[self.name(target)] = base + delta if match.group(2) == "+" else base - delta
+                    else:
+                        item[self.name(target)] = self.operand(value, item)
+                elif action == "REMOVE":
+                    item.pop(self.name(clause), None)
+                elif action == "ADD":
+                    target, value = clause.split()
+                    current = item.get(self.name(target))
+                    delta = self.values[value]
+                    item[self.name(target)] = (current | delta) if isinstance(delta, set) else (current or 0) + delta
+
+    @staticmethod
+    def _split_top_level(body):
+        parts, depth, current = [], 0, ""
+        for char in body:
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            if char == "," and depth == 0:
+                parts.append(current.strip())
+                current = ""
+            else:
+                current += char
+        if current.strip():
+            parts.append(current.strip())
+        return parts
+
+
+class FakeDynamoDB:
+    """Tables keyed by their primary key, exposed through client and resource APIs."""
+
+    def __init__(self):
+        self.schemas = {}
+        self.indexes = {}
+        self.items = {}
+        self._lock = threading.RLock()
+        self.calls = collections.Counter()
+        self.exceptions = FakeExceptions
+
+    def create_table(self, name, hash_key, range_key=None, indexes=None):
+        """indexes maps index name to (hash_key, range_key)."""
+        self.schemas[name] = (hash_key, range_key)
+        self.indexes[name] = indexes or {}
+        self.items[name] = {}
+
+    def _key(self, table, key):
+        hash_key, range_key = self.schemas[table]
+        return (key[hash_key], key.get(range_key) if range_key else None)
+
+    # Plain-value operations used by both the client and resource APIs
+
+    def get(self, table, key):
+        with self._lock:
+            self.calls["get_item"] += 1
+            item = self.items[table].get(self._key(table, key))
+            return dict(item) if item else None
+
+    def put(self, table, item, condition=None, names=None, values=None):
+        item = _normalize(item)
+        with self._lock:
+            self.calls["put_item"] += 1
+            key = self._key(table, item)
+            existing = self.items[table].get(key, {})
+            if not Expression(names, _normalize(values)).condition(condition, existing):
+                raise FakeExceptions.ConditionalCheckFailedException(
+                    {"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}},
+                    "PutItem",
+                )
+            self.items[table][key] = item
+
+    def update(self, table, key, expression, condition=None, names=None, values=None, return_old=False):
+        values = _normalize(values)
+        with self._lock:
+            self.calls["update_item"] += 1
+            stored_key = self._key(table, key)
+            existing = self.items[table].get(stored_key)
+            item = dict(existing or _normalize(key))
+            evaluator = Expression(names, values)
+            if not evaluator.condition(condition, existing or {}):
+                response = {"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}}
+                if return_old and existing:
+                    response["Item"] = _serialize_item(existing)
+                raise FakeExceptions.ConditionalCheckFailedException(response, "UpdateItem")
+            evaluator.update(expression, item)
+            self.items[table][stored_key] = item
+            return dict(item)
+
+    def delete(self, table, key, condition=None, names=None, values=None):
+        with self._lock:
+            self.calls["delete_item"] += 1
+            stored_key = self._key(table, key)
+            existing = self.items[table].get(stored_key, {})
+            if not Expression(names, _normalize(values)).condition(condition, existing):
+                raise FakeExceptions.ConditionalCheckFailedException(
+                    {"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}},
+                    "DeleteItem",
+                )
+            self.items[table].pop(stored_key, None)
+
+    def find(self, table, index, hash_value, range_condition=None, forward=True, limit=None, start_key=None):
+        """Plain-value query; range_condition is (op, value) or ("between", low, high)."""
+        with self._lock:
+            self.calls["query"] += 1
+            hash_key, range_key = self.indexes[table][index] if index else self.schemas[table]
+            matches = [
+                dict(item)
+                for item in self.items[table].values()
+                if item.get(hash_key) == hash_value and (range_key is None or range_key in item)
+            ]
+        if range_condition:
+            op, *operands = range_condition
+            tests = {
+                "=": lambda v: v == operands[0],
+                "<": lambda v: v < operands[0],
+                "<=": lambda v: v <= operands[0],
+                ">": lambda v: v > operands[0],
+                ">=": lambda v: v >= operands[0],
+                "between": lambda v: operands[0] <= v <= operands[1],
+                "begins_with": lambda v: str(v).startswith(operands[0]),
+            }
+            matches = [item for item in matches if tests[op](item[range_key])]
+        table_hash, table_range = self.schemas[table]
+
+        def sort_key(item):
+            return (item.get(range_key) if range_key else "", item[table_hash], item.get(table_range) or "")
+
+        matches.sort(key=sort_key, reverse=not forward)
+        if start_key:
+            position = sort_key(start_key)
+            matches = [
+                item for item in matches
+                if (sort_key(item) > position if forward else sort_key(item) < position)
+            ]
+        last_key = None
+        if limit is not None and len(matches) > limit:
+            matches = matches[:limit]
+            last = matches[-1]
+            last_key = {table_hash: last[table_hash]}
+            if table_range:
+                last_key[table_range] = last[table_range]
+            if range_key:
+                last_key[range_key] = last[range_key]
+            if index:
+                last_key[hash_key] = last[hash_key]
+        return matches, last_key
+
+    # Low-level client API (typed attribute values)
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.get(TableName, _deserialize_item(Key))
+        return {"Item": _serialize_item(item)} if item else {}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        values = _deserialize_item(ExpressionAttributeValues or {})
+        self.put(TableName, _deserialize_item(Item), ConditionExpression, ExpressionAttributeNames, values)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues=None, ReturnValuesOnConditionCheckFailure=None, **kwargs):
+        values = _deserialize_item(ExpressionAttributeValues or {})
+        item = self.update(
+            TableName, _deserialize_item(Key), UpdateExpression, ConditionExpression,
+            ExpressionAttributeNames, values, return_old=ReturnValuesOnConditionCheckFailure == "ALL_OLD",
+        )
+        return {"Attributes": _serialize_item(item)} if ReturnValues else {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        values = _deserialize_item(ExpressionAttributeValues or {})
+        self.delete(TableName, _deserialize_item(Key), ConditionExpression, ExpressionAttributeNames, values)
+        return {}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        with self._lock:
+            self.calls["batch_get_item"] += 1
+            for table, request in RequestItems.items():
+                found = []
+                for key in request["Keys"]:
+                    item = self.items[table].get(self._key(table, _deserialize_item(key)))
+                    if item:
+                        found.append(_serialize_item(item))
+                responses[table] = found
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None, IndexName=None, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, ProjectionExpression=None, **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = _deserialize_item(ExpressionAttributeValues)
+        clauses = re.split(r"\s+AND\s+(?![^(]*\))(?!:\w+\s*$)", KeyConditionExpression.strip(), maxsplit=1)
+        hash_name, hash_value = [part.strip() for part in clauses[0].split("=")]
+        hash_name = names.get(hash_name, hash_name)
+        expected_hash = self.indexes[TableName][IndexName][0] if IndexName else self.schemas[TableName][0]
+        assert hash_name == expected_hash, f"{hash_name} is not the hash key"
+        range_condition = None
+        if len(clauses) > 1:
+            clause = clauses[1].strip()
+            match = re.match(r"begins_with\(\s*([#\w]+)\s*,\s*(:\w+)\s*\)$", clause)
+            between = re.match(r"([#\w]+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)$", clause, re.IGNORECASE)
+            if match:
+                range_condition = ("begins_with", values[match.group(2)])
+            elif between:
+                range_condition = ("between", values[between.group(2)], values[between.group(3)])
+            else:
+                _, op, value = re.match(r"([#\w]+)\s*(<=|>=|=|<|>)\s*(:\w+)$", clause).groups()
+                range_condition = (op, values[value])
+        start_key = _deserialize_item(ExclusiveStartKey) if ExclusiveStartKey else None
+        items, last_key = self.find(
+            TableName, IndexName, values[hash_value], range_condition,
+            ScanIndexForward, Limit, start_key,
+        )
+        if ProjectionExpression:
+            projected = [names.get(n.strip(), n.strip()) for n in ProjectionExpression.split(",")]
+            items = [{n: item[n] for n in projected if n in item} for item in items]
+        response = {"Items": [_serialize_item(item) for item in items], "Count": len(items)}
+        if last_key:
+            response["LastEvaluatedKey"] = _serialize_item(last_key)
+        return response
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        with self._lock:
+            self.calls["batch_write_item"] += 1
+            for table, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise client_error("ValidationException", "Too many items", "BatchWriteItem")
+                for request in requests:
+                    if "PutRequest" in request:
+                        self.put(table, _deserialize_item(request["PutRequest"]["Item"]))
+                    else:
+                        self.delete(table, _deserialize_item(request["DeleteRequest"]["Key"]))
+        return {"UnprocessedItems": {}}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        with self._lock:
+            self.calls["transact_write_items"] += 1
+            snapshot = {table: dict(items) for table, items in self.items.items()}
+            reasons = []
+            try:
+                for entry in TransactItems:
+                    (operation, request), = entry.items()
+                    names = request.get("ExpressionAttributeNames")
+                    values = _deserialize_item(request.get("ExpressionAttributeValues", {}))
+                    condition = request.get("ConditionExpression")
+                    table = request["TableName"]
+                    if operation == "Put":
+                        self.put(table, _deserialize_item(request["Item"]), condition, names, values)
+                    elif operation == "Update":
+                        self.update(table, _deserialize_item(request["Key"]), request["UpdateExpression"], condition, names, values)
+                    elif operation == "Delete":
+                        self.delete(table, _deserialize_item(request["Key"]), condition, names, values)
+                    elif operation == "ConditionCheck":
+                        existing = self.get(table, _deserialize_item(request["Key"])) or {}
+                        if not Expression(names, _normalize(values)).condition(condition, existing):
+                            raise FakeExceptions.ConditionalCheckFailedException(
+                                {"Error": {"Code": "ConditionalCheckFailedException"}}, "ConditionCheck"
+                            )
+                    reasons.append({"Code": "None"})
+            except FakeExceptions.ConditionalCheckFailedException:
+                self.items = snapshot
+                reasons.append({"Code": "ConditionalCheckFailed"})
+                reasons += [{"Code": "None"}] * (len(TransactItems) - len(reasons))
+                raise FakeExceptions.TransactionCanceledException(
+                    {
+                        "Error": {"Code": "TransactionCanceledException", "Message": "cancelled"},
+                        "CancellationReasons": reasons,
+                    },
+                    "TransactWriteItems",
+                )
+        return {}
+
+    def Table(self, name):
+        return FakeTable(self, name)
+
+
+class FakeTable:
+    """boto3 resource Table API (plain Python values)."""
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.table_name = name
+
+    def get_item(self, Key, **kwargs):
+        item = self.db.get(self.name, Key)
+        return {"Item": item} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        self.db.put(self.name, Item, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        item = self.db.update(self.name, Key, UpdateExpression, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        return {"Attributes": item} if ReturnValues else {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        self.db.delete(self.name, Key, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        return {}
+
+
+class FakeDynamoDBResource:
+    def __init__(self, db):
+        self.db = db
+        self.meta = type("Meta", (), {"client": db})()
+
+    def Table(self, name):
+        return FakeTable(self.db, name)
+
+
+# --- Bedrock ----------------------------------------------------------------
+
+GMAIL_LINK_PATTERN = re.compile(r"https://mail-settings\.google\.com/mail/vf-\S+")
+GMAIL_EMAIL_PATTERN = re.compile(r"([\w.+-]+@[\w.-]+) has requested to automatically forward")
+EMAIL_BLOCK_PATTERN = re.compile(r'<email id="([^"]+)">(.*?)</email>', re.DOTALL)
+IMPORTANT_WORDS = ("urgent", "meeting", "tonight", "asap", "outage", "reply", "please")
+URGENT_WORDS = ("urgent", "asap", "outage")
+# Emails that are important only because of these words get a low confidence
+WEAK_WORDS = ("reply", "please")
+
+
+class FakeBedrock:
+    """Deterministic Bedrock runtime with configurable latency.
+
+    Emails mentioning one of IMPORTANT_WORDS are worth reading; Gmail
+    forwarding confirmations have their link extracted. Verdicts resting on
+    WEAK_WORDS alone come back with a confidence below the classifier's
+    default threshold, so a fast tier escalates them. System blocks marked
+    with cache_control are reported as prompt cache writes the first time
+    a model sees them and as cache reads after that, provided the cached
+    prefix reaches the model's minimum; shorter prefixes are not cached,
+    as on Bedrock.
+    """
+
+    # Minimum cacheable prefix in tokens, by model family
+    MIN_CACHED_TOKENS = {"haiku": 2048}
+    DEFAULT_MIN_CACHED_TOKENS = 1024
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.calls = collections.Counter()
+        self.prompt_cache = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def verdict(text):
+        link = GMAIL_LINK_PATTERN.search(text)
+        requester = GMAIL_EMAIL_PATTERN.search(text)
+        matched = {word for word in IMPORTANT_WORDS if word in text.lower()}
+        important = bool(matched)
+        weak = important and matched <= set(WEAK_WORDS)
+        return {
+            "worth_reading": bool(important and not link),
+            "email": requester.group(1) if requester and link else None,
+            "gmail_forward_confirm_link": link.group(0) if link else None,
+            "reason": "You received an email that looks important." if important else "You received a routine email.",
+            "urgent": any(word in text.lower() for word in URGENT_WORDS),
+            "confidence": 0.6 if weak and not link else 0.95 if important or link else 0.9,
+        }
+
+    def _answer(self, prompt):
+        blocks = EMAIL_BLOCK_PATTERN.findall(prompt)
+        if blocks:
+            return json.dumps([dict(self.verdict(text), id=email_id) for email_id, text in blocks])
+        email_part = prompt.rsplit("Here is the email:", 1)[-1]
+        return json.dumps(self.verdict(email_part))
+
+    @staticmethod
+    def _prompt_text(payload):
+        parts = []
+        for block in payload.get("system", []) if isinstance(payload.get("system"), list) else [{"text": payload.get("system", "")}]:
+            parts.append(block.get("text", ""))
+        for message in payload["messages"]:
+            content = message["content"]
+            if isinstance(content, str):
+                parts.append(content)
+            else:
+                parts.extend(block.get("text", "") for block in content)
+        return "\n".join(parts)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        payload = json.loads(body)
+        prompt = self._prompt_text(payload)
+        with self._lock:
+            self.calls[modelId] += 1
+        time.sleep(self.latency_seconds)
+        text = self._answer(prompt)
+        response = {
+            "content": [{"type": "text", "text": text}],
+            "usage": dict(
+                self._cache_usage(modelId, payload, len(prompt) // 4),
+                output_tokens=len(text) // 4,
+            ),
+            "stop_reason": "end_turn",
+        }
+        return {"body": StreamingBody(json.dumps(response).encode("utf-8"))}
+
+    def _cache_usage(self, model_id, payload, input_tokens):
+        """Split input tokens into uncached, cache-read and cache-written ones."""
+        system = payload.get("system")
+        if not isinstance(system, list) or not any("cache_control" in b for b in system):
+            return {"input_tokens": input_tokens}
+        last = max(i for i, b in enumerate(system) if "cache_control" in b)
+        prefix = "\n".join(b.get("text", "") for b in system[: last + 1])
+        cached = len(prefix) // 4
+        minimum = next(
+            (tokens for family, tokens in self.MIN_CACHED_TOKENS.items() if family in model_id.lower()),
+            self.DEFAULT_MIN_CACHED_TOKENS,
+        )
+        if cached < minimum:
+            return {"input_tokens": input_tokens}
+        with self._lock:
+            hit = (model_id, prefix) in self.prompt_cache
+            self.prompt_cache.add((model_id, prefix))
+        return {
+            "input_tokens": input_tokens - cached,
+            "cache_read_input_tokens": cached if hit else 0,
+            "cache_creation_input_tokens": 0 if hit else cached,
+        }
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        response = json.loads(self.invoke_model(modelId, body)["body"].read())
+        text = response["content"][0]["text"]
+
+        def events():
+            usage = {k: v for k, v in response["usage"].items() if k != "output_tokens"}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start", "message": {"usage": usage}}).encode()}}
+            for start in range(0, len(text), 16):
+                delta = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": text[start : start + 16]}}
+                yield {"chunk": {"bytes": json.dumps(delta).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_delta", "usage": {"output_tokens": response["usage"]["output_tokens"]}}).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_stop"}).encode()}}
+
+        return {"body": events()}
+
+
+# --- AWS entry points -------------------------------------------------------
+
+
+class FakeAWS:
+    """Hands out the fakes in place of boto3.client / boto3.resource."""
+
+    def __init__(self, bedrock_latency_seconds=0.0):
+        self.s3 = FakeS3()
+        self.sqs = FakeSQS()
+        self.dynamodb = FakeDynamoDB()
+        self.bedrock = FakeBedrock(bedrock_latency_seconds)
+
+    def client(self, service, *args, **kwargs):
+        return {
+            "s3": self.s3,
+            "sqs": self.sqs,
+            "dynamodb": self.dynamodb,
+            "bedrock-runtime": self.bedrock,
+        }[service]
+
+    def resource(self, service, *args, **kwargs):
+        assert service == "dynamodb"
+        return FakeDynamoDBResource(self.dynamodb)
+
+    def session(self, *args, **kwargs):
+        aws = self
+
+        class Session:
+            def client(self, service, *a, **k):
+                return aws.client(service)
+
+            def resource(self, service, *a, **k):
+                return aws.resource(service)
+
+        return Session()
+
+
+# --- HTTP endpoints (Telegram and Gmail) ------------------------------------
+
+
+class FakeHTTPServer:
+    """Local HTTP server standing in for the Telegram Bot API and Gmail.
+
+    Telegram: POST /bot<token>/sendMessage records the message.
+    Gmail:    POST /mail/vf-ok confirms, /mail/vf-redirect-N follows N
+              redirects, /mail/vf-slow-S sleeps S seconds, /mail/vf-fail-CODE
+              returns CODE.
+    """
+
+    def __init__(self, telegram_latency_seconds=0.0, rate_limit_every=0):
+        self.telegram_latency_seconds = telegram_latency_seconds
+        self.rate_limit_every = rate_limit_every
+        self.messages = []
+        self.confirmations = []
+        self._lock = threading.Lock()
+        self._requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload=None, headers=None):
+                body = json.dumps(payload or {}).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode("utf-8")
+                if "/sendMessage" in self.path:
+                    server._telegram(self, raw)
+                elif self.path.startswith("/mail/"):
+                    server._gmail(self)
+                else:
+                    self._reply(404)
+
+            do_GET = do_POST
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+
+    def _telegram(self, handler, raw):
+        from urllib.parse import parse_qs
+
+        fields = {k: v[0] for k, v in parse_qs(raw).items()} if raw and not raw.startswith("{") else json.loads(raw or "{}")
+        with self._lock:
+            self._requests += 1
+            limited = self.rate_limit_every and self._requests % self.rate_limit_every == 0
+        if limited:
+            handler._reply(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}})
+            return
+        time.sleep(self.telegram_latency_seconds)
+        with self._lock:
+            self.messages.append((fields.get("chat_id"), fields.get("text"), time.time()))
+        handler._reply(200, {"ok": True, "result": {"message_id": len(self.messages)}})
+
+    def _gmail(self, handler):
+        path = handler.path.split("?")[0]
+        match = re.match(r"/mail/vf-(\w+?)(?:-(\d+(?:\.\d+)?))?$", path)
+        kind, arg = (match.group(1), match.group(2)) if match else ("ok", None)
+        if kind == "redirect" and arg and int(arg) > 0:
+            target = f"/mail/vf-redirect-{int(arg) - 1}" if int(arg) > 1 else "/mail/vf-ok"
+            handler._reply(302, headers={"Location": target})
+            return
+        if kind == "slow":
+            time.sleep(float(arg or 1))
+        if kind == "fail":
+            handler._reply(int(arg or 500), {"error": "failed"})
+            return
+        with self._lock:
+            self.confirmations.append(path)
+        handler._reply(200, {"confirmed": True})
@@ -0,0 +1,453 @@
+"""Run the whole pipeline in-process against the fakes in fakes.py.
+
+Each Lambda is imported from src/lambda/<name>/handler.py with boto3 patched
+to hand out the in-memory services, and with its own environment variables
+set the way terraform/lambda.tf sets them. Every SQS-triggered stage gets a
+poller thread that behaves like an event source mapping: it receives up to
+a batch of records, invokes the handler, and puts reported batchItemFailures
+(or the whole batch, if the handler raised) back on the queue.
+"""
+
+import collections
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import ExitStack
+from unittest import mock
+
+import boto3
+import requests
+
+from fakes import FakeAWS, FakeHTTPServer, FakeSQS, s3_event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "src", "lambda")
+SHARED_DIR = os.path.join(ROOT, "src", "shared")
+
+RAW_BUCKET = "needl-email-inbox"
+SANITIZED_BUCKET = "needl-email-sanitized"
+BOT_TOKEN = "bench-bot-token"
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+# With the fast tier on, the current model becomes the fast tier under a larger one
+TIERED_MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+# Queues, named after terraform/sqs.tf
+INBOX_QUEUE = FakeSQS.url("needl-raw")
+SANITIZED_QUEUE = FakeSQS.url("needl-sanitized")
+CHAT_QUEUE = FakeSQS.url("needl-chat")
+NOTIFY_QUEUE = FakeSQS.url("needl-notify")
+GMAIL_QUEUE = FakeSQS.url("needl-url-visitor")
+UPDATES_QUEUE = FakeSQS.url("needl-telegram-updates")
+
+# Records are dropped (as if sent to the queue's DLQ) after this many
+# receives, as sqs_max_receive_count sets in terraform/variables.tf
+MAX_RECEIVES = 3
+
+# Real hosts the handlers call, rewritten to the local fake server
+REWRITTEN_HOSTS = ("https://api.telegram.org", "https://mail-settings.google.com")
+
+
+def lambda_environment(name, **options):
+    """Environment variables for a Lambda, as terraform/lambda.tf sets them."""
+    options = dict(
+        {
+            "chat_history_enabled": False,
+            "inline_classify": False,
+            "classifier_batch_size": 1,
+            "classifier_concurrency": 10,
+            "digest_window_seconds": 0,
+            "fast_tier": False,
+            "stream_responses": False,
+            "prompt_cache": False,
+            "fast_ack": False,
+            "prefilter_mode": "off",
+            "prefilter_model": "",
+        },
+        **options,
+    )
+    env = {
+        "AWS_LAMBDA_FUNCTION_NAME": f"needl-email-{name}",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "REGION": "us-east-1",
+        "USERS_TABLE": "users",
+        "TELEGRAM_TABLE": "telegram",
+        "PENDING_LINKS_TABLE": "pending_links",
+    }
+    env.update(
+        {
+            "sanitizer": {
+                "OUTPUT_S3_BUCKET": SANITIZED_BUCKET,
+                "USER_EMAILS_TABLE": "user_emails",
+                "CLASSIFY_SQS_URL": SANITIZED_QUEUE,
+                "INLINE_CLASSIFY": str(options["inline_classify"]).lower(),
+                "LEDGER_TABLE": "message_ledger",
+            },
+            "classifier": {
+                "BEDROCK_MODEL_ID": TIERED_MODEL_ID if options["fast_tier"] else MODEL_ID,
+                "BEDROCK_FAST_MODEL_ID": MODEL_ID if options["fast_tier"] else "",
+                "BEDROCK_STREAM_RESPONSES": str(options["stream_responses"]).lower(),
+                "BEDROCK_PROMPT_CACHE_MODELS": (
+                    f"{MODEL_ID},{TIERED_MODEL_ID}" if options["prompt_cache"] else ""
+                ),
+                "OUTPUT_SQS_URL": CHAT_QUEUE,
+                "OUTPUT_SQS_URL_GMAIL": GMAIL_QUEUE,
+                "NOTIFY_SQS_URL": NOTIFY_QUEUE,
+                "CHAT_HISTORY_ENABLED": str(options["chat_history_enabled"]).lower(),
+                "CLASSIFIER_CONCURRENCY": str(options["classifier_concurrency"]),
+                "CLASSIFIER_BATCH_SIZE": str(options["classifier_batch_size"]),
+                "CLASSIFICATION_CACHE_TABLE": "classification_cache",
+                "LEDGER_TABLE": "message_ledger",
+                "PREFILTER_MODE": options["prefilter_mode"],
+                "PREFILTER_MODEL_URI": options["prefilter_model"],
+                "PREFILTER_TRAINING_BUCKET": SANITIZED_BUCKET,
+            },
+            "chat": {"OUTPUT_SQS_URL": NOTIFY_QUEUE},
+            "notifier": {
+                "TELEGRAM_BOT_ID": BOT_TOKEN,
+                "LEDGER_TABLE": "message_ledger",
+                "DIGEST_TABLE": "notification_digest",
+                "DIGEST_WINDOW_SECONDS": str(options["digest_window_seconds"]),
+                "NOTIFY_SQS_URL": NOTIFY_QUEUE,
+            },
+            "urlvisitor": {},
+            "webhook": {
+                "OUTPUT_SQS_URL": CHAT_QUEUE,
+                "NOTIFY_SQS_URL": NOTIFY_QUEUE,
+                "CHAT_HISTORY_ENABLED": str(options["chat_history_enabled"]).lower(),
+                "USER_EMAILS_TABLE": "user_emails",
+                "UPDATES_SQS_URL": UPDATES_QUEUE,
+                "WEBHOOK_FAST_ACK": str(options["fast_ack"]).lower(),
+                "LEDGER_TABLE": "message_ledger",
+            },
+        }[name]
+    )
+    return env
+
+
+class Context:
+    """Stand-in for the Lambda context object."""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.memory_limit_in_mb = 128
+        self._deadline = time.monotonic() + 900
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+class Stage:
+    """An SQS-triggered Lambda and the queue feeding it.
+
+    lambda_name is the Lambda's directory under src/lambda, when the stage
+    is named differently from it.
+    """
+
+    def __init__(self, name, queue_url, batch_size, lambda_name=None):
+        self.name = name
+        self.queue_url = queue_url
+        self.batch_size = batch_size
+        self.lambda_name = lambda_name or name
+        self.handler = None
+
+
+class Pipeline:
+    """The six Lambdas wired together through the in-memory services.
+
+    Use as a context manager; options map to the Lambdas' environment
+    variables, and env_overrides sets further ones per Lambda name.
+    """
+
+    def __init__(
+        self,
+        bedrock_latency_seconds=0.05,
+        telegram_latency_seconds=0.01,
+        chat_history_enabled=False,
+        inline_classify=False,
+        classifier_batch_size=1,
+        classifier_concurrency=10,
+        digest_window_seconds=0,
+        fast_tier=False,
+        stream_responses=False,
+        prompt_cache=False,
+        fast_ack=False,
+        prefilter_mode="off",
+        prefilter_model="",
+        env_overrides=None,
+    ):
+        self.aws = FakeAWS(bedrock_latency_seconds)
+        self.http = FakeHTTPServer(telegram_latency_seconds)
+        self.options = {
+            "chat_history_enabled": chat_history_enabled,
+            "inline_classify": inline_classify,
+            "classifier_batch_size": classifier_batch_size,
+            "classifier_concurrency": classifier_concurrency,
+            "digest_window_seconds": digest_window_seconds,
+            "fast_tier": fast_tier,
+            "stream_responses": stream_responses,
+            "prompt_cache": prompt_cache,
+            "fast_ack": fast_ack,
+            "prefilter_mode": prefilter_mode,
+            "prefilter_model": prefilter_model,
+        }
+        self.env_overrides = env_overrides or {}
+        self.stages = {
+            "sanitizer": Stage("sanitizer", INBOX_QUEUE, 10),
+            "classifier": Stage("classifier", SANITIZED_QUEUE, 10),
+            "chat": Stage("chat", CHAT_QUEUE, 10),
+            "notifier": Stage("notifier", NOTIFY_QUEUE, 10),
+            "urlvisitor": Stage("urlvisitor", GMAIL_QUEUE, 10),
+            # The webhook's own queue of Telegram updates, used in fast-ack mode
+            "updates": Stage("updates", UPDATES_QUEUE, 10, lambda_name="webhook"),
+        }
+        self.webhook = None
+        self.timings = collections.defaultdict(list)  # stage -> [(seconds, records)]
+        self.allocations = collections.defaultdict(list)  # stage -> [(bytes, records)]
+        # stage -> metric name -> values, from the handlers' EMF records
+        self.metrics = collections.defaultdict(lambda: collections.defaultdict(list))
+        self.metric_units = {}
+        self.dead_letters = collections.Counter()
+        self.redeliveries = collections.Counter()
+        self._receives = collections.Counter()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._exit = ExitStack()
+
+    # Setup
+
+    def __enter__(self):
+        self._exit.enter_context(self.http)
+        self._patch()
+        self._create_resources()
+        for name, stage in self.stages.items():
+            stage.handler = self.load(stage.lambda_name, name)
+        self.webhook = self.load("webhook")
+        # Handlers set the root logger to INFO at import; keep the run quiet
+        logging.getLogger().setLevel(logging.WARNING)
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        self._exit.close()
+
+    def _patch(self):
+        self._exit.enter_context(mock.patch.object(boto3, "client", self.aws.client))
+        self._exit.enter_context(mock.patch.object(boto3, "resource", self.aws.resource))
+        self._exit.enter_context(
+            mock.patch.object(boto3.session, "Session", self.aws.session)
+        )
+
+        original = requests.Session.request
+        local_url = self.http.url
+
+        def request(session, method, url, *args, **kwargs):
+            for host in REWRITTEN_HOSTS:
+                if url.startswith(host):
+                    url = local_url + url[len(host) :]
+            return original(session, method, url, *args, **kwargs)
+
+        self._exit.enter_context(mock.patch.object(requests.Session, "request", request))
+
+    def _create_resources(self):
+        db = self.aws.dynamodb
+        db.create_table("users", "email")
+        db.create_table("telegram", "telegram_id")
+        db.create_table("pending_links", "link_code")
+        db.create_table(
+            "user_emails",
+            "user_email",
+            "timestamp",
+            indexes={"sender_index": ("user_email", "sender_timestamp")},
+        )
+        db.create_table("classification_cache", "fingerprint")
+        db.create_table("message_ledger", "message_id")
+        db.create_table("notification_digest", "user_email", "item_id")
+
+        def raw_created(bucket, key):
+            self.aws.sqs.send_message(
+                QueueUrl=INBOX_QUEUE, MessageBody=json.dumps(s3_event(bucket, key))
+            )
+
+        def sanitized_created(bucket, key):
+            self.aws.sqs.send_message(
+                QueueUrl=SANITIZED_QUEUE, MessageBody=json.dumps(s3_event(bucket, key))
+            )
+
+        self.aws.s3.on_put(RAW_BUCKET, "", raw_created)
+        self.aws.s3.on_put(SANITIZED_BUCKET, "classify/", sanitized_created)
+
+    def environment(self, name):
+        env = lambda_environment(name, **self.options)
+        env.update(self.env_overrides.get(name, {}))
+        return env
+
+    def load(self, name, label=None):
+        """Import a Lambda's handler module under its own name.
+
+        Lambdas share module names (handler, and whatever they bundle from
+        src/shared), so each is imported with a clean slate and kept under
+        a unique name in sys.modules. Metrics are collected under label,
+        which defaults to the Lambda's name.
+        """
+        label = label or name
+        directory = os.path.join(LAMBDA_DIR, name)
+        local = {f[:-3] for f in os.listdir(directory) if f.endswith(".py")}
+        shared = {f[:-3] for f in os.listdir(SHARED_DIR) if f.endswith(".py")}
+        for module in local | shared:
+            sys.modules.pop(module, None)
+
+        sys.path[:0] = [directory, SHARED_DIR]
+        try:
+            with mock.patch.dict(os.environ, self.environment(name)):
+                module = importlib.import_module("handler")
+        finally:
+            del sys.path[:2]
+        sys.modules[f"bench_{label}_handler"] = sys.modules.pop("handler")
+        module.metrics.sink = lambda line: self._collect_metrics(label, line)
+        return module
+
+    def _collect_metrics(self, name, line):
+        record = json.loads(line)
+        with self._lock:
+            for definition in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+                self.metrics[name][definition["Name"]].extend(record[definition["Name"]])
+                self.metric_units[definition["Name"]] = definition["Unit"]
+
+    def seed_users(self, emails, linked=True):
+        """Create users (with a Telegram chat when linked) for each email."""
+        for n, email in enumerate(sorted(emails)):
+            user = {"email": email}
+            if linked:
+                user["telegram_id"] = str(100000 + n)
+                self.aws.dynamodb.put(
+                    "telegram", {"telegram_id": user["telegram_id"], "user_email": email}
+                )
+            self.aws.dynamodb.put("users", user)
+
+    def seed_link_codes(self, emails) -> dict:
+        """Create unlinked users with a pending /link code each; returns email -> code."""
+        codes = {}
+        for email in emails:
+            codes[email] = uuid.uuid4().hex[:8]
+            self.aws.dynamodb.put("users", {"email": email})
+            self.aws.dynamodb.put("pending_links", {"link_code": codes[email], "user_email": email})
+        return codes
+
+    # Driving the pipeline
+
+    def inject(self, name, raw: bytes):
+        """Deliver a raw email the way SES does, by writing it to the raw bucket."""
+        self.aws.s3.put_object(Bucket=RAW_BUCKET, Key=f"{name}", Body=raw)
+
+    def invoke(self, name, records, trace_allocations=False):
+        """Invoke a stage's handler with records and return its response."""
+        handler = self.stages[name].handler
+        event = {"Records": records}
+        return self._timed(name, handler.lambda_handler, event, len(records), trace_allocations)
+
+    def invoke_webhook(self, update: dict, trace_allocations=False):
+        """Deliver a Telegram update to the webhook's function URL."""
+        event = {"body": json.dumps(update), "requestContext": {"http": {"method": "POST"}}}
+        return self._timed("webhook", self.webhook.lambda_handler, event, 1, trace_allocations)
+
+    def _timed(self, name, fn, event, count, trace_allocations):
+        context = Context(name)
+        if trace_allocations:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            return fn(event, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.timings[name].append((elapsed, count))
+                if trace_allocations:
+                    peak = tracemalloc.get_traced_memory()[1] - baseline
+                    self.allocations[name].append((peak, count))
+
+    def poll(self, name, trace_allocations=False) -> int:
+        """Run one event source mapping cycle for a stage; returns records handled."""
+        stage = self.stages[name]
+        with self._lock:
+            records = self.aws.sqs.receive_records(stage.queue_url, stage.batch_size)
+            if not records:
+                return 0
+            self._in_flight += 1
+        try:
+            try:
+                response = self.invoke(name, records, trace_allocations)
+                failed = {
+                    failure["itemIdentifier"]
+                    for failure in (response or {}).get("batchItemFailures", [])
+                }
+            except Exception:
+                failed = {record["messageId"] for record in records}
+            self._retry(name, [r for r in records if r["messageId"] in failed])
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        return len(records)
+
+    def _retry(self, name, records):
+        retry = []
+        for record in records:
+            self._receives[record["messageId"]] += 1
+            if self._receives[record["messageId"]] >= MAX_RECEIVES:
+                self.dead_letters[name] += 1
+            else:
+                self.redeliveries[name] += 1
+                retry.append(record)
+        self.aws.sqs.requeue(self.stages[name].queue_url, retry)
+
+    def start(self, pollers_per_stage=1):
+        """Start background pollers, one or more per SQS-triggered stage."""
+        for name in self.stages:
+            for _ in range(pollers_per_stage):
+                thread = threading.Thread(target=self._poll_loop, args=(name,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _poll_loop(self, name):
+        while not self._stop.is_set():
+            if not self.poll(name):
+                time.sleep(0.002)
+
+    def idle(self) -> bool:
+        with self._lock:
+            return self._in_flight == 0 and all(
+                self.aws.sqs.depth(stage.queue_url) == 0 for stage in self.stages.values()
+            )
+
+    def drain(self, timeout=600.0, settle=0.05) -> bool:
+        """Wait until every queue is empty and no handler is running."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.idle():
+                time.sleep(settle)
+                if self.idle():
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def run_to_completion(self, trace_allocations=False):
+        """Poll every stage on the calling thread until the pipeline is idle."""
+        while True:
+            handled = sum(self.poll(name, trace_allocations) for name in self.stages)
+            if not handled:
+                return
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
@@ -0,0 +1,100 @@
+"""Compare the classifier's response parser with the regex salvage it replaced.
+
+    python bench/parsers.py
+    python bench/parsers.py --fixtures path/to/responses.jsonl --repeat 200
+
+Each fixture line is {"name", "text", "expect"}, where expect holds the
+fields a correct parse must produce, or null if the text holds no verdict.
+Reported per parser are how many fixtures it parses correctly, the mean
+time per response, and how parse time grows on unbalanced input, which is
+where the old lazy regex backtracks.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from harness import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "src", "lambda", "classifier"))
+
+from verdict import parse_verdict  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "malformed_responses.jsonl")
+
+
+def regex_parse(text):
+    """safe_json_parse as it was before the scanner, for comparison."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        match = re.search(r"\{[^}]*:.*?\}", text, re.DOTALL)
+        if match:
+            fixed_json = re.sub(
+                r"(\"reason\"\s*:\s*)([^\"].*?)([}\n])", r'\1"\2"\3', match.group(0)
+            )
+            return json.loads(fixed_json)
+        raise ValueError("Could not extract valid JSON")
+
+
+PARSERS = {"regex": regex_parse, "scanner": parse_verdict}
+
+
+def correct(parser, fixture):
+    try:
+        result = parser(fixture["text"])
+    except ValueError:
+        return fixture["expect"] is None
+    expect = fixture["expect"]
+    if expect is None or not isinstance(result, dict):
+        return False
+    return all(result.get(field) == value for field, value in expect.items())
+
+
+def mean_micros(parser, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            parser(text)
+        except ValueError:
+            pass
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--verbose", action="store_true", help="list each fixture's outcome")
+    args = parser.parse_args()
+
+    with open(args.fixtures) as f:
+        fixtures = [json.loads(line) for line in f if line.strip()]
+
+    print(f"{'parser':<10}{'correct':>10}{'mean us':>10}{'max us':>10}")
+    for name, fn in PARSERS.items():
+        results = [correct(fn, fixture) for fixture in fixtures]
+        timings = [mean_micros(fn, fixture["text"], args.repeat) for fixture in fixtures]
+        print(
+            f"{name:<10}{sum(results):>5}/{len(fixtures):<4}"
+            f"{sum(timings) / len(timings):>10.1f}{max(timings):>10.1f}"
+        )
+        if args.verbose:
+            for fixture, ok in zip(fixtures, results):
+                print(f"  {'ok ' if ok else 'BAD'} {fixture['name']}")
+
+    print(f"\nUnbalanced input ('{{' followed by n colons), ms per parse:")
+    print(f"{'n':>8}" + "".join(f"{name:>10}" for name in PARSERS))
+    for n in (1000, 4000, 16000):
+        text = "{" + ":" * n
+        print(
+            f"{n:>8}"
+            + "".join(f"{mean_micros(fn, text, 3) / 1000:>10.2f}" for fn in PARSERS.values())
+        )
+
+
+if __name__ == "__main__":
+    main()
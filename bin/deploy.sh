@@ -45,6 +45,9 @@ fi
 
 echo "Packaging Lambdas..."
 
+# Modules shared by all Lambdas; copied into every package
+SHARED_FOLDER="src/shared"
+
 # Docker-based packaging
 package_lambda() {
     local lambda_folder=$1
@@ -56,7 +59,7 @@ package_lambda() {
 
     # Compute hash of source files
     local current_hash
-    current_hash=$(find "$lambda_folder" -type f \( -name "*.py" -o -name "requirements.txt" \) -exec sha256sum {} \; | sha256sum | awk '{print $1}')
+    current_hash=$(find "$lambda_folder" "$SHARED_FOLDER" -type f \( -name "*.py" -o -name "requirements.txt" \) -exec sha256sum {} \; | sha256sum | awk '{print $1}')
 
     if [ -f "$hash_file" ] && [[ "$current_hash" == "$(cat "$hash_file")" ]]; then
         echo "⏩ No changes in $lambda_name, skipping packaging."
@@ -80,13 +83,14 @@ package_lambda() {
         -f bin/Dockerfile \
         bin
 
-    # Run container to zip the Lambda
+    # Run container to zip the Lambda along with the shared modules
     docker run --rm \
         -v "$(pwd)/build":/build \
         -v "$(realpath ${lambda_folder})":/src \
+        -v "$(realpath ${SHARED_FOLDER})":/shared \
         -w /app/package \
         "lambda-package-${lambda_name}" \
-        bash -c "cp /src/*.py . && zip -r /build/${lambda_name}.zip . > /dev/null"
+        bash -c "cp /shared/*.py /src/*.py . && zip -r /build/${lambda_name}.zip . > /dev/null"
 
     # Save hash for future comparisons
     echo "$current_hash" > "$hash_file"
@@ -1,8 +1,11 @@
 import json
-import boto3
 import logging
 import os
 
+import clients
+from metrics import metrics
+from routing import BatchSender
+
 # Logger setup
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -10,18 +13,19 @@ logger.setLevel(logging.INFO)
 # Environment variables
 SQS_QUEUE_URL = os.environ["OUTPUT_SQS_URL"]
 
-# AWS Clients
-sqs = boto3.client("sqs")
-
-# DynamoDB setup (future use)
-dynamodb = boto3.resource("dynamodb")
+# AWS Clients (built on first use)
+sqs = clients.lazy_client("sqs")
 
 
 def lambda_handler(event, context):
     """Currently, this lambda acts only as a pass-through, forwarding messages directly to SQS.
-    In the future, chat history will be updated in DynamoDB here."""
-    logger.info("Event received: %s", json.dumps(event))
+    In the future, chat history will be updated in DynamoDB here.
+
+    Only deployed in the message path when CHAT_HISTORY_ENABLED is set on the
+    classifier and webhook; otherwise they send straight to the notify queue."""
+    logger.info("Received %d records", len(event.get("Records", [])))
 
+    sender = BatchSender(sqs, SQS_QUEUE_URL)
     for record in event.get("Records", []):
         try:
             message = json.loads(record["body"])
@@ -30,14 +34,14 @@ def lambda_handler(event, context):
 
             logger.info(f"user_email: {user_email}, Text: {text}")
 
-            payload = {
-                "user_email": user_email,
-                "text": text,
-            }
+            # Pass digest fields (sender, urgency) through to the notifier
+            payload = {**message, "user_email": user_email, "text": text}
 
-            sqs.send_message(QueueUrl=SQS_QUEUE_URL, MessageBody=json.dumps(payload))
+            sender.add(json.dumps(payload), record["messageId"])
 
         except Exception as e:
             logger.exception("Error processing record")
 
-    return {"statusCode": 200, "body": "Processing complete"}
+    failures = sender.flush()
+    metrics.flush()
+    return {"batchItemFailures": [{"itemIdentifier": i} for i in failures]}
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+import clients
+
+logger = logging.getLogger()
+
+# Patterns stripped before fingerprinting so that near-identical emails from
+# bulk senders (newsletters, receipts) map to the same cache key
+URL_PATTERN = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r"\b[\w-]{24,}\b")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,:/-]\d+)*")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Only the decision is cached. The model's reason can quote the amounts and
+# card digits that normalize() strips, so hits get a generic reason instead
+CACHED_FIELDS = ("worth_reading", "urgent")
+CACHED_REASONS = {
+    True: "You received an email that looks worth reading.",
+    False: "You received a routine email.",
+}
+
+
+def normalize(text: str) -> str:
+    """Reduce text to a template by removing URLs, tracking tokens and numbers."""
+    text = URL_PATTERN.sub(" ", text.lower())
+    text = TOKEN_PATTERN.sub(" ", text)
+    text = NUMBER_PATTERN.sub("#", text)
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def fingerprint(from_email: str, to_email: str, subject: str, body: str) -> str:
+    """Return a content-addressed cache key for an email.
+
+    The recipient is part of the key, so one user's verdicts are never
+    served for another user's mail.
+    """
+    material = "\n".join(
+        [
+            from_email.strip().lower(),
+            to_email.strip().lower(),
+            normalize(subject),
+            normalize(body),
+        ]
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def cached_verdict(entry: dict) -> dict:
+    """Rebuild a verdict from the cached decision, with a generic reason."""
+    decision = {field: bool(entry.get(field)) for field in CACHED_FIELDS}
+    return dict(
+        decision,
+        email=None,
+        gmail_forward_confirm_link=None,
+        reason=CACHED_REASONS[decision["worth_reading"]],
+    )
+
+
+class ClassificationCache:
+    """Two-tier cache of classification results.
+
+    The first tier is an in-process LRU that survives warm invocations; the
+    second is an optional DynamoDB table shared by all containers. Entries
+    expire after ttl_seconds in both tiers. Only the CACHED_FIELDS of a
+    result are stored; hits are rebuilt by cached_verdict().
+
+    The shared tier uses the shared low-level DynamoDB client, which is safe
+    to call from the classifier's per-invocation worker threads. It is best
+    effort: a table error is logged and treated as a miss, or a skipped write.
+    """
+
+    def __init__(self, table_name=None, max_size=1024, ttl_seconds=86400, client=None):
+        self.table_name = table_name
+        self.client = client or clients.lazy_client("dynamodb")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "local_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "miss_seconds": 0.0,
+        }
+
+    def get(self, key: str) -> dict | None:
+        """Return a cached result, checking the local tier before the shared one."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._counters["local_hits"] += 1
+                return cached_verdict(entry[1])
+            if entry:
+                del self._entries[key]
+
+        if self.table_name:
+            try:
+                item = self.client.get_item(
+                    TableName=self.table_name, Key={"fingerprint": {"S": key}}
+                ).get("Item")
+            except ClientError:
+                logger.exception("Failed to read the classification cache")
+                item = None
+            if item and int(item["expires_at"]["N"]) > now:
+                decision = json.loads(item["result"]["S"])
+                self._store_local(key, decision, int(item["expires_at"]["N"]))
+                with self._lock:
+                    self._counters["shared_hits"] += 1
+                return cached_verdict(decision)
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key: str, result: dict, elapsed: float = 0.0):
+        """Store a result in both tiers; elapsed is the model latency it avoids."""
+        expires_at = int(time.time() + self.ttl_seconds)
+        decision = {field: bool(result.get(field)) for field in CACHED_FIELDS}
+        self._store_local(key, decision, expires_at)
+        with self._lock:
+            self._counters["miss_seconds"] += elapsed
+
+        if self.table_name:
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "fingerprint": {"S": key},
+                        "result": {"S": json.dumps(decision)},
+                        "expires_at": {"N": str(expires_at)},
+                    },
+                )
+            except ClientError:
+                logger.exception("Failed to write the classification cache")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the estimated model time saved."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["size"] = len(self._entries)
+        hits = counters["local_hits"] + counters["shared_hits"]
+        stored = counters["misses"] or 1
+        counters["estimated_seconds_saved"] = round(
+            hits * counters["miss_seconds"] / stored, 3
+        )
+        return counters
+
+    def _store_local(self, key, result, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -1,9 +1,20 @@
 import json
-import boto3
 import logging
 import urllib.parse
 import os
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import clients
+from cache import ClassificationCache, fingerprint
+from ledger import CLASSIFIED, NOTIFIED, Ledger, is_done, stored_classification
+from metrics import metrics, trace_fields
+from prefilter import Prefilter, TrainingLog, featurize
+from routing import BatchSender, NotificationRouter
+from rules import preclassify
+from textbudget import classification_view, estimate_tokens
+from userdir import UserDirectory
+from verdict import ObjectScanner, parse_verdict, parse_verdicts, verdict_from
 
 # Logger
 logger = logging.getLogger()
@@ -12,23 +23,79 @@ logger.setLevel(logging.INFO)
 # Environment variables
 USERS_TABLE = os.environ.get("USERS_TABLE", "users")
 MODEL_ID = os.environ.get("BEDROCK_MODEL_ID")
+FAST_MODEL_ID = os.environ.get("BEDROCK_FAST_MODEL_ID")
+CONFIDENCE_THRESHOLD = float(os.environ.get("CLASSIFIER_CONFIDENCE_THRESHOLD", "0.8"))
+STREAM_RESPONSES = os.environ.get("BEDROCK_STREAM_RESPONSES", "false").lower() == "true"
+PROMPT_CACHE_MODELS = {
+    model_id.strip()
+    for model_id in os.environ.get("BEDROCK_PROMPT_CACHE_MODELS", "").split(",")
+    if model_id.strip()
+}
 SQS_QUEUE_URL = os.environ["OUTPUT_SQS_URL"]
 SQS_QUEUE_URL_GMAIL = os.environ["OUTPUT_SQS_URL_GMAIL"]
+NOTIFY_SQS_URL = os.environ.get("NOTIFY_SQS_URL")
+CHAT_HISTORY_ENABLED = os.environ.get("CHAT_HISTORY_ENABLED", "false").lower() == "true"
 REGION = os.environ["REGION"]
+MAX_CONCURRENCY = int(os.environ.get("CLASSIFIER_CONCURRENCY", "10"))
+CACHE_TABLE = os.environ.get("CLASSIFICATION_CACHE_TABLE")
+CACHE_SIZE = int(os.environ.get("CLASSIFICATION_CACHE_SIZE", "1024"))
+CACHE_TTL_SECONDS = int(os.environ.get("CLASSIFICATION_CACHE_TTL", "86400"))
+BATCH_SIZE = int(os.environ.get("CLASSIFIER_BATCH_SIZE", "1"))
+LEDGER_TABLE = os.environ.get("LEDGER_TABLE")
+PREFILTER_MODE = os.environ.get("PREFILTER_MODE", "off")
+PREFILTER_MODEL_URI = os.environ.get("PREFILTER_MODEL_URI")
+PREFILTER_THRESHOLD = float(os.environ.get("PREFILTER_THRESHOLD", "0.97"))
+TRAINING_BUCKET = os.environ.get("PREFILTER_TRAINING_BUCKET")
+TRAINING_PREFIX = os.environ.get("PREFILTER_TRAINING_PREFIX", "training/prefilter/")
 
 # Constants
 MAX_PROMPT_TOKENS = 4000
 MAX_TOKENS = 512
-
-# AWS Clients
-s3 = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
-bedrock = boto3.client("bedrock-runtime", region_name=REGION)
-sqs = boto3.client("sqs")
-
-users_table = dynamodb.Table(USERS_TABLE)
-
-PROMPT_TEMPLATE = """
+MAX_BATCH_TOKENS = 4096
+MAX_BATCH_BODY_TOKENS = 500
+
+# Bedrock only caches a prompt prefix of at least this many tokens; a
+# checkpoint on a shorter prefix is ignored
+MIN_CACHED_PREFIX_TOKENS = 1024
+MIN_CACHED_PREFIX_TOKENS_HAIKU = 2048
+
+# The fast tier gets a shorter prompt and room for a short JSON answer only
+MAX_FAST_PROMPT_TOKENS = 2000
+FAST_MAX_TOKENS = 160
+
+# Model tiers; when BEDROCK_FAST_MODEL_ID is set, emails go to the fast model
+# first and only reach the primary model if its answer is unusable or unsure
+PRIMARY_TIER = "Primary"
+FAST_TIER = "Fast"
+TIER_MODELS = {PRIMARY_TIER: MODEL_ID, FAST_TIER: FAST_MODEL_ID}
+
+# AWS Clients; each is built on first use, so records decided by the rules
+# or delivered inline never pay for the Bedrock or S3 client
+s3 = clients.lazy_client("s3")
+bedrock = clients.lazy_client("bedrock-runtime", region_name=REGION)
+sqs = clients.lazy_client("sqs")
+
+# Cached users lookups; lives for the lifetime of the warm container
+user_directory = UserDirectory(users_table=USERS_TABLE)
+
+# Classification cache; lives for the lifetime of the warm container
+classification_cache = ClassificationCache(
+    table_name=CACHE_TABLE or None,
+    max_size=CACHE_SIZE,
+    ttl_seconds=CACHE_TTL_SECONDS,
+)
+
+# Per-message stage ledger; holds each email's classification so that
+# redeliveries are answered without the model
+ledger = Ledger(LEDGER_TABLE) if LEDGER_TABLE else None
+
+# Local model trained on past verdicts; loaded once per warm container
+prefilter = Prefilter(PREFILTER_MODE, PREFILTER_MODEL_URI, PREFILTER_THRESHOLD, s3)
+
+# Model verdicts are logged with the email's features to train the prefilter
+training_log = TrainingLog(TRAINING_BUCKET, TRAINING_PREFIX, s3) if TRAINING_BUCKET else None
+
+PROMPT_INSTRUCTIONS = """
 Your job is to classify emails. There are 2 main "types" of emails:
 
 1. From Google / Gmail asking for approval to accept forwarded emails
@@ -40,6 +107,7 @@ The output should be JSON, in the following structure:
   "worth_reading": true | false,
   "email": "some.user@gmail.com",
   "gmail_forward_confirm_link": "<confirmation URL or null>",
+  "urgent": true | false,
   "reason": "Natural, human-sounding explanation — friendly and short, as if texting the user. Start with 'You received an email that...' or something similar."
 }
 
@@ -73,13 +141,58 @@ If you determine that the email is of the second type, please classify it accord
   - Promotional/commercial (advertisements, sales)
   - Automated/low-value (newsletters, notifications)
 
-Here is the email:
+- urgent is true only if a worth_reading email cannot wait an hour or so: time-sensitive
+  alerts, same-day plans, or someone waiting on an immediate reply. Otherwise it is false.
+"""
+
+COMPACT_PROMPT_INSTRUCTIONS = """
+Classify an email for a user who wants to be notified only about mail worth reading.
+Answer with JSON only, no other text:
+
+{"worth_reading": bool, "urgent": bool, "email": str|null, "gmail_forward_confirm_link": str|null, "reason": str, "confidence": number}
 
+- Gmail forwarding confirmation (asks to confirm forwarding, has a mail-settings.google.com link):
+  set gmail_forward_confirm_link to the link, email to the requesting address, worth_reading false.
+- worth_reading true: personal, time-sensitive, actionable, or highly relevant (family, recruiters, children).
+- worth_reading false: receipts, statements, shipping updates, promotions, newsletters, automated mail.
+- urgent true only if it cannot wait an hour or so.
+- reason: one short friendly sentence to the user, starting "You received an email that...".
+- confidence: 0 to 1, how sure you are of worth_reading. Use below 0.8 when unsure.
+"""
+
+EMAIL_TEMPLATE = """
 Subject: {subject}
 From: {from}
 Body: {body}
 """
 
+BATCH_INSTRUCTIONS = """
+You will be given several emails, each wrapped in an <email id="..."> tag. Classify
+each one independently. The output should be a JSON array containing one object per
+email, in the structure above plus an "id" property holding the email's id.
+"""
+
+EMAIL_PROMPT = "Here is the email:\n" + EMAIL_TEMPLATE
+BATCH_PROMPT = "Here are the emails:\n{emails}"
+
+# Prompt templates are (system, user) pairs. The system block holds only the
+# static instructions, identical on every call, so Bedrock can cache it as a
+# prompt prefix; the email is always in the user message after it
+PROMPT_TEMPLATE = (PROMPT_INSTRUCTIONS, EMAIL_PROMPT)
+BATCH_PROMPT_TEMPLATE = (PROMPT_INSTRUCTIONS + BATCH_INSTRUCTIONS, BATCH_PROMPT)
+
+COMPACT_PROMPT_TEMPLATE = (COMPACT_PROMPT_INSTRUCTIONS, EMAIL_PROMPT)
+COMPACT_BATCH_PROMPT_TEMPLATE = (COMPACT_PROMPT_INSTRUCTIONS + BATCH_INSTRUCTIONS, BATCH_PROMPT)
+
+# Usage fields recorded per call, by metric name; the cache fields are only
+# reported by models with prompt caching on
+USAGE_METRICS = (
+    ("InputTokens", "input_tokens"),
+    ("OutputTokens", "output_tokens"),
+    ("CacheReadTokens", "cache_read_input_tokens"),
+    ("CacheWriteTokens", "cache_creation_input_tokens"),
+)
+
 
 def get_s3_record(record):
     """Extract the bucket and key from an SQS-triggered S3 event."""
@@ -96,109 +209,518 @@ def get_s3_record(record):
 def read_json_from_s3(bucket, key):
     """Fetch and parse JSON content from an S3 object."""
     logger.info(f"Reading file from s3://{bucket}/{key}")
-    response = s3.get_object(Bucket=bucket, Key=key)
-    return json.loads(response["Body"].read().decode("utf-8"))
+    with metrics.timer("S3Fetch"):
+        response = s3.get_object(Bucket=bucket, Key=key)
+        return json.loads(response["Body"].read().decode("utf-8"))
+
+
+def read_email_record(record):
+    """Return (key, email_data) for a record, preferring an inline payload.
+
+    The sanitizer embeds the email in the SQS message when it fits; otherwise
+    the record is an S3 event and the email is fetched from S3.
+    """
+    body = json.loads(record["body"])
+    if "inline" in body:
+        email_data = body["inline"]
+        return email_data.get("full_body_key", record.get("messageId")), email_data
+    bucket, key = get_s3_record(record)
+    return key, read_json_from_s3(bucket, key)
 
 
 def lookup_user(email):
     """Retrieve user information from DynamoDB by email."""
-    response = users_table.get_item(Key={"email": email})
-    return response.get("Item")
+    return user_directory.get_user(email)
 
 
-def trim_token_length(text, max_tokens=MAX_PROMPT_TOKENS):
-    """Trim text to fit approximately within token limits."""
-    return text[: max_tokens * 4]  # Roughly 4 characters per token
+def safe_json_parse_batch(text):
+    """Parse a batched answer into a dict of verdicts keyed by email id.
 
+    Items that cannot be recovered are left out so the caller can retry them
+    individually instead of discarding the whole batch.
+    """
+    return {str(item["id"]): item for item in parse_verdicts(text) if "id" in item}
+
+
+def email_fields(email_data):
+    """Return the normalized (from, subject, body) used for classification."""
+    return (
+        email_data.get("from", "").strip().lower(),
+        email_data.get("subject", "").strip(),
+        email_data.get("body", "").strip(),
+    )
 
-def safe_json_parse(text):
-    """Attempt to safely parse JSON, with fallback handling."""
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        match = re.search(r"\{[^}]*:.*?\}", text, re.DOTALL)
-        if match:
-            fixed_json = re.sub(
-                r"(\"reason\"\s*:\s*)([^\"].*?)([}\n])", r'\1"\2"\3', match.group(0)
-            )
-            return json.loads(fixed_json)
-        raise ValueError("Could not extract valid JSON")
 
+def cache_key_for(email_data) -> str:
+    """Return the classification cache key of an email, scoped to its recipient."""
+    from_email, subject, body = email_fields(email_data)
+    return fingerprint(from_email, email_data.get("to", ""), subject, body)
+
+
+def min_cached_prefix_tokens(model_id: str) -> int:
+    """Return the shortest prompt prefix, in tokens, a model will cache."""
+    if "haiku" in model_id.lower():
+        return MIN_CACHED_PREFIX_TOKENS_HAIKU
+    return MIN_CACHED_PREFIX_TOKENS
+
+
+def model_request(prompt, max_tokens, tier):
+    """Build the InvokeModel arguments for a (system, user) prompt.
+
+    For models listed in BEDROCK_PROMPT_CACHE_MODELS the system block is
+    marked as a cache checkpoint, but only when it reaches the model's
+    minimum cacheable length. The current instructions fall short of it
+    for every supported model, so no checkpoint is sent for them.
+    """
+    system, content = prompt
+    model_id = TIER_MODELS[tier]
+    system_block = {"type": "text", "text": system}
+    if (
+        model_id in PROMPT_CACHE_MODELS
+        and estimate_tokens(system) >= min_cached_prefix_tokens(model_id)
+    ):
+        system_block["cache_control"] = {"type": "ephemeral"}
+    return {
+        "modelId": model_id,
+        "contentType": "application/json",
+        "accept": "application/json",
+        "body": json.dumps(
+            {
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": max_tokens,
+                "temperature": 0,
+                "system": [system_block],
+                "messages": [{"role": "user", "content": content}],
+            }
+        ),
+    }
 
-def classify_email(email_data):
-    """Classify email content using an AI model."""
-    from_email = email_data.get("from", "").strip().lower()
-    subject = email_data.get("subject", "").strip()
-    body = email_data.get("body", "").strip()
 
-    prompt = trim_token_length(
-        PROMPT_TEMPLATE.replace("{from}", from_email)
+def record_usage(usage, tier):
+    """Record token usage, including prompt cache reads and writes, overall and per tier."""
+    for name, field in USAGE_METRICS:
+        if field in usage or name in ("InputTokens", "OutputTokens"):
+            metrics.record(f"Bedrock{name}", usage.get(field, 0))
+            metrics.record(f"Bedrock{name}{tier}", usage.get(field, 0))
+
+
+def invoke_model(prompt, max_tokens=MAX_TOKENS, tier=PRIMARY_TIER):
+    """Send a (system, user) prompt to a tier's model and return its text answer.
+
+    Latency and token usage are recorded both overall and per tier.
+    """
+    with metrics.timer("BedrockCall"), metrics.timer(f"BedrockCall{tier}"):
+        response = bedrock.invoke_model(**model_request(prompt, max_tokens, tier))
+        result = json.loads(response["body"].read())
+
+    record_usage(result.get("usage", {}), tier)
+    return result["content"][0]["text"].strip()
+
+
+def stream_verdict(prompt, max_tokens=MAX_TOKENS, tier=PRIMARY_TIER):
+    """Stream a tier's answer and return the first verdict in it.
+
+    Reading stops as soon as the first JSON object closes, so text the model
+    writes after its answer is neither waited for nor paid for in latency.
+    Output tokens are estimated when the stream is cut short, since Bedrock
+    only reports them at the end. Time to the first token is recorded, as
+    that is what a cached prompt prefix shortens.
+    """
+    scanner = ObjectScanner()
+    usage, streamed = {}, []
+    started = time.perf_counter()
+    with metrics.timer("BedrockCall"), metrics.timer(f"BedrockCall{tier}"):
+        response = bedrock.invoke_model_with_response_stream(
+            **model_request(prompt, max_tokens, tier)
+        )
+        stream = response["body"]
+        try:
+            for event in stream:
+                chunk = json.loads(event.get("chunk", {}).get("bytes", b"{}"))
+                if chunk.get("type") == "message_start":
+                    usage.update(chunk["message"].get("usage", {}))
+                elif chunk.get("type") == "message_delta":
+                    usage.update(chunk.get("usage", {}))
+                elif chunk.get("type") == "content_block_delta":
+                    if not streamed:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                        metrics.record("BedrockTimeToFirstToken", first_token_ms, "Milliseconds")
+                        metrics.record(f"BedrockTimeToFirstToken{tier}", first_token_ms, "Milliseconds")
+                    text = chunk["delta"].get("text", "")
+                    streamed.append(text)
+                    if scanner.feed(text):
+                        metrics.record("BedrockStreamStoppedEarly", 1)
+                        break
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+
+    usage.setdefault("output_tokens", estimate_tokens("".join(streamed)))
+    record_usage(usage, tier)
+    return verdict_from(scanner)
+
+
+def ask_model(prompt, max_tokens=MAX_TOKENS, tier=PRIMARY_TIER):
+    """Return the verdict for a single-email prompt, streamed if enabled."""
+    if STREAM_RESPONSES:
+        return stream_verdict(prompt, max_tokens, tier)
+    return parse_verdict(invoke_model(prompt, max_tokens, tier))
+
+
+def cache_result(cache_key, parsed, elapsed):
+    """Cache a model verdict unless it carries a single-use confirmation link."""
+    if not parsed.get("gmail_forward_confirm_link"):
+        classification_cache.put(cache_key, parsed, elapsed)
+
+
+def build_prompt(template, max_prompt_tokens, from_email, subject, body):
+    """Fill a (system, user) template in with an email; returns the pair."""
+    system, user = template
+    # Only the body is trimmed, so the prompt's instructions are never cut
+    body_budget = max_prompt_tokens - estimate_tokens(system + user + from_email + subject)
+    return system, (
+        user.replace("{from}", from_email)
         .replace("{subject}", subject)
-        .replace("{body}", body)
+        .replace("{body}", classification_view(body, body_budget))
     )
 
-    bedrock_payload = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": MAX_TOKENS,
-        "temperature": 0,
-        "messages": [{"role": "user", "content": prompt}],
-    }
 
-    response = bedrock.invoke_model(
-        modelId=MODEL_ID,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(bedrock_payload),
-    )
+def confident(verdict) -> bool:
+    """Whether a fast-tier verdict can be used without escalating."""
+    if not isinstance(verdict, dict) or not isinstance(verdict.get("worth_reading"), bool):
+        return False
+    if verdict.get("gmail_forward_confirm_link"):
+        return True
+    try:
+        return float(verdict.get("confidence", 0)) >= CONFIDENCE_THRESHOLD
+    except (TypeError, ValueError):
+        return False
 
-    result = json.loads(response["body"].read())
-    parsed = safe_json_parse(result["content"][0]["text"].strip())
-    return parsed, subject
 
+def record_escalation(reason):
+    metrics.record("Escalations", 1)
+    metrics.record(f"Escalations{reason}", 1)
 
-def lambda_handler(event, context):
-    """Lambda handler to classify emails and forward important ones."""
-    logger.info("Received event: %s", json.dumps(event))
 
-    for record in event.get("Records", []):
+def classify_email(email_data, escalate=False):
+    """Classify email content using an AI model, consulting the cache first.
+
+    With a fast tier configured, the fast model answers first and the primary
+    model is only asked when that answer fails to parse or is not confident
+    enough. escalate skips straight to the primary model.
+    """
+    from_email, subject, body = email_fields(email_data)
+
+    cache_key = cache_key_for(email_data)
+    cached = classification_cache.get(cache_key)
+    if cached is not None:
+        return cached, subject
+
+    started = time.perf_counter()
+    if FAST_MODEL_ID and not escalate:
+        prompt = build_prompt(
+            COMPACT_PROMPT_TEMPLATE, MAX_FAST_PROMPT_TOKENS, from_email, subject, body
+        )
+        try:
+            parsed = ask_model(prompt, FAST_MAX_TOKENS, FAST_TIER)
+        except ValueError:
+            record_escalation("ParseFailure")
+        else:
+            if confident(parsed):
+                metrics.record("FastTierAccepted", 1)
+                cache_result(cache_key, parsed, time.perf_counter() - started)
+                return parsed, subject
+            record_escalation("LowConfidence")
+
+    prompt = build_prompt(PROMPT_TEMPLATE, MAX_PROMPT_TOKENS, from_email, subject, body)
+    parsed = ask_model(prompt)
+    cache_result(cache_key, parsed, time.perf_counter() - started)
+    return parsed, subject
+
+
+def classify_batch(emails):
+    """Classify several emails with a single model call.
+
+    Cached emails are answered without the model, and any email missing from
+    the batched answer falls back to classify_email. With a fast tier, the
+    batch goes to the fast model and unsure answers are escalated one by one
+    to the primary model. Returns a list of results,
+    each either a parsed verdict or the exception raised while classifying it.
+    """
+    results = [None] * len(emails)
+    misses = []
+    for i, email_data in enumerate(emails):
+        cache_key = cache_key_for(email_data)
+        cached = classification_cache.get(cache_key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            misses.append((i, cache_key))
+
+    verdicts, elapsed = {}, 0.0
+    if len(misses) > 1:
+        blocks = []
+        for n, (i, _) in enumerate(misses, start=1):
+            from_email, subject, body = email_fields(emails[i])
+            email_text = (
+                EMAIL_TEMPLATE.replace("{from}", from_email)
+                .replace("{subject}", subject)
+                .replace("{body}", classification_view(body, MAX_BATCH_BODY_TOKENS))
+            )
+            blocks.append(f'<email id="{n}">{email_text}</email>')
+
+        started = time.perf_counter()
+        if FAST_MODEL_ID:
+            template, tier, per_email = COMPACT_BATCH_PROMPT_TEMPLATE, FAST_TIER, FAST_MAX_TOKENS
+        else:
+            template, tier, per_email = BATCH_PROMPT_TEMPLATE, PRIMARY_TIER, MAX_TOKENS
+        system, user = template
+        prompt = (system, user.replace("{emails}", "\n".join(blocks)))
+        max_tokens = min(per_email * len(misses), MAX_BATCH_TOKENS)
+        try:
+            verdicts = safe_json_parse_batch(invoke_model(prompt, max_tokens, tier))
+        except Exception:
+            logger.exception("Batched classification failed; falling back")
+        elapsed = (time.perf_counter() - started) / len(misses)
+
+    for n, (i, cache_key) in enumerate(misses, start=1):
+        verdict = verdicts.get(str(n))
+        escalate = False
+        if verdict is not None and FAST_MODEL_ID:
+            if confident(verdict):
+                metrics.record("FastTierAccepted", 1)
+            else:
+                record_escalation("LowConfidence")
+                verdict, escalate = None, True
+        if verdict is not None:
+            verdict.pop("id", None)
+            cache_result(cache_key, verdict, elapsed)
+            results[i] = verdict
+            continue
         try:
-            bucket, key = get_s3_record(record)
-            email_data = read_json_from_s3(bucket, key)
-
-            # Sanity check; all received emails should always have a "to" address
-            user_email = email_data.get("to", "").strip().lower()
-            if not user_email:
-                logger.warning("Missing 'to' email in %s", key)
-                continue
-
-            # Classify
-            parsed_result, subject = classify_email(email_data)
-            
-            # First check if its a Gmail forward request
-            confirm_link = parsed_result.get("gmail_forward_confirm_link")
-            if confirm_link:
-                user_email = parsed_result.get("email")
-                message_body = json.dumps({"email": user_email, "url": confirm_link})
-                sqs.send_message(
-                    QueueUrl=SQS_QUEUE_URL_GMAIL,
-                    MessageBody=message_body
-                )
-                logger.info(f"Found gmail confirmation link: {message_body}")
-                return
-            
-            # Check if there is a record in the "users" table for the "to" address
-            user = lookup_user(user_email)
-
-            # Send positive classifications to SQS; no-op otherwise
-            if user and parsed_result.get("worth_reading"):
-                reason = parsed_result["reason"]
-                text = f"{subject}\n\n{reason}"
-                sqs.send_message(
-                    QueueUrl=SQS_QUEUE_URL,
-                    MessageBody=json.dumps({"user_email": user_email, "text": text}),
-                )
+            results[i] = classify_email(emails[i], escalate)[0]
+        except Exception as e:
+            results[i] = e
+
+    return results
+
+
+def load_record(record):
+    """Fetch a record's email and build its work item.
+
+    Returns None if the record has nothing to classify.
+    """
+    key, email_data = read_email_record(record)
+
+    # Sanity check; all received emails should always have a "to" address
+    user_email = email_data.get("to", "").strip().lower()
+    if not user_email:
+        logger.warning("Missing 'to' email in %s", key)
+        return None
+
+    return {
+        "record": record,
+        "key": key,
+        "email_data": email_data,
+        "user_email": user_email,
+        "user": None,
+        "subject": email_data.get("subject", "").strip(),
+        "correlation_id": email_data.get("correlation_id"),
+        "result": None,
+        "replayed": False,
+        "features": None,
+        "prefilter_score": None,
+    }
+
 
+def recall(items):
+    """Apply the ledger to redelivered items.
+
+    Items already notified are dropped, and items already classified take
+    their recorded result instead of being classified again.
+    """
+    entries = ledger.get_many(item["correlation_id"] for item in items)
+    remaining = []
+    for item in items:
+        entry = entries.get(item["correlation_id"])
+        if is_done(entry, NOTIFIED):
+            logger.info("Skipping %s; already notified", item["correlation_id"])
+            continue
+        stored = stored_classification(entry)
+        if stored is not None:
+            logger.info("Replaying recorded classification for %s", item["correlation_id"])
+            item["result"], item["replayed"] = stored, True
+        remaining.append(item)
+    return remaining
+
+
+def record_classification(item):
+    """Store a new classification in the ledger."""
+    ledger.complete(item["correlation_id"], CLASSIFIED, classification=item["result"])
+
+
+def apply_rules(item):
+    """Look up the item's user and decide obvious cases without the model.
+
+    Items replayed from the ledger keep their recorded result.
+    """
+    # Check if there is a record in the "users" table for the "to" address
+    item["user"] = lookup_user(item["user_email"])
+    if item["result"] is not None:
+        return
+
+    preclassified = preclassify(item["email_data"], item["user"])
+    if preclassified:
+        item["result"], rule = preclassified
+        logger.info("Pre-classified %s by rule %s", item["key"], rule)
+
+
+def apply_prefilter(item):
+    """Score an item with the local model, deciding it if confident enough."""
+    item["features"] = featurize(item["email_data"])
+    item["prefilter_score"] = prefilter.score(item["features"])
+    decided = prefilter.decide(item["prefilter_score"])
+    if decided:
+        logger.info("Prefilter decided %s (%.3f)", item["key"], item["prefilter_score"])
+        item["result"] = decided
+
+
+def learn_from(item):
+    """Compare a model verdict with the prefilter and log it for training."""
+    prefilter.compare(item["prefilter_score"], item["result"])
+    if training_log:
+        training_log.add(item["features"], item["result"])
+
+
+def classify_items(items):
+    """Classify work items with one model call, setting each item's result."""
+    results = classify_batch([item["email_data"] for item in items])
+    for item, result in zip(items, results):
+        item["result"] = result
+
+
+def route_result(item, notifications, gmail_confirmations):
+    """Queue a classified item for the Gmail or notification senders."""
+    parsed_result = item["result"]
+    user_email = item["user_email"]
+    message_id = item["record"]["messageId"]
+    trace = trace_fields(item["email_data"])
+
+    # First check if its a Gmail forward request
+    confirm_link = parsed_result.get("gmail_forward_confirm_link")
+    if confirm_link:
+        user_email = parsed_result.get("email")
+        message_body = json.dumps({"email": user_email, "url": confirm_link, **trace})
+        gmail_confirmations.add(message_body, message_id)
+        logger.info(f"Found gmail confirmation link: {message_body}")
+        return
+
+    # Send positive classifications to SQS; no-op otherwise
+    if item["user"] and parsed_result.get("worth_reading"):
+        reason = parsed_result["reason"]
+        text = f"{item['subject']}\n\n{reason}"
+        email_data = item["email_data"]
+        # Sender, subject and urgency let the notifier merge non-urgent
+        # notifications into a digest
+        notification = {
+            "user_email": user_email,
+            "text": text,
+            "sender": email_data.get("display_name") or email_data.get("from", ""),
+            "subject": item["subject"],
+            "reason": reason,
+            "urgent": bool(parsed_result.get("urgent")),
+            **trace,
+        }
+        notifications.add(json.dumps(notification), message_id)
+
+
+def run_stage(executor, fn, args, failures):
+    """Run fn over args concurrently and return (arg, result) for successes.
+
+    Each arg is a work item or list of items carrying the SQS record; records
+    whose stage raised are added to failures.
+    """
+    futures = [(arg, executor.submit(fn, arg)) for arg in args]
+    completed = []
+    for arg, future in futures:
+        try:
+            completed.append((arg, future.result()))
         except Exception:
-            logger.exception("Error processing record")
+            for item in arg if isinstance(arg, list) else [arg]:
+                record = item.get("record", item)
+                logger.exception("Error processing record %s", record.get("messageId"))
+                failures.append({"itemIdentifier": record["messageId"]})
+    return completed
+
 
-    return {"statusCode": 200, "body": "Processing complete"}
+def lambda_handler(event, context):
+    """Lambda handler to classify emails and forward important ones.
+
+    Records are processed concurrently, bounded by CLASSIFIER_CONCURRENCY (set
+    it to 1 for sequential processing). Emails that need the model are packed
+    into requests of up to CLASSIFIER_BATCH_SIZE emails, after the prefilter
+    has answered those it is sure of (PREFILTER_MODE). Failed records are
+    reported as SQS batchItemFailures so only those are redelivered.
+    """
+    records = event.get("Records", [])
+    logger.info("Received %d records", len(records))
+
+    failures = []
+    if not records:
+        return {"batchItemFailures": failures}
+
+    workers = max(1, min(MAX_CONCURRENCY, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        loaded = run_stage(executor, load_record, records, failures)
+        items = [item for _, item in loaded if item]
+        if ledger:
+            items = recall(items)
+
+        # Load every recipient in the batch with one BatchGetItem
+        try:
+            user_directory.prefetch(item["user_email"] for item in items)
+        except Exception:
+            logger.exception("Failed to prefetch users; falling back to lookups")
+        items = [item for item, _ in run_stage(executor, apply_rules, items, failures)]
+
+        pending = [item for item in items if item["result"] is None]
+        if prefilter.mode != "off" or training_log:
+            for item in pending:
+                apply_prefilter(item)
+            pending = [item for item in pending if item["result"] is None]
+        chunk_size = max(1, BATCH_SIZE)
+        chunks = [pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        run_stage(executor, classify_items, chunks, failures)
+        for item in pending:
+            if item["features"] is not None and isinstance(item["result"], dict):
+                learn_from(item)
+
+        classified = []
+        for item in items:
+            if isinstance(item["result"], Exception):
+                logger.error("Error classifying %s: %s", item["key"], item["result"])
+                failures.append({"itemIdentifier": item["record"]["messageId"]})
+            elif item["result"] is not None:
+                classified.append(item)
+
+        if ledger:
+            new = [i for i in classified if i["correlation_id"] and not i["replayed"]]
+            run_stage(executor, record_classification, new, [])
+
+    # Outgoing messages are sent in batches of up to 10 per queue
+    notifications = NotificationRouter(
+        sqs, SQS_QUEUE_URL, NOTIFY_SQS_URL, CHAT_HISTORY_ENABLED
+    )
+    gmail_confirmations = BatchSender(sqs, SQS_QUEUE_URL_GMAIL)
+    for item in classified:
+        route_result(item, notifications, gmail_confirmations)
+    for message_id in notifications.flush() + gmail_confirmations.flush():
+        failures.append({"itemIdentifier": message_id})
+
+    if training_log:
+        training_log.flush()
+
+    logger.info("Classification cache stats: %s", classification_cache.stats())
+    metrics.flush()
+    return {"batchItemFailures": failures}
@@ -0,0 +1,246 @@
+import gzip
+import io
+import json
+import logging
+import math
+import re
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+from metrics import metrics
+
+logger = logging.getLogger()
+
+# Bump when featurize() changes; examples and models of other versions are ignored
+FEATURE_VERSION = 1
+FEATURE_BITS = 18
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9'_-]{1,23}")
+MAX_SUBJECT_TOKENS = 40
+MAX_BODY_TOKENS = 400
+
+# Headers whose presence (or value) says something about how mail was sent
+HEADER_FLAGS = ("list-id", "list-unsubscribe", "auto-submitted")
+
+# Artifacts start with this line, followed by a JSON header line and the weights
+ARTIFACT_MAGIC = b"needl-prefilter\n"
+
+MODES = ("off", "shadow", "enforce")
+
+
+def feature_index(name: str) -> int:
+    """Hash a feature name into the weight vector; stable across processes."""
+    return zlib.crc32(name.encode("utf-8")) & ((1 << FEATURE_BITS) - 1)
+
+
+def feature_names(email_data: dict) -> set[str]:
+    """Sparse features of an email: sender, header flags and hashed words."""
+    sender = email_data.get("from", "").strip().lower()
+    local, _, domain = sender.rpartition("@")
+    subject = email_data.get("subject", "").strip().lower()
+    body = email_data.get("body", "").lower()
+    headers = {k.lower(): v for k, v in email_data.get("headers", {}).items()}
+
+    names = {f"d:{domain}", f"tld:{domain.rsplit('.', 1)[-1]}"}
+    if re.search(r"no-?reply|notifications?|mailer|alerts?|news", local):
+        names.add("sender:automated")
+    if email_data.get("display_name"):
+        names.add("sender:named")
+    for header in HEADER_FLAGS:
+        if headers.get(header):
+            names.add(f"h:{header}")
+    if headers.get("precedence"):
+        names.add(f"h:precedence={headers['precedence'].strip().lower()}")
+    if re.match(r"(re|fwd?):", subject):
+        names.add("s:reply")
+    if "?" in subject:
+        names.add("s:question")
+    names.add(f"len:{min(len(body).bit_length(), 16)}")
+
+    for n, match in enumerate(TOKEN_PATTERN.finditer(subject)):
+        if n == MAX_SUBJECT_TOKENS:
+            break
+        names.add(f"s:{match.group()}")
+    for n, match in enumerate(TOKEN_PATTERN.finditer(body)):
+        if n == MAX_BODY_TOKENS:
+            break
+        names.add(f"b:{match.group()}")
+    return names
+
+
+def featurize(email_data: dict) -> list[int]:
+    return sorted({feature_index(name) for name in feature_names(email_data)})
+
+
+class PrefilterModel:
+    """Hashed bag-of-words logistic regression over featurize() indices.
+
+    Scoring is a sum of looked-up weights, so it needs no NumPy at runtime;
+    the trainer (tools/train_prefilter.py) writes the weights as float32.
+    """
+
+    def __init__(self, weights: array, bias: float, info: dict):
+        self.weights = weights
+        self.bias = bias
+        self.info = info
+
+    @classmethod
+    def loads(cls, data: bytes) -> "PrefilterModel":
+        raw = gzip.decompress(data)
+        if not raw.startswith(ARTIFACT_MAGIC):
+            raise ValueError("Not a prefilter model")
+        header_end = raw.index(b"\n", len(ARTIFACT_MAGIC))
+        info = json.loads(raw[len(ARTIFACT_MAGIC) : header_end])
+        if info.get("feature_version") != FEATURE_VERSION or info.get("feature_bits") != FEATURE_BITS:
+            raise ValueError(f"Model was trained on other features: {info}")
+        weights = array("f")
+        weights.frombytes(raw[header_end + 1 :])
+        if len(weights) != 1 << FEATURE_BITS:
+            raise ValueError("Model has the wrong number of weights")
+        return cls(weights, float(info["bias"]), info)
+
+    def predict(self, indices: list[int]) -> float:
+        """Probability that an email is worth reading."""
+        weights = self.weights
+        z = self.bias + sum(weights[i] for i in indices)
+        return 1 / (1 + math.exp(-max(min(z, 30.0), -30.0)))
+
+
+def dumps_model(weights: bytes, bias: float, info: dict) -> bytes:
+    """Serialize float32 weights and metadata as a prefilter artifact."""
+    header = dict(info, bias=bias, feature_version=FEATURE_VERSION, feature_bits=FEATURE_BITS)
+    return gzip.compress(ARTIFACT_MAGIC + json.dumps(header).encode("utf-8") + b"\n" + weights)
+
+
+class Prefilter:
+    """Answer confident emails locally and learn from the model's verdicts.
+
+    In "shadow" mode every prediction is compared with the verdict Bedrock
+    gives, and agreement is recorded as metrics; in "enforce" mode emails
+    scored at or beyond threshold (either way) are decided without Bedrock.
+    The model is fetched on first use, once per warm container, from an
+    s3://bucket/key URI or a local path; if it cannot be loaded the
+    prefilter stays out of the way.
+    """
+
+    def __init__(self, mode, model_uri, threshold, s3):
+        if mode not in MODES:
+            raise ValueError(f"Unknown prefilter mode: {mode}")
+        self.mode = mode if model_uri else "off"
+        self.model_uri = model_uri
+        self.threshold = threshold
+        self.s3 = s3
+        self._model = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def model(self) -> PrefilterModel | None:
+        if self.mode == "off":
+            return None
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    self._model = PrefilterModel.loads(self._read_artifact())
+                    logger.info("Loaded prefilter model: %s", self._model.info)
+                except Exception:
+                    logger.exception("Failed to load prefilter model %s", self.model_uri)
+            return self._model
+
+    def _read_artifact(self) -> bytes:
+        if self.model_uri.startswith("s3://"):
+            bucket, _, key = self.model_uri[len("s3://") :].partition("/")
+            return self.s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        with open(self.model_uri, "rb") as f:
+            return f.read()
+
+    def score(self, features: list[int]) -> float | None:
+        model = self.model()
+        if model is None:
+            return None
+        with metrics.timer("PrefilterPredict"):
+            return model.predict(features)
+
+    def confident(self, probability: float) -> bool:
+        return max(probability, 1 - probability) >= self.threshold
+
+    def decide(self, probability: float | None) -> dict | None:
+        """Return a verdict for a confident score in enforce mode, else None."""
+        if self.mode != "enforce" or probability is None or not self.confident(probability):
+            return None
+        worth_reading = probability >= 0.5
+        metrics.record("PrefilterDecisions", 1)
+        return {
+            "worth_reading": worth_reading,
+            "email": None,
+            "gmail_forward_confirm_link": None,
+            "urgent": False,
+            "reason": (
+                "You received an email that looks worth reading."
+                if worth_reading
+                else "You received a routine email."
+            ),
+            "confidence": max(probability, 1 - probability),
+        }
+
+    def compare(self, probability: float | None, verdict: dict):
+        """Record whether a score agrees with the verdict Bedrock gave."""
+        if probability is None:
+            return
+        agrees = (probability >= 0.5) == bool(verdict.get("worth_reading"))
+        metrics.record("PrefilterAgreement", int(agrees))
+        if self.confident(probability):
+            metrics.record("PrefilterConfidentAgreement", int(agrees))
+            metrics.record("PrefilterCoverage", 1)
+        else:
+            metrics.record("PrefilterCoverage", 0)
+
+
+class TrainingLog:
+    """Buffer (features, verdict) examples and write them to S3 as gzipped JSONL.
+
+    One object is written per flush, under prefix/YYYY/MM/DD/, so the
+    trainer can pick up a date range.
+    """
+
+    def __init__(self, bucket, prefix, s3):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = s3
+        self._examples = []
+        self._lock = threading.Lock()
+
+    def add(self, features: list[int], verdict: dict):
+        example = {
+            "v": FEATURE_VERSION,
+            "f": features,
+            "y": int(bool(verdict.get("worth_reading"))),
+            "t": int(time.time()),
+        }
+        with self._lock:
+            self._examples.append(example)
+
+    def flush(self):
+        with self._lock:
+            examples, self._examples = self._examples, []
+        if not examples:
+            return
+        body = gzip.compress("".join(json.dumps(e) + "\n" for e in examples).encode("utf-8"))
+        key = f"{self.prefix}{datetime.now(timezone.utc):%Y/%m/%d}/{uuid.uuid4().hex}.jsonl.gz"
+        try:
+            with metrics.timer("S3Put"):
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+        except Exception:
+            logger.exception("Failed to write %d training examples", len(examples))
+
+
+def read_examples(data: bytes):
+    """Yield the examples in one training log object."""
+    with gzip.open(io.BytesIO(data), "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
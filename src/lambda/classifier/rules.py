@@ -0,0 +1,117 @@
+import os
+import re
+
+# Gmail forwarding confirmations have a fixed shape, so they never need the model
+GMAIL_CONFIRM_LINK_PATTERN = re.compile(
+    r"https://mail-settings\.google\.com/mail/vf-[^\s<>\"']+"
+)
+GMAIL_CONFIRM_EMAIL_PATTERN = re.compile(
+    r"([\w.+-]+@[\w-]+(?:\.[\w-]+)+)\s+has\s+requested\s+to\s+automatically\s+forward",
+    re.IGNORECASE,
+)
+
+NOREPLY_PATTERN = re.compile(r"^(?:no-?reply|do-?not-?reply|donotreply)[\w.+-]*@")
+BULK_PRECEDENCE = {"bulk", "list", "junk"}
+
+# Senders whose mail is routine (receipts, statements, shipping updates)
+ROUTINE_SENDER_DOMAINS = {
+    "amazon.com",
+    "shipment-tracking.amazon.com",
+    "ups.com",
+    "fedex.com",
+    "usps.com",
+    "dhl.com",
+    "paypal.com",
+    "venmo.com",
+    "squareup.com",
+    "stripe.com",
+    "uber.com",
+    "doordash.com",
+    "email.apple.com",
+} | {
+    domain.strip().lower()
+    for domain in os.environ.get("ROUTINE_SENDER_DOMAINS", "").split(",")
+    if domain.strip()
+}
+
+
+def sender_matches(sender: str, entries) -> bool:
+    """Check a sender against a list of addresses and domains ('@example.com')."""
+    domain = sender.rpartition("@")[2]
+    for entry in entries or ():
+        entry = str(entry).strip().lower()
+        if entry == sender:
+            return True
+        bare = entry.lstrip("@")
+        if "@" not in bare and (domain == bare or domain.endswith("." + bare)):
+            return True
+    return False
+
+
+def is_routine_domain(sender: str) -> bool:
+    """Return True if the sender's domain (or a parent domain) is known routine."""
+    labels = sender.rpartition("@")[2].split(".")
+    return any(
+        ".".join(labels[i:]) in ROUTINE_SENDER_DOMAINS for i in range(len(labels) - 1)
+    )
+
+
+def routine(reason: str) -> dict:
+    """Build a negative verdict in the model's output shape."""
+    return {
+        "worth_reading": False,
+        "email": None,
+        "gmail_forward_confirm_link": None,
+        "reason": reason,
+    }
+
+
+def match_gmail_confirmation(email_data: dict) -> dict | None:
+    """Extract the forwarding confirmation link and requesting address."""
+    body = email_data.get("body", "")
+    link = GMAIL_CONFIRM_LINK_PATTERN.search(body)
+    requester = GMAIL_CONFIRM_EMAIL_PATTERN.search(body)
+    if not link or not requester:
+        return None
+    return {
+        "worth_reading": False,
+        "email": requester.group(1).lower(),
+        "gmail_forward_confirm_link": link.group(0),
+        "reason": "You received a Gmail forwarding confirmation request.",
+    }
+
+
+def preclassify(email_data: dict, user: dict | None = None) -> tuple[dict, str] | None:
+    """Decide obvious cases without the model.
+
+    Returns a (result, rule name) tuple shaped like the model's output, or None
+    if the email is ambiguous and should be sent to Bedrock.
+    """
+    confirmation = match_gmail_confirmation(email_data)
+    if confirmation:
+        return confirmation, "gmail_confirmation"
+
+    sender = email_data.get("from", "").strip().lower()
+    headers = email_data.get("headers", {})
+
+    if user:
+        if sender_matches(sender, user.get("blocked_senders")):
+            return routine("You received an email from a blocked sender."), "blocked_sender"
+        if sender_matches(sender, user.get("allowed_senders")):
+            return {
+                "worth_reading": True,
+                "email": None,
+                "gmail_forward_confirm_link": None,
+                "reason": f"You received an email from {sender}, who is on your list of important senders.",
+            }, "allowed_sender"
+
+    if headers.get("list-unsubscribe"):
+        return routine("You received a mailing list email."), "list_unsubscribe"
+    if headers.get("precedence", "").strip().lower() in BULK_PRECEDENCE:
+        return routine("You received a bulk email."), "precedence_bulk"
+    if NOREPLY_PATTERN.match(sender):
+        return routine("You received an automated no-reply email."), "noreply_sender"
+    if is_routine_domain(sender):
+        return routine("You received a routine receipt or shipping update."), "routine_domain"
+
+    return None
@@ -0,0 +1,186 @@
+import json
+import re
+
+# Fields of a classification verdict and the types they are coerced to
+BOOL_FIELDS = ("worth_reading", "urgent")
+OPTIONAL_STR_FIELDS = ("email", "gmail_forward_confirm_link")
+NULL_STRINGS = {"", "null", "none", "n/a"}
+TRUE_STRINGS = {"true", "yes", "y", "1"}
+FALSE_STRINGS = {"false", "no", "n", "0"}
+
+# Bare literals some models write in place of JSON ones
+LITERAL_FIXES = {"True": "true", "False": "false", "None": "null"}
+LITERAL_PATTERN = re.compile(r"\b(True|False|None)\b")
+TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+BARE_REASON_PATTERN = re.compile(r'("reason"\s*:\s*)([^"\s][^\n]*?)(\s*)(,?\s*\n|\s*}$)')
+
+
+class ObjectScanner:
+    """Find balanced top-level JSON objects in text fed in chunks.
+
+    Each character is looked at once, tracking nesting depth and whether it
+    is inside a string, so braces within strings (a reason that quotes code,
+    say) do not end an object early. Text outside objects, such as prose or
+    code fences around the answer, is skipped.
+    """
+
+    def __init__(self):
+        self.objects = []
+        self._current = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        """Scan a chunk; returns True once at least one object has closed."""
+        start = 0 if self._depth else None
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char == "{":
+                if self._depth == 0:
+                    start = i
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._current.append(chunk[start : i + 1])
+                    self.objects.append("".join(self._current))
+                    self._current = []
+                    start = None
+        if self._depth and start is not None:
+            self._current.append(chunk[start:])
+        return bool(self.objects)
+
+    def partial(self) -> str | None:
+        """Close an unfinished object, as when the answer hit max_tokens."""
+        if not self._depth:
+            return None
+        text = "".join(self._current)
+        if self._in_string:
+            text += '"'
+        text = text.rstrip().rstrip(",:")
+        return text + "}" * self._depth
+
+
+def loads_lenient(text: str) -> dict:
+    """json.loads with repairs for the mistakes models make in JSON answers."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    fixed = LITERAL_PATTERN.sub(lambda m: LITERAL_FIXES[m.group(1)], text)
+    fixed = TRAILING_COMMA_PATTERN.sub(r"\1", fixed)
+    fixed = BARE_REASON_PATTERN.sub(
+        lambda m: m.group(1) + json.dumps(m.group(2)) + m.group(3) + m.group(4), fixed
+    )
+    return json.loads(fixed)
+
+
+def to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_STRINGS:
+        return True
+    if text in FALSE_STRINGS or text in NULL_STRINGS:
+        return False
+    raise ValueError(f"Not a boolean: {value!r}")
+
+
+def to_optional_str(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return None if text.lower() in NULL_STRINGS else text
+
+
+def coerce(obj) -> dict:
+    """Validate a parsed verdict and coerce its fields to the expected types.
+
+    Raises ValueError if obj is not a verdict: it must be an object with
+    either worth_reading or a Gmail confirmation link.
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("Verdict is not a JSON object")
+    verdict = dict(obj)
+    for field in BOOL_FIELDS:
+        if field in verdict:
+            verdict[field] = to_bool(verdict[field])
+    for field in OPTIONAL_STR_FIELDS:
+        if field in verdict:
+            verdict[field] = to_optional_str(verdict[field])
+    link = verdict.get("gmail_forward_confirm_link")
+    if link and not link.startswith("https://"):
+        verdict["gmail_forward_confirm_link"] = None
+    if "reason" in verdict and not isinstance(verdict["reason"], str):
+        verdict["reason"] = "" if verdict["reason"] is None else str(verdict["reason"])
+    if "confidence" in verdict:
+        try:
+            verdict["confidence"] = min(max(float(verdict["confidence"]), 0.0), 1.0)
+        except (TypeError, ValueError):
+            del verdict["confidence"]
+    if verdict.get("worth_reading") is None and not verdict.get("gmail_forward_confirm_link"):
+        raise ValueError("Verdict has no worth_reading")
+    verdict.setdefault("worth_reading", False)
+    return verdict
+
+
+def parse_verdict(text: str) -> dict:
+    """Return the first verdict object in a model answer.
+
+    Raises ValueError if there is none.
+    """
+    scanner = ObjectScanner()
+    scanner.feed(text)
+    return verdict_from(scanner)
+
+
+def verdict_from(scanner: ObjectScanner) -> dict:
+    """Return the first usable verdict found by scanner, or its closed-off remainder."""
+    candidates = scanner.objects + [p for p in [scanner.partial()] if p]
+    for candidate in candidates:
+        try:
+            return coerce(loads_lenient(candidate))
+        except ValueError:
+            continue
+    raise ValueError("Could not extract valid JSON")
+
+
+def parse_verdicts(text: str) -> list[dict]:
+    """Return every verdict object in a batched answer, skipping broken ones.
+
+    Objects are found by scanning, so one malformed item only loses itself.
+    A well-formed answer wrapped as {"results": [...]} is unwrapped.
+    """
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        items = None
+    if isinstance(items, dict):
+        items = items.get("results", [items])
+    if not isinstance(items, list):
+        scanner = ObjectScanner()
+        scanner.feed(text)
+        items = []
+        for candidate in scanner.objects:
+            try:
+                items.append(loads_lenient(candidate))
+            except ValueError:
+                continue
+    verdicts = []
+    for item in items:
+        try:
+            verdicts.append(coerce(item))
+        except ValueError:
+            continue
+    return verdicts
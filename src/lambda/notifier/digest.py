@@ -0,0 +1,202 @@
+import json
+import logging
+import time
+
+from boto3.dynamodb.types import TypeSerializer
+
+import clients
+from metrics import metrics
+from telegram import MAX_MESSAGE_CHARS
+from userdir import deserialize
+
+logger = logging.getLogger()
+
+# Sort key of the item marking that a flush is scheduled for a user
+WINDOW_MARKER = "#window"
+
+# SQS caps message delays at 15 minutes
+MAX_WINDOW_SECONDS = 900
+
+# BatchWriteItem accepts at most 25 requests per call
+BATCH_WRITE_LIMIT = 25
+
+# Buffered items are removed by TTL if a flush never happens
+BUFFER_TTL_SECONDS = 24 * 3600
+
+# How late a scheduled flush may be before its marker counts as abandoned and
+# the next notification schedules another; covers SQS delivery and a retry
+FLUSH_GRACE_SECONDS = 120
+
+MAX_DIGEST_SUBJECT_CHARS = 80
+
+_serializer = TypeSerializer()
+
+
+def serialize(item: dict) -> dict:
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+class DigestBuffer:
+    """Buffer non-urgent notifications per user and flush them as one digest.
+
+    Notifications are stored in a DynamoDB table keyed by (user_email,
+    item_id). The first notification in a window also writes a marker item and
+    schedules a flush: a delayed SQS message to the notify queue that arrives
+    when the window closes. Items are keyed by correlation id, so buffering a
+    redelivered message twice is harmless. The marker records when its flush
+    is due, and a marker more than FLUSH_GRACE_SECONDS overdue is replaced,
+    so a flush that never ran cannot hold a user's window shut.
+    """
+
+    def __init__(self, table_name, window_seconds, sqs, queue_url, client=None):
+        self.table_name = table_name
+        self.window_seconds = min(window_seconds, MAX_WINDOW_SECONDS)
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.client = client or clients.lazy_client("dynamodb")
+
+    def add(self, user_email: str, item_id: str, message: dict):
+        """Buffer message for user_email, scheduling a flush if none is pending."""
+        now = int(time.time())
+        expires_at = now + BUFFER_TTL_SECONDS
+        with metrics.timer("DigestWrite"):
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=serialize(
+                    {
+                        "user_email": user_email,
+                        "item_id": item_id,
+                        "message": json.dumps(message),
+                        "expires_at": expires_at,
+                    }
+                ),
+            )
+        try:
+            with metrics.timer("DigestWrite"):
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item=serialize(
+                        {
+                            "user_email": user_email,
+                            "item_id": WINDOW_MARKER,
+                            "flush_at": now + self.window_seconds,
+                            "expires_at": expires_at,
+                        }
+                    ),
+                    ConditionExpression=(
+                        "attribute_not_exists(item_id) OR "
+                        "attribute_not_exists(flush_at) OR flush_at < :abandoned"
+                    ),
+                    ExpressionAttributeValues={
+                        ":abandoned": {"N": str(now - FLUSH_GRACE_SECONDS)}
+                    },
+                )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return  # a flush is already scheduled for this window
+
+        try:
+            with metrics.timer("SQSSend"):
+                self.sqs.send_message(
+                    QueueUrl=self.queue_url,
+                    MessageBody=json.dumps({"digest_flush": user_email}),
+                    DelaySeconds=self.window_seconds,
+                )
+        except Exception:
+            # Remove the marker so the retry of this record schedules the flush
+            self.close_window(user_email)
+            raise
+        logger.info("Scheduled a digest for %s in %ss", user_email, self.window_seconds)
+
+    def drain(self, user_email: str) -> list[dict]:
+        """Close the user's window and return its buffered items, oldest first.
+
+        The marker is removed first, so notifications arriving from now on
+        open a new window instead of being stranded.
+        """
+        self.close_window(user_email)
+        items, start_key = [], None
+        while True:
+            kwargs = {"ExclusiveStartKey": start_key} if start_key else {}
+            with metrics.timer("DigestRead"):
+                response = self.client.query(
+                    TableName=self.table_name,
+                    KeyConditionExpression="user_email = :email",
+                    ExpressionAttributeValues={":email": {"S": user_email}},
+                    ConsistentRead=True,
+                    **kwargs,
+                )
+            items.extend(
+                deserialize(item)
+                for item in response.get("Items", [])
+                if item["item_id"]["S"] != WINDOW_MARKER
+            )
+            start_key = response.get("LastEvaluatedKey")
+            if not start_key:
+                break
+        messages = [dict(json.loads(item["message"]), item_id=item["item_id"]) for item in items]
+        return sorted(messages, key=lambda m: m.get("received_at") or 0)
+
+    def close_window(self, user_email: str):
+        """Remove the user's marker; the next notification opens a new window."""
+        with metrics.timer("DigestWrite"):
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key=serialize({"user_email": user_email, "item_id": WINDOW_MARKER}),
+            )
+
+    def clear(self, user_email: str, item_ids: list[str]):
+        """Delete flushed items from the buffer."""
+        requests = [
+            {"DeleteRequest": {"Key": serialize({"user_email": user_email, "item_id": i})}}
+            for i in item_ids
+        ]
+        for start in range(0, len(requests), BATCH_WRITE_LIMIT):
+            request = {self.table_name: requests[start : start + BATCH_WRITE_LIMIT]}
+            for attempt in range(5):
+                response = self.client.batch_write_item(RequestItems=request)
+                request = response.get("UnprocessedItems")
+                if not request:
+                    break
+                time.sleep(0.05 * 2**attempt)
+
+
+def render(messages: list[dict], max_chars: int = MAX_MESSAGE_CHARS) -> str:
+    """Merge buffered notifications into one message, grouped by sender.
+
+    Items that would push the message past max_chars are summarized as a
+    count rather than cut off mid-line.
+    """
+    if len(messages) == 1:
+        return messages[0]["text"]
+
+    by_sender = {}
+    for message in messages:
+        by_sender.setdefault(message.get("sender") or "Unknown sender", []).append(message)
+
+    lines = [f"{len(messages)} emails worth reading:"]
+    # Leave room for the "and N more" line
+    budget = max_chars - 40 - len(lines[0])
+    shown = 0
+    for sender, group in by_sender.items():
+        heading = f"From {sender}" + (f" ({len(group)})" if len(group) > 1 else "")
+        budget -= len(heading) + 2
+        if budget < 0:
+            break
+        lines += ["", heading]
+        for message in group:
+            subject = message.get("subject") or "(no subject)"
+            if len(subject) > MAX_DIGEST_SUBJECT_CHARS:
+                subject = subject[: MAX_DIGEST_SUBJECT_CHARS - 1] + "…"
+            reason = message.get("reason") if len(group) == 1 else None
+            line = f"• {subject}" + (f": {reason}" if reason else "")
+            budget -= len(line) + 1
+            if budget < 0:
+                break
+            lines.append(line)
+            shown += 1
+        if budget < 0:
+            break
+
+    if shown < len(messages):
+        lines.append(f"\n…and {len(messages) - shown} more")
+    return "\n".join(lines)
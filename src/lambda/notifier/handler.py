@@ -1,49 +1,162 @@
 import json
-import boto3
 import os
 import logging
-import requests 
+import time
+
+import clients
+import telegram
+from digest import DigestBuffer, render
+from ledger import NOTIFIED, ClaimHeld, Ledger
+from metrics import metrics, record_end_to_end
+from userdir import UserDirectory
 
 # Constants
 TELEGRAM_BOT_ID = os.environ.get("TELEGRAM_BOT_ID")
 USERS_TABLE = os.environ.get("USERS_TABLE", "users")
+LEDGER_TABLE = os.environ.get("LEDGER_TABLE")
+NOTIFY_SQS_URL = os.environ.get("NOTIFY_SQS_URL")
+DIGEST_TABLE = os.environ.get("DIGEST_TABLE")
+DIGEST_WINDOW_SECONDS = int(os.environ.get("DIGEST_WINDOW_SECONDS", "0"))
 
-# Clients
-dynamodb = boto3.resource("dynamodb")
+# Time kept back from the invocation for a request already in flight to time
+# out and for the ledger to be settled
+RESERVED_SECONDS = sum(telegram.TIMEOUT) + 2
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# DynamoDB Table
-users_table = dynamodb.Table(USERS_TABLE)
+# Cached users lookups; lives for the lifetime of the warm container
+user_directory = UserDirectory(users_table=USERS_TABLE)
+
+# Per-message stage ledger; a message is claimed before it is sent so that
+# redeliveries and duplicates do not ping the user twice
+ledger = Ledger(LEDGER_TABLE) if LEDGER_TABLE else None
+
+# Non-urgent email notifications are held for DIGEST_WINDOW_SECONDS and sent
+# as one message per user; disabled when the window is 0
+digest_buffer = (
+    DigestBuffer(
+        DIGEST_TABLE,
+        DIGEST_WINDOW_SECONDS,
+        clients.lazy_client("sqs"),
+        NOTIFY_SQS_URL,
+    )
+    if DIGEST_TABLE and NOTIFY_SQS_URL and DIGEST_WINDOW_SECONDS > 0
+    else None
+)
 
 
 def send_telegram_notification(bot_token: str, chat_id: str, message: str) -> dict:
     """Send a message using the Telegram Bot API."""
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {"chat_id": chat_id, "text": message}
-    response = requests.post(url, data=payload)
-    response.raise_for_status()
-    return response.json()
+    return telegram.send_message(bot_token, chat_id, message)
 
 
 def lookup_user(email: str) -> dict | None:
-    """Retrieve a user record from DynamoDB by email."""
-    response = users_table.get_item(Key={"email": email})
-    return response.get("Item")
+    """Retrieve a user record from DynamoDB by email.
 
+    A cached user without a telegram_id is re-read, as it may have just linked.
+    """
+    return user_directory.get_user(email, require="telegram_id")
 
-def lambda_handler(event, context):
-    logger.info("Received event: " + json.dumps(event))
 
-    for record in event.get("Records", []):
+def digestible(message: dict) -> bool:
+    """Email notifications can wait for a digest unless marked urgent.
+
+    Only the classifier sets a sender, so replies from the chat path are
+    always sent immediately.
+    """
+    return bool(digest_buffer and message.get("sender") and not message.get("urgent"))
+
+
+def claim(message: dict) -> bool:
+    """Claim a message in the ledger; False if it was already notified."""
+    correlation_id = message.get("correlation_id")
+    if ledger and correlation_id and not ledger.claim(correlation_id, NOTIFIED):
+        logger.info("Skipping %s; already notified", correlation_id)
+        return False
+    return True
+
+
+def settle(message: dict, delivered: bool, rejected: bool = False):
+    """Record a message's outcome in the ledger and its end-to-end latency.
+
+    Messages Telegram rejected for good are settled as done, so they are not
+    retried.
+    """
+    correlation_id = message.get("correlation_id")
+    if ledger and correlation_id:
+        if delivered or rejected:
+            ledger.complete(correlation_id, NOTIFIED)
+        else:
+            ledger.release(correlation_id, NOTIFIED)
+    if delivered:
+        record_end_to_end(message)
+
+
+def collect_digest(user_email: str) -> tuple[list[dict], str | None]:
+    """Drain a user's digest window; returns (claimed messages, merged text).
+
+    Messages already notified are dropped, and ones held by another
+    delivery are left for a later window.
+    """
+    claimed = []
+    for message in digest_buffer.drain(user_email):
+        try:
+            if claim(message):
+                claimed.append(message)
+            else:
+                digest_buffer.clear(user_email, [message["item_id"]])
+        except ClaimHeld as e:
+            logger.info("Leaving item in the digest: %s", e)
+    return claimed, render(claimed) if claimed else None
+
+
+def abandon_flush(flush: bool, user_email: str):
+    """Close the window of a flush that cannot be sent.
+
+    Its items stay buffered until they expire, and are sent with the next
+    window if the user can be reached by then.
+    """
+    if flush and digest_buffer:
+        digest_buffer.close_window(user_email)
+
+
+def lambda_handler(event, context):
+    """Send notifications to Telegram.
+
+    Notifications for the same chat are coalesced into as few messages as
+    possible, and chats are sent to concurrently. Records that could not be
+    delivered are reported as SQS batchItemFailures, including those still
+    waiting on a 429 when the invocation is about to time out. Records that
+    Telegram refuses for good (a blocked bot, an unknown chat) are dropped.
+    """
+    records = event.get("Records", [])
+    logger.info("Received %d records", len(records))
+    failures = []
+    pending = {}
+    queued = {}
+    digests = {}
+
+    # Load every recipient in the batch with one BatchGetItem
+    try:
+        user_directory.prefetch(
+            (message.get("user_email") or message.get("digest_flush") or "").strip().lower()
+            for message in (json.loads(record["body"]) for record in records)
+        )
+    except Exception:
+        logger.exception("Failed to prefetch users; falling back to lookups")
+
+    for record in records:
         try:
             # Parse SQS message body (assumed to be JSON)
             message = json.loads(record["body"])
 
-            # Extract recipient email
-            user_email = message.get("user_email", "").strip().lower()
+            # Extract recipient email; digest flushes carry it in digest_flush
+            flush = "digest_flush" in message
+            user_email = (
+                message.get("digest_flush" if flush else "user_email") or ""
+            ).strip().lower()
             if not user_email:
                 logger.warning("No 'user_email' address found in message.")
                 continue
@@ -52,11 +165,25 @@ def lambda_handler(event, context):
             user = lookup_user(user_email)
             if not user:
                 logger.info(f"No user found for email: {user_email}")
+                abandon_flush(flush, user_email)
                 continue
 
             telegram_id = user.get("telegram_id")
             if not telegram_id:
                 logger.warning(f"User {user_email} does not have a telegram_id.")
+                abandon_flush(flush, user_email)
+                continue
+
+            if flush:
+                if not digest_buffer:
+                    logger.warning("Digest flush for %s with digests disabled", user_email)
+                    continue
+                digested, text = collect_digest(user_email)
+                if not digested:
+                    continue
+                logger.info("Sending a digest of %d to %s", len(digested), telegram_id)
+                pending.setdefault(telegram_id, []).append((record["messageId"], text))
+                digests[record["messageId"]] = (user_email, digested)
                 continue
 
             text = message.get("text", "")
@@ -64,14 +191,53 @@ def lambda_handler(event, context):
                 logger.warning("No text found in message.")
                 continue
 
-            logger.info(f"Sending Telegram message to {telegram_id}: {text}")
-            send_resp = send_telegram_notification(
-                TELEGRAM_BOT_ID, telegram_id, text
+            if digestible(message):
+                item_id = message.get("correlation_id") or record["messageId"]
+                digest_buffer.add(user_email, item_id, message)
+                metrics.record("NotificationsDigested", 1)
+                continue
+
+            if not claim(message):
+                continue
+
+            logger.info(
+                "Queueing Telegram message %s to %s",
+                message.get("correlation_id"),
+                telegram_id,
             )
-            
-            logger.info("Telegram response: %s", send_resp)
+            pending.setdefault(telegram_id, []).append((record["messageId"], text))
+            queued[record["messageId"]] = message
 
-        except Exception as e:
-            logger.exception("Error processing record")
+        except ClaimHeld as e:
+            logger.info("Deferring record: %s", e)
+            failures.append(record["messageId"])
 
-    return {"statusCode": 200, "body": "Processing complete"}
+        except Exception:
+            logger.exception("Error processing record")
+            failures.append(record["messageId"])
+
+    deadline = None
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000 - RESERVED_SECONDS
+        deadline = time.monotonic() + max(remaining, 0)
+    unsent, rejected = telegram.send_all(TELEGRAM_BOT_ID, pending, deadline)
+    failures.extend(unsent)
+
+    # Record the outcome, and receive-to-notify latency for everything delivered
+    for message_id, message in queued.items():
+        settle(
+            message,
+            delivered=message_id not in failures and message_id not in rejected,
+            rejected=message_id in rejected,
+        )
+
+    # Sent digests leave the buffer, as do rejected ones; failed ones stay for
+    # the flush's redelivery
+    for message_id, (user_email, digested) in digests.items():
+        delivered = message_id not in failures and message_id not in rejected
+        for message in digested:
+            settle(message, delivered, rejected=message_id in rejected)
+        if delivered or message_id in rejected:
+            digest_buffer.clear(user_email, [message["item_id"] for message in digested])
+    metrics.flush()
+    return {"batchItemFailures": [{"itemIdentifier": i} for i in failures]}
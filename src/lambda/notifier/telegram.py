@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+logger = logging.getLogger()
+
+API_URL = "https://api.telegram.org/bot{token}/{method}"
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_CHARS = 4096
+MESSAGE_SEPARATOR = "\n\n———\n\n"
+
+# Bot API limits: about 30 messages per second overall, 1 per second per chat
+GLOBAL_RATE_PER_SECOND = 30
+CHAT_INTERVAL_SECONDS = 1.0
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 10)
+MAX_RETRIES = 3
+
+# Longest retry_after we wait out; beyond this the record is left to SQS
+MAX_RETRY_AFTER_SECONDS = 20
+MAX_CONCURRENCY = 8
+
+# Module-level session so connections are kept alive across warm invocations
+session = requests.Session()
+session.mount(
+    "https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY)
+)
+
+
+class TelegramError(Exception):
+    """Raised when a message could not be delivered to Telegram."""
+
+
+class TelegramRejected(TelegramError):
+    """Raised when Telegram refuses a message for good, such as a 403 from a
+    user who blocked the bot or a 400 for an unknown chat; retrying cannot help."""
+
+
+class RateLimiter:
+    """Token bucket shared by all sending threads."""
+
+    def __init__(self, rate_per_second):
+        self.rate = rate_per_second
+        self.tokens = float(rate_per_second)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.rate, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(GLOBAL_RATE_PER_SECOND)
+
+
+def coalesce(texts: list[str]) -> list[list[int]]:
+    """Group message indexes so each group's joined text fits in one message."""
+    groups, current, length = [], [], 0
+    for i, text in enumerate(texts):
+        added = len(text) + (len(MESSAGE_SEPARATOR) if current else 0)
+        if current and length + added > MAX_MESSAGE_CHARS:
+            groups.append(current)
+            current, length = [], 0
+            added = len(text)
+        current.append(i)
+        length += added
+    if current:
+        groups.append(current)
+    return groups
+
+
+def pause(seconds: float, deadline: float | None):
+    """Sleep, unless that would run past deadline (a time.monotonic() value)."""
+    if deadline is not None and time.monotonic() + seconds > deadline:
+        raise TelegramError(f"No time left to wait {seconds}s before sending")
+    time.sleep(seconds)
+
+
+def send_message(bot_token: str, chat_id: str, text: str, deadline: float | None = None) -> dict:
+    """Send one message, waiting out 429 retry_after and retrying server errors.
+
+    Waits stop at deadline, so a retry never outlasts the invocation. Client
+    errors other than 429 raise TelegramRejected.
+    """
+    url = API_URL.format(token=bot_token, method="sendMessage")
+    payload = {"chat_id": chat_id, "text": text[:MAX_MESSAGE_CHARS]}
+
+    for attempt in range(MAX_RETRIES + 1):
+        pause(0, deadline)
+        rate_limiter.acquire()
+        try:
+            with metrics.timer("TelegramSend"):
+                response = session.post(url, data=payload, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            if attempt == MAX_RETRIES:
+                raise TelegramError(f"Request to Telegram failed: {e}") from e
+            pause(0.5 * 2**attempt, deadline)
+            continue
+
+        if response.status_code == 429:
+            metrics.record("TelegramRateLimited", 1)
+            try:
+                retry_after = response.json()["parameters"]["retry_after"]
+            except (ValueError, KeyError):
+                retry_after = 1
+            if attempt == MAX_RETRIES or retry_after > MAX_RETRY_AFTER_SECONDS:
+                raise TelegramError(f"Rate limited by Telegram for {retry_after}s")
+            logger.warning("Rate limited on chat %s; retrying in %ss", chat_id, retry_after)
+            pause(retry_after, deadline)
+            continue
+
+        if response.status_code >= 500 and attempt < MAX_RETRIES:
+            pause(0.5 * 2**attempt, deadline)
+            continue
+
+        if 400 <= response.status_code < 500:
+            raise TelegramRejected(
+                f"Telegram refused the message with {response.status_code}: {response.text[:300]}"
+            )
+
+        if not response.ok:
+            raise TelegramError(
+                f"Telegram returned {response.status_code}: {response.text[:300]}"
+            )
+        return response.json()
+
+    raise TelegramError("Exhausted retries sending to Telegram")
+
+
+def send_to_chat(
+    bot_token: str, chat_id: str, items: list[tuple[str, str]], deadline: float | None = None
+) -> tuple[list[str], list[str]]:
+    """Send (item id, text) pairs to one chat, coalescing them into few messages.
+
+    Messages to a chat are sent one after another, at most one per second, so
+    a 429 backs off only this chat. Returns the ids of items that failed and
+    may be retried, and of items Telegram refused for good.
+    """
+    failed, rejected = [], []
+    texts = [text for _, text in items]
+    for n, group in enumerate(coalesce(texts)):
+        ids = [items[i][0] for i in group]
+        try:
+            if n:
+                pause(CHAT_INTERVAL_SECONDS, deadline)
+            text = MESSAGE_SEPARATOR.join(texts[i] for i in group)
+            send_message(bot_token, chat_id, text, deadline)
+            logger.info("Sent %d notification(s) to %s", len(group), chat_id)
+        except TelegramRejected as e:
+            logger.warning("Dropping %d notification(s) to %s: %s", len(group), chat_id, e)
+            metrics.record("TelegramRejected", len(group))
+            rejected.extend(ids)
+        except Exception:
+            logger.exception("Failed to send Telegram message to %s", chat_id)
+            failed.extend(ids)
+    return failed, rejected
+
+
+def send_all(
+    bot_token: str, pending: dict[str, list[tuple[str, str]]], deadline: float | None = None
+) -> tuple[list[str], list[str]]:
+    """Send pending notifications for many chats concurrently.
+
+    pending maps chat id to (item id, text) pairs. Nothing waits past
+    deadline; items not sent by then are failed. Returns (failed item ids,
+    rejected item ids).
+    """
+    if not pending:
+        return [], []
+    failed, rejected = [], []
+    workers = min(MAX_CONCURRENCY, len(pending))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(send_to_chat, bot_token, chat_id, items, deadline)
+            for chat_id, items in pending.items()
+        ]
+    for future in futures:
+        chat_failed, chat_rejected = future.result()
+        failed.extend(chat_failed)
+        rejected.extend(chat_rejected)
+    return failed, rejected
@@ -1,36 +1,87 @@
 import json
 import os
 import re
-import boto3
 import logging
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from email import policy
-from email.parser import BytesParser
+from email.feedparser import BytesFeedParser
+from email.message import EmailMessage
 from email.header import decode_header, make_header
 from email.utils import parseaddr
 from datetime import datetime, timezone
 
+import clients
+from htmltext import html_to_text
+from inbox import normalize_address, recipient_address, sender_timestamp
+from ledger import SANITIZED, ClaimHeld, Ledger
+from metrics import epoch_millis, metrics
+from textbudget import classification_view
+
 # Set up logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Clients
-s3 = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+# Clients (built on first use)
+s3 = clients.lazy_client("s3")
+sqs = clients.lazy_client("sqs")
 
 # Environment vars
 OUTPUT_S3_BUCKET = os.environ["OUTPUT_S3_BUCKET"]
 USER_EMAILS_TABLE = os.environ["USER_EMAILS_TABLE"]
+MAX_BODY_CHARS = int(os.environ.get("MAX_BODY_CHARS", "100000"))
+HTML_TEXT_ENGINE = os.environ.get("HTML_TEXT_ENGINE", "stdlib")
+CLASSIFICATION_BODY_TOKENS = int(os.environ.get("CLASSIFICATION_BODY_TOKENS", "3000"))
+CLASSIFY_SQS_URL = os.environ.get("CLASSIFY_SQS_URL")
+INLINE_CLASSIFY = os.environ.get("INLINE_CLASSIFY", "false").lower() == "true"
+LEDGER_TABLE = os.environ.get("LEDGER_TABLE")
+
+# SQS rejects message bodies above 256 KB
+MAX_SQS_MESSAGE_BYTES = 256 * 1024
+
+# Prefix of the trimmed copies the classifier is triggered by and reads
+CLASSIFY_PREFIX = "classify/"
+
+# Size of the S3 body chunks fed to the MIME parser
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Headers carried into the sanitized JSON for the classifier's rule stage
+CARRIED_HEADERS = (
+    "Message-ID",
+    "List-Id",
+    "List-Unsubscribe",
+    "Precedence",
+    "Auto-Submitted",
+)
+
+# DynamoDB table object, owned by the thread that uses it
+user_emails_table = clients.lazy_table(USER_EMAILS_TABLE)
+
+# Archive writes run off the critical path on a single background worker
+archive_executor = ThreadPoolExecutor(max_workers=1)
 
-# DynamoDB table object
-user_emails_table = dynamodb.Table(USER_EMAILS_TABLE)
+# Per-message stage ledger; redelivered emails that were already handed to
+# the classifier are skipped
+ledger = Ledger(LEDGER_TABLE) if LEDGER_TABLE else None
 
 
-def clean_text(text: str) -> str:
-    """Strip HTML tags and normalize whitespace in email content."""
-    soup = BeautifulSoup(text, "html.parser")
-    cleaned = soup.get_text(separator=" ", strip=True)
-    return re.sub(r"\s+", " ", cleaned).strip()
+def clean_text(text: str, max_chars: int | None = None) -> str:
+    """Strip HTML tags and normalize whitespace in email content.
+
+    Uses the streaming stdlib extractor unless HTML_TEXT_ENGINE is "bs4";
+    BeautifulSoup is imported lazily and only used as a fallback.
+    """
+    with metrics.timer("HtmlClean"):
+        if HTML_TEXT_ENGINE != "bs4":
+            try:
+                return html_to_text(text, max_chars)
+            except Exception:
+                logger.exception("HTML extraction failed; falling back to BeautifulSoup")
+
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(text, "html.parser")
+        cleaned = soup.get_text(separator=" ", strip=True)
+        return re.sub(r"\s+", " ", cleaned).strip()[:max_chars]
 
 
 def decode_mime_words(s: str) -> str:
@@ -43,19 +94,156 @@ def decode_mime_words(s: str) -> str:
 
 def extract_body(msg):
     """Extract plain text or fallback to cleaned HTML."""
+    streamed = getattr(msg, "streamed_body", None)
+    if streamed is not None:
+        return streamed
     for part in msg.walk():
         if part.get_content_type() == "text/plain":
             return part.get_content()
     for part in msg.walk():
         if part.get_content_type() == "text/html":
-            return clean_text(part.get_content())
+            return html_part_text(part)
     return ""
 
 
+def html_part_text(part) -> str:
+    """Cleaned text of an HTML part, reusing any extracted while streaming."""
+    text = getattr(part, "cleaned_text", None)
+    if text is None:
+        text = clean_text(part.get_content(), MAX_BODY_CHARS)
+    return text
+
+
+def streamed_message_factory(on_text_part):
+    """Build a message class that drops non-text payloads as they are parsed.
+
+    The feed parser sets a part's payload once the part is complete; keeping
+    only text payloads means attachments never accumulate in the parse tree.
+    on_text_part is called with each completed text part.
+    """
+
+    class StreamedMessage(EmailMessage):
+        # Set by parse_email_stream on the HTML part it checked against the cap
+        cleaned_text = None
+        # Set on the root message when reading stopped at that HTML part
+        streamed_body = None
+
+        def set_payload(self, payload, charset=None):
+            if isinstance(payload, str) and self.get_content_maintype() != "text":
+                payload = ""
+            super().set_payload(payload, charset)
+            if self.get_content_maintype() == "text":
+                on_text_part(self)
+
+    return StreamedMessage
+
+
+def parse_email_stream(chunks):
+    """Parse an email from an iterable of byte chunks with bounded memory.
+
+    Reading stops as soon as the first text/plain part is complete, since
+    extract_body would not look any further. It also stops once the first
+    text/html part is complete and its text already fills MAX_BODY_CHARS, so
+    HTML-only mail is not read to the end; a text/plain part after it is
+    then not waited for.
+    """
+    text_parts = []
+    parser = BytesFeedParser(
+        _factory=streamed_message_factory(text_parts.append), policy=policy.default
+    )
+    stopped = False
+    for chunk in chunks:
+        parser.feed(chunk)
+        if body_complete(text_parts):
+            stopped = True
+            break
+    complete = list(text_parts)
+    msg = parser.close()
+    if stopped and not any(part.get_content_type() == "text/plain" for part in complete):
+        # The chunk may end inside the next part's headers, and close() turns
+        # that fragment into a part that defaults to text/plain; the body is
+        # the HTML part's text, never a search of what close() built
+        msg.streamed_body = next(
+            part.cleaned_text for part in complete if part.get_content_type() == "text/html"
+        )
+    return msg
+
+
+def body_complete(text_parts) -> bool:
+    """Whether the completed text parts already give extract_body enough."""
+    if any(part.get_content_type() == "text/plain" for part in text_parts):
+        return True
+    html = next((p for p in text_parts if p.get_content_type() == "text/html"), None)
+    if html is None:
+        return False
+    if html.cleaned_text is None:
+        html.cleaned_text = clean_text(html.get_content(), MAX_BODY_CHARS)
+    return len(html.cleaned_text) >= MAX_BODY_CHARS
+
+
+def extract_headers(msg) -> dict:
+    """Collect the headers the classifier uses, keyed by lowercase name."""
+    headers = {}
+    for name in CARRIED_HEADERS:
+        value = msg.get(name)
+        if value:
+            headers[name.lower()] = str(value)
+    return headers
+
+
+def sanitize(msg, trace: dict) -> dict:
+    """Build the sanitized email JSON from a parsed message."""
+    from_name, from_email = parseaddr(msg.get("From", "unknown"))
+    return {
+        "from": normalize_address(from_email),
+        "to": recipient_address(msg) or "unknown",
+        "display_name": from_name,
+        "subject": decode_mime_words(msg.get("Subject", "")),
+        "body": extract_body(msg)[:MAX_BODY_CHARS],
+        "headers": extract_headers(msg),
+        **trace,
+    }
+
+
+def send_inline(view_json: dict) -> bool:
+    """Send the classification view straight to the classifier queue.
+
+    Returns False if inline mode is off or the message would exceed the SQS
+    size limit, in which case the caller should use the S3-triggered path.
+    """
+    if not (INLINE_CLASSIFY and CLASSIFY_SQS_URL):
+        return False
+    message_body = json.dumps({"inline": view_json})
+    if len(message_body.encode("utf-8")) > MAX_SQS_MESSAGE_BYTES:
+        return False
+    with metrics.timer("SQSSend"):
+        sqs.send_message(QueueUrl=CLASSIFY_SQS_URL, MessageBody=message_body)
+    return True
+
+
+def archive_email(output_key: str, email_json: dict, item: dict):
+    """Write the full sanitized email to S3 and its metadata to user_emails."""
+    with metrics.timer("S3Put"):
+        s3.put_object(
+            Bucket=OUTPUT_S3_BUCKET,
+            Key=output_key,
+            Body=json.dumps(email_json, indent=2),
+            ContentType="application/json",
+        )
+    logger.info("Wrote cleaned email to %s", item["s3_path"])
+
+    with metrics.timer("DynamoDBPut"):
+        user_emails_table.put_item(Item=item)
+    logger.info("Inserted record into user_emails for %s", item["from_email"])
+
+
 def lambda_handler(event, context):
     logger.info("Processing %d records", len(event["Records"]))
 
+    archive_futures = []
+    failures = []
     for record in event["Records"]:
+        claimed = None
         try:
             # Parse the outer SQS message body
             sqs_body = json.loads(record["body"])
@@ -64,59 +252,111 @@ def lambda_handler(event, context):
             )
 
             # Get bucket and key from the inner S3 event
-            s3_info = s3_event["Records"][0]["s3"]
+            s3_record = s3_event["Records"][0]
+            s3_info = s3_record["s3"]
             bucket = s3_info["bucket"]["name"]
             key = s3_info["object"]["key"]
 
+            # SES names the raw object after the message, so its key follows
+            # the email through every stage; eventTime is when SES stored it
+            trace = {
+                "correlation_id": os.path.basename(key),
+                "received_at": epoch_millis(s3_record.get("eventTime")),
+            }
+
+            if ledger:
+                try:
+                    if not ledger.claim(trace["correlation_id"], SANITIZED):
+                        logger.info("Skipping %s; already sanitized", trace["correlation_id"])
+                        continue
+                except ClaimHeld as e:
+                    # Another delivery may still be working on it, or may have
+                    # died holding the lease; SQS tries again once it lapses
+                    logger.info("Deferring record: %s", e)
+                    failures.append({"itemIdentifier": record["messageId"]})
+                    continue
+                claimed = trace["correlation_id"]
+
             logger.info("Fetching email from s3://%s/%s", bucket, key)
 
-            # Download the raw email
-            response = s3.get_object(Bucket=bucket, Key=key)
-            raw_email = response["Body"].read()
+            # Stream and parse the raw email; the parse time includes reading
+            # the body, since the two are interleaved
+            with metrics.timer("S3Fetch"):
+                response = s3.get_object(Bucket=bucket, Key=key)
+            try:
+                with metrics.timer("MimeParse"):
+                    msg = parse_email_stream(
+                        response["Body"].iter_chunks(STREAM_CHUNK_SIZE)
+                    )
+            finally:
+                response["Body"].close()
 
-            # Parse the email
-            msg = BytesParser(policy=policy.default).parsebytes(raw_email)
-            from_name, from_email = parseaddr(msg.get("From", "unknown"))
-            to_email = msg.get("To", "unknown")
-            subject = decode_mime_words(msg.get("Subject", ""))
-            body_text = extract_body(msg)
+            # Build the sanitized email
+            email_json = sanitize(msg, trace)
+            from_email, to_email = email_json["from"], email_json["to"]
+            from_name, subject = email_json["display_name"], email_json["subject"]
+            body_text = email_json["body"]
 
-            # Write cleaned body to S3
             base_key = os.path.basename(key).split(".")[0]
             output_key = f"{base_key}.json"
             s3_path = f"s3://{OUTPUT_S3_BUCKET}/{output_key}"
 
-            email_json = {
-                "from": from_email,
-                "to": to_email,
-                "display_name": from_name,
-                "subject": subject,
-                "body": body_text,
-            }
-
-            s3.put_object(
-                Bucket=OUTPUT_S3_BUCKET,
-                Key=output_key,
-                Body=json.dumps(email_json, indent=2),
-                ContentType="application/json",
+            # Hand the trimmed classification view to the classifier: inline
+            # over SQS when enabled and small enough, otherwise by writing it
+            # under the prefix whose S3 events trigger the classifier
+            view_json = dict(
+                email_json,
+                body=classification_view(body_text, CLASSIFICATION_BODY_TOKENS),
+                full_body_key=output_key,
             )
+            if send_inline(view_json):
+                logger.info("Sent classification view inline for %s", output_key)
+            else:
+                with metrics.timer("S3Put"):
+                    s3.put_object(
+                        Bucket=OUTPUT_S3_BUCKET,
+                        Key=f"{CLASSIFY_PREFIX}{output_key}",
+                        Body=json.dumps(view_json),
+                        ContentType="application/json",
+                    )
 
-            logger.info("Wrote cleaned email to %s", s3_path)
-
-            # Insert metadata into user_emails table
+            # Archive the full body and insert metadata into user_emails
             now = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
-            user_emails_table.put_item(
-                Item={
-                    "user_email": to_email,
-                    "from_email": from_email,
-                    "display_name": from_name,
-                    "timestamp": now,
-                    "s3_path": s3_path,
-                    "subject": subject,
-                }
+            item = {
+                "user_email": to_email,
+                "from_email": from_email,
+                "display_name": from_name,
+                "timestamp": now,
+                "sender_timestamp": sender_timestamp(from_email, now),
+                "s3_path": s3_path,
+                "subject": subject,
+            }
+            archive_futures.append(
+                (
+                    record["messageId"],
+                    claimed,
+                    archive_executor.submit(archive_email, output_key, email_json, item),
+                )
             )
 
-            logger.info("Inserted record into user_emails for %s", from_email)
-
         except Exception:
             logger.exception("Failed to process record")
+            failures.append({"itemIdentifier": record["messageId"]})
+            if claimed:
+                ledger.release(claimed, SANITIZED)
+
+    # Lambda freezes the container after returning, so wait for the archive
+    for message_id, claimed, future in archive_futures:
+        try:
+            future.result()
+        except Exception:
+            logger.exception("Failed to archive record")
+            failures.append({"itemIdentifier": message_id})
+            if claimed:
+                ledger.release(claimed, SANITIZED)
+        else:
+            if claimed:
+                ledger.complete(claimed, SANITIZED)
+
+    metrics.flush()
+    return {"batchItemFailures": failures}
@@ -0,0 +1,191 @@
+import html
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+
+# Elements whose text BeautifulSoup's get_text() does not treat as page text
+SKIPPED_TAGS = {"script", "style", "template", "rt", "rp"}
+
+# Elements that never have an end tag, so can't open a skipped region
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+# Scopes that bound the search for an open element, per the HTML spec
+DEFAULT_SCOPE = {
+    "applet", "caption", "html", "marquee", "object", "table", "td", "template", "th",
+}
+BUTTON_SCOPE = DEFAULT_SCOPE | {"button"}
+TABLE_SCOPE = {"html", "table", "template"}
+TABLE_TAGS = {"table", "caption", "thead", "tbody", "tfoot", "tr", "td", "th"}
+
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+# Start tags that close a still-open p element
+P_CLOSERS = {
+    "address", "article", "aside", "blockquote", "center", "details", "dialog",
+    "dd", "dir", "div", "dl", "dt", "fieldset", "figcaption", "figure", "footer",
+    "form", "header", "hgroup", "hr", "li", "main", "menu", "nav", "ol", "p",
+    "pre", "section", "summary", "table", "ul",
+} | HEADING_TAGS
+
+# Other elements whose end tag may be left out: start tag -> (elements it
+# closes, elements that stop the search). Without these, a hidden <td> or
+# <li> followed by its next sibling would hide the rest of the document
+IMPLIED_END_TAGS = {
+    "li": ({"li"}, {"ul", "ol"} | DEFAULT_SCOPE),
+    "dt": ({"dt", "dd"}, {"dl"} | DEFAULT_SCOPE),
+    "dd": ({"dt", "dd"}, {"dl"} | DEFAULT_SCOPE),
+    "td": ({"td", "th"}, {"tr"} | TABLE_SCOPE),
+    "th": ({"td", "th"}, {"tr"} | TABLE_SCOPE),
+    "tr": ({"tr", "td", "th"}, {"thead", "tbody", "tfoot"} | TABLE_SCOPE),
+    "thead": ({"thead", "tbody", "tfoot", "tr", "td", "th"}, TABLE_SCOPE),
+    "tbody": ({"thead", "tbody", "tfoot", "tr", "td", "th"}, TABLE_SCOPE),
+    "tfoot": ({"thead", "tbody", "tfoot", "tr", "td", "th"}, TABLE_SCOPE),
+    "option": ({"option"}, {"select", "datalist", "optgroup"}),
+    "optgroup": ({"option", "optgroup"}, {"select"}),
+    "rt": ({"rt", "rp"}, {"ruby"}),
+    "rp": ({"rt", "rp"}, {"ruby"}),
+}
+
+HIDDEN_STYLE_PATTERN = re.compile(
+    r"display\s*:\s*none|visibility\s*:\s*hidden", re.IGNORECASE
+)
+
+# Size of the slices fed to the parser, so long documents can stop early
+FEED_CHUNK_SIZE = 16 * 1024
+
+
+class TextExtractor(HTMLParser):
+    """Collect the visible words of an HTML document.
+
+    Text from adjacent data events is merged until the next markup event, then
+    split on whitespace, which matches get_text(separator=" ", strip=True)
+    followed by whitespace normalization.
+
+    Open elements are tracked as a stack, closed by their end tag, by the end
+    tag of an element around them, or by a start tag that implies their end
+    (a new <p>, <li>, <td> or heading). Skipped and hidden elements drop all
+    text until they are closed.
+    """
+
+    def __init__(self, max_chars=None):
+        super().__init__(convert_charrefs=False)
+        self.max_chars = max_chars
+        self.words = []
+        self.length = 0
+        self._pending = []
+        self._open = []
+        # Index in _open of the element whose content is being skipped
+        self._skip_at = None
+
+    @property
+    def full(self):
+        return self.max_chars is not None and self.length >= self.max_chars
+
+    def flush(self):
+        if not self._pending:
+            return
+        for word in "".join(self._pending).split():
+            self.length += len(word) + (1 if self.words else 0)
+            self.words.append(word)
+        self._pending = []
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in P_CLOSERS:
+            self._close(self._find({"p"}, BUTTON_SCOPE))
+        if tag in IMPLIED_END_TAGS:
+            self._close(self._find(*IMPLIED_END_TAGS[tag]))
+        # Headings don't nest: a heading start tag right inside another
+        # heading closes it
+        if tag in HEADING_TAGS and self._open and self._open[-1] in HEADING_TAGS:
+            self._close(len(self._open) - 1)
+        if tag in VOID_TAGS:
+            return
+        self._open.append(tag)
+        if self._skip_at is None and (tag in SKIPPED_TAGS or self.is_hidden(attrs)):
+            self._skip_at = len(self._open) - 1
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in HEADING_TAGS:
+            # Any heading's end tag closes whichever heading is open
+            self._close(self._find(HEADING_TAGS, DEFAULT_SCOPE))
+            return
+        self._close(self._find({tag}, TABLE_SCOPE if tag in TABLE_TAGS else DEFAULT_SCOPE))
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush()
+
+    def handle_data(self, data):
+        if self._skip_at is None:
+            self._pending.append(data)
+
+    def _find(self, tags, scope):
+        """Index of the innermost open element in tags, not looking past scope."""
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index] in tags:
+                return index
+            if self._open[index] in scope:
+                return None
+        return None
+
+    def _close(self, index):
+        """Close the open element at index and everything inside it, if found."""
+        if index is None:
+            return
+        del self._open[index:]
+        if self._skip_at is not None and self._skip_at >= index:
+            self._skip_at = None
+
+    def handle_entityref(self, name):
+        # Unknown entities are kept without their semicolon, as BeautifulSoup
+        # does; only exact names count, so &notanentity is not &not + text
+        self.handle_data(html5.get(f"{name};", f"&{name}"))
+
+    def handle_charref(self, name):
+        self.handle_data(html.unescape(f"&#{name};"))
+
+    def unknown_decl(self, data):
+        self.flush()
+        if data.startswith("CDATA[") and self._skip_at is None:
+            self._pending.append(data[6:])
+            self.flush()
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    @staticmethod
+    def is_hidden(attrs):
+        for name, value in attrs:
+            if name == "hidden":
+                return True
+            if name == "style" and value and HIDDEN_STYLE_PATTERN.search(value):
+                return True
+        return False
+
+
+def html_to_text(html: str, max_chars: int | None = None) -> str:
+    """Extract visible text from HTML with whitespace collapsed to single spaces.
+
+    Parsing stops once max_chars characters of text have been collected.
+    """
+    extractor = TextExtractor(max_chars)
+    for start in range(0, len(html), FEED_CHUNK_SIZE):
+        extractor.feed(html[start : start + FEED_CHUNK_SIZE])
+        if extractor.full:
+            break
+    else:
+        extractor.close()
+        extractor.flush()
+
+    text = " ".join(extractor.words)
+    return text[:max_chars] if max_chars is not None else text
@@ -1,69 +1,166 @@
 import json
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import boto3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import clients
+from metrics import metrics
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.client("dynamodb")
+dynamodb = clients.lazy_client("dynamodb")
 USERS_TABLE_NAME = "users"
 
+MAX_CONCURRENCY = int(os.environ.get("URL_VISITOR_CONCURRENCY", "5"))
 
-def lambda_handler(event, context):
-    """
-    Lambda handler triggered by SQS events.
+# (connect, read) timeouts in seconds; a slow link fails on its own instead
+# of holding the batch until the Lambda times out
+TIMEOUT = (3.05, 10)
+MAX_REDIRECTS = 5
 
-    For each message, this function:
-    - Parses the JSON body for 'email' and 'url'
-    - Sends a POST request to the Gmail confirmation URL (following redirects)
-    - If the response is HTTP 200, it updates the corresponding user record in DynamoDB
-      by setting 'forward_confirmed' = true for that email
-    - If any step fails, the error is logged and re-raised so SQS can retry the message
-    """
+# Module-level session so connections are kept alive across warm invocations.
+# Only connection failures are retried here, since the request never reached
+# Gmail; anything else is left to SQS
+session = requests.Session()
+session.max_redirects = MAX_REDIRECTS
+session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=MAX_CONCURRENCY,
+        max_retries=Retry(total=None, connect=2, read=0, status=0, backoff_factor=0.2),
+    ),
+)
 
-    for record in event["Records"]:
-        try:
-            # Log the raw message body
-            logger.info("Received SQS event body: %s", record["body"])
-            body = json.loads(record["body"])
 
-            email = body.get("email")
-            url = body.get("url")
+class AlreadyConfirmed(Exception):
+    """Raised when a confirmation link has been visited successfully before."""
 
-            if not email or not url:
-                raise ValueError(f"Missing email or url in body: {body}")
 
-            logger.info(f"Processing URL confirmation for {email}: {url}")
+class UnknownUser(Exception):
+    """Raised when the link's user has no item in the users table."""
 
-            # Send POST request and follow redirects (like curl -L -X POST)
-            response = requests.post(url, allow_redirects=True)
 
-            logger.info(
-                f"POST completed. Status: {response.status_code} | Final URL: {response.url}"
-            )
+def claim_link(email: str, url: str):
+    """Record the link as pending for the user, unless it was already confirmed.
 
-            # Only consider successful if we get HTTP 200
-            if response.status_code != 200:
-                raise Exception(
-                    f"Non-200 response from Gmail forward confirmation: {response.status_code} | Body: {response.text[:300]}"
-                )
-
-            # Upsert 'forward_confirmed' = true in DynamoDB users table
+    The condition makes redelivered messages skip the POST; a new link for a
+    user who confirmed an earlier one is still visited. It also requires the
+    user to exist, so an unknown address never creates a users item.
+    """
+    try:
+        with metrics.timer("DynamoDBUpdate"):
             dynamodb.update_item(
                 TableName=USERS_TABLE_NAME,
-                Key={"email": {"S": email}}, 
-                UpdateExpression="SET forward_confirmed = :val",
-                ExpressionAttributeValues={":val": {"BOOL": True}},
+                Key={"email": {"S": email}},
+                UpdateExpression="SET forward_confirm_link = :url, forward_requested_at = :now",
+                ConditionExpression=(
+                    "attribute_exists(email)"
+                    " AND (attribute_not_exists(confirmed_link) OR confirmed_link <> :url)"
+                ),
+                ExpressionAttributeValues={
+                    ":url": {"S": url},
+                    ":now": {"N": str(int(time.time()))},
+                },
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
             )
-            logger.info(f"DynamoDB updated: forward_confirmed = true for {email}")
+    except dynamodb.exceptions.ConditionalCheckFailedException as e:
+        if "Item" not in e.response:
+            raise UnknownUser(f"No user {email} for {url}")
+        raise AlreadyConfirmed(f"{url} was already confirmed for {email}")
 
-        except Exception as e:
-            # Log the error with traceback, then re-raise to trigger SQS retry
-            logger.error(
-                f"Error processing message for email: {body.get('email', 'unknown')}",
-                exc_info=True,
-            )
-            raise
 
-    return {"statusCode": 200, "body": "Processed all messages"}
+def mark_confirmed(email: str, url: str):
+    with metrics.timer("DynamoDBUpdate"):
+        dynamodb.update_item(
+            TableName=USERS_TABLE_NAME,
+            Key={"email": {"S": email}},
+            UpdateExpression="SET forward_confirmed = :val, confirmed_link = :url",
+            ConditionExpression="attribute_exists(email)",
+            ExpressionAttributeValues={":val": {"BOOL": True}, ":url": {"S": url}},
+        )
+
+
+def visit(record):
+    """Confirm one forwarding request; raises if it should be retried."""
+    body = json.loads(record["body"])
+    email = body.get("email")
+    url = body.get("url")
+    if not email or not url:
+        raise ValueError(f"Missing email or url in body: {body}")
+
+    logger.info(
+        f"Processing URL confirmation for {email}: {url} "
+        f"(correlation id {body.get('correlation_id')})"
+    )
+    try:
+        claim_link(email, url)
+    except AlreadyConfirmed as e:
+        logger.info("Skipping: %s", e)
+        metrics.record("GmailAlreadyConfirmed", 1)
+        return
+    except UnknownUser as e:
+        # Retrying cannot help; the request is dropped rather than left to
+        # fill the dead-letter queue
+        logger.warning("Skipping: %s", e)
+        metrics.record("GmailUnknownUser", 1)
+        return
+
+    # Send POST request and follow redirects (like curl -L -X POST)
+    with metrics.timer("GmailConfirm"):
+        response = session.post(url, allow_redirects=True, timeout=TIMEOUT)
+
+    logger.info(
+        f"POST completed. Status: {response.status_code} | Final URL: {response.url}"
+        f" | Redirects: {len(response.history)}"
+    )
+
+    # Only consider successful if we get HTTP 200
+    if response.status_code != 200:
+        raise Exception(
+            f"Non-200 response from Gmail forward confirmation: {response.status_code} | Body: {response.text[:300]}"
+        )
+
+    mark_confirmed(email, url)
+    logger.info(f"DynamoDB updated: forward_confirmed = true for {email}")
+
+
+def lambda_handler(event, context):
+    """
+    Lambda handler triggered by SQS events.
+
+    Each message holds an 'email' and a Gmail confirmation 'url'. Links are
+    visited concurrently, bounded by URL_VISITOR_CONCURRENCY, over a shared
+    keep-alive session with connect/read timeouts:
+    - Links already confirmed for that user, or for an address with no
+      users item, are skipped, by a conditional update_item on the users
+      table
+    - The URL is POSTed, following redirects
+    - On HTTP 200 the user is marked 'forward_confirmed' = true
+    Messages that fail are reported as SQS batchItemFailures, so only those
+    links are retried.
+    """
+    records = event.get("Records", [])
+    failures = []
+    if not records:
+        return {"batchItemFailures": failures}
+
+    workers = max(1, min(MAX_CONCURRENCY, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(record, executor.submit(visit, record)) for record in records]
+        for record, future in futures:
+            try:
+                future.result()
+            except Exception:
+                logger.exception("Error confirming forwarding for record %s", record["messageId"])
+                metrics.record("GmailConfirmFailed", 1)
+                failures.append({"itemIdentifier": record["messageId"]})
+
+    metrics.flush()
+    return {"batchItemFailures": failures}
@@ -1,34 +1,64 @@
 import json
 import os
-import boto3
 import logging
 import re
 
+import clients
+from inbox import Inbox
+from ledger import UPDATE_HANDLED, ClaimHeld, Ledger
+from metrics import metrics
+from routing import NotificationRouter
+from userdir import UserDirectory
+
 # Logger setup
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Environment variables
 SQS_QUEUE_URL = os.environ.get("OUTPUT_SQS_URL")
+NOTIFY_SQS_URL = os.environ.get("NOTIFY_SQS_URL")
+CHAT_HISTORY_ENABLED = os.environ.get("CHAT_HISTORY_ENABLED", "false").lower() == "true"
 PENDING_LINKS_TABLE = os.environ.get("PENDING_LINKS_TABLE", "pending_links")
 USERS_TABLE = os.environ.get("USERS_TABLE", "users")
 TELEGRAM_TABLE = os.environ.get("TELEGRAM_TABLE", "telegram")
+USER_EMAILS_TABLE = os.environ.get("USER_EMAILS_TABLE", "user_emails")
+INBOX_PAGE_SIZE = int(os.environ.get("INBOX_PAGE_SIZE", "10"))
+UPDATES_SQS_URL = os.environ.get("UPDATES_SQS_URL")
+FAST_ACK = os.environ.get("WEBHOOK_FAST_ACK", "false").lower() == "true" and bool(UPDATES_SQS_URL)
+LEDGER_TABLE = os.environ.get("LEDGER_TABLE")
 
-# AWS clients
-sqs = boto3.client("sqs")
-dynamodb = boto3.resource("dynamodb")
+# AWS clients (built on first use)
+sqs = clients.lazy_client("sqs")
+dynamodb = clients.lazy_client("dynamodb")
 
 # DynamoDB tables
-telegram_table = dynamodb.Table(TELEGRAM_TABLE)
-pending_links_table = dynamodb.Table(PENDING_LINKS_TABLE)
-users_table = dynamodb.Table(USERS_TABLE)
+pending_links_table = clients.lazy_table(PENDING_LINKS_TABLE)
+
+# Cached users/telegram lookups; lives for the lifetime of the warm container
+user_directory = UserDirectory(users_table=USERS_TABLE, telegram_table=TELEGRAM_TABLE)
+
+# Received-email listings for /recent and /from
+inbox = Inbox(USER_EMAILS_TABLE, page_size=INBOX_PAGE_SIZE)
+
+# Records handled Telegram update ids, since Telegram redelivers an update
+# whenever the webhook answers slowly or with an error
+ledger = Ledger(LEDGER_TABLE) if LEDGER_TABLE else None
 
 # Regex for detecting /link command
 LINK_PATTERN = re.compile(r"^/link\s+(\S+)$")
 
+# Regexes for the inbox commands; the optional last argument is a page cursor
+RECENT_PATTERN = re.compile(r"^/recent(?:\s+(\S+))?$")
+FROM_PATTERN = re.compile(r"^/from\s+(\S+)(?:\s+(\S+))?$")
+
 
 def handle_link_command(chat_id, link_code, user_text):
-    """Handle the /link command from a Telegram message."""
+    """Handle the /link command from a Telegram message.
+
+    The pending link is read once; consuming it, setting the user's
+    telegram_id and recording the chat then happen in one transaction, so a
+    code is used at most once and a link is never half-written.
+    """
     logger.info("Processing a /link command")
 
     pending_resp = pending_links_table.get_item(Key={"link_code": link_code})
@@ -43,27 +73,53 @@ def handle_link_command(chat_id, link_code, user_text):
         logger.warning(f"Link code {link_code} missing user_email.")
         return None
 
-    user_resp = users_table.get_item(Key={"email": user_email})
-    user = user_resp.get("Item")
-
-    if not user:
-        logger.warning(f"No user found for email: {user_email}")
+    telegram_id = str(chat_id)
+    try:
+        with metrics.timer("LinkTransaction"):
+            dynamodb.transact_write_items(
+                TransactItems=[
+                    {
+                        "Delete": {
+                            "TableName": PENDING_LINKS_TABLE,
+                            "Key": {"link_code": {"S": link_code}},
+                            "ConditionExpression": "user_email = :email",
+                            "ExpressionAttributeValues": {":email": {"S": user_email}},
+                        }
+                    },
+                    {
+                        "Update": {
+                            "TableName": USERS_TABLE,
+                            "Key": {"email": {"S": user_email}},
+                            "UpdateExpression": "SET telegram_id = :tid",
+                            "ConditionExpression": "attribute_exists(email)",
+                            "ExpressionAttributeValues": {":tid": {"S": telegram_id}},
+                        }
+                    },
+                    {
+                        "Put": {
+                            "TableName": TELEGRAM_TABLE,
+                            "Item": {
+                                "telegram_id": {"S": telegram_id},
+                                "user_email": {"S": user_email},
+                            },
+                        }
+                    },
+                ]
+            )
+    except dynamodb.exceptions.TransactionCanceledException as e:
+        reasons = [r.get("Code") for r in e.response.get("CancellationReasons", [])]
+        if reasons[:1] == ["ConditionalCheckFailed"]:
+            logger.warning(f"Link code {link_code} was already used")
+        elif reasons[1:2] == ["ConditionalCheckFailed"]:
+            logger.warning(f"No user found for email: {user_email}")
+        else:
+            raise
         return None
 
-    # Update user with telegram_id
-    users_table.update_item(
-        Key={"email": user_email},
-        UpdateExpression="SET telegram_id = :tid",
-        ExpressionAttributeValues={":tid": str(chat_id)},
-    )
-
-    telegram_payload = {"telegram_id": str(chat_id), "user_email": user_email}
-    telegram_table.put_item(Item=telegram_payload)
-
-    pending_links_table.delete_item(Key={"link_code": link_code})
+    user_directory.invalidate_user(user_email)
+    user_directory.invalidate_telegram_link(telegram_id)
 
     logger.info(f"Linked Telegram ID {chat_id} to user {user_email}")
-    logger.info(f"Deleted pending link: {link_code}")
 
     payload = {"user_email": user_email, "text": user_text}
     return payload
@@ -71,38 +127,174 @@ def handle_link_command(chat_id, link_code, user_text):
 
 def handle_regular_message(chat_id, user_text):
     """Handle any regular message (non-/link) from Telegram."""
-    try:
-        response = telegram_table.get_item(Key={"telegram_id": chat_id})
-        user_email = response["Item"]["user_email"]
+    link = user_directory.get_telegram_link(chat_id)
+    user_email = link.get("user_email") if link else None
+    if user_email:
         logger.info(f"Retrieved user_email: {user_email}")
-    except Exception as e:
+    else:
         logger.error(f"No user_email found for telegram_id: {chat_id}")
 
     return {"user_email": user_email, "text": user_text}
 
 
-def lambda_handler(event, context):
-    """Main handler for Telegram webhook Lambda."""
-    try:
-        telegram_event = json.loads(event.get("body", "{}"))
-        message = telegram_event.get("message", {})
+def format_listing(title, emails, more_command):
+    """Render an inbox page as a Telegram message."""
+    if not emails:
+        return f"{title}: nothing found."
+    lines = [f"{title}:"]
+    for email in emails:
+        sender = email.get("display_name") or email.get("from_email", "")
+        subject = email.get("subject") or "(no subject)"
+        lines.append(f"• {email['timestamp'][:16].replace('T', ' ')}  {sender}: {subject}")
+    if more_command:
+        lines.append(f"\nMore: {more_command}")
+    return "\n".join(lines)
 
-        chat_id = str(message.get("chat", {}).get("id")).strip()
-        user_text = message.get("text", "")
 
-        logger.info(f"Chat ID: {chat_id}")
-        logger.info(f"User message: {user_text}")
+def handle_inbox_command(chat_id, user_text):
+    """Handle /recent [cursor] and /from <sender> [cursor]."""
+    payload = handle_regular_message(chat_id, user_text)
+    user_email = payload["user_email"]
+    if not user_email:
+        return payload
 
-        match = LINK_PATTERN.match(user_text)
-        if match:
-            payload = handle_link_command(chat_id, match.group(1), user_text)
+    recent = RECENT_PATTERN.match(user_text)
+    try:
+        if recent:
+            emails, cursor = inbox.recent(user_email, recent.group(1))
+            title, command = "Recent emails", "/recent"
         else:
-            payload = handle_regular_message(chat_id, user_text)
+            sender, page = FROM_PATTERN.match(user_text).groups()
+            emails, cursor = inbox.from_sender(user_email, sender, page)
+            title, command = f"Emails from {sender}", f"/from {sender}"
+    except ValueError:
+        payload["text"] = "Couldn't read that page cursor; send the command without it to start over."
+        return payload
+
+    payload["text"] = format_listing(title, emails, cursor and f"{command} {cursor}")
+    return payload
+
+
+def build_reply(update):
+    """Return the payload to send for a Telegram update, or None if there is none."""
+    message = update.get("message", {})
+    if not message:
+        logger.info("Ignoring update %s without a message", update.get("update_id"))
+        return None
 
-        sqs.send_message(QueueUrl=SQS_QUEUE_URL, MessageBody=json.dumps(payload))
+    chat_id = str(message.get("chat", {}).get("id")).strip()
+    user_text = message.get("text", "")
+
+    logger.info(f"Chat ID: {chat_id}")
+    logger.info(f"User message: {user_text}")
+
+    match = LINK_PATTERN.match(user_text)
+    if match:
+        return handle_link_command(chat_id, match.group(1), user_text)
+    if RECENT_PATTERN.match(user_text) or FROM_PATTERN.match(user_text):
+        return handle_inbox_command(chat_id, user_text)
+    return handle_regular_message(chat_id, user_text)
+
+
+def update_key(update):
+    return f"telegram-update-{update['update_id']}"
+
+
+def claim_update(update) -> bool:
+    """Claim an update in the ledger; False if it was already handled."""
+    if ledger and not ledger.claim(update_key(update), UPDATE_HANDLED):
+        logger.info("Skipping update %s; already handled", update["update_id"])
+        return False
+    return True
+
+
+def settle_update(update, handled: bool):
+    if not ledger:
+        return
+    if handled:
+        ledger.complete(update_key(update), UPDATE_HANDLED)
+    else:
+        ledger.release(update_key(update), UPDATE_HANDLED)
+
+
+def process_updates(updates, retry_held=True):
+    """Handle (ref, update) pairs and queue their replies.
+
+    Returns the refs of updates that failed and should be retried. With
+    retry_held, updates another delivery is working on count as failed, so
+    they are checked again once that delivery has finished.
+    """
+    router = NotificationRouter(sqs, SQS_QUEUE_URL, NOTIFY_SQS_URL, CHAT_HISTORY_ENABLED)
+    failures, claimed = [], []
+    for ref, update in updates:
+        try:
+            if not claim_update(update):
+                continue
+        except ClaimHeld as e:
+            logger.info("Update in progress elsewhere: %s", e)
+            if retry_held:
+                failures.append(ref)
+            continue
+        try:
+            payload = build_reply(update)
+            if payload:
+                router.add(json.dumps(payload), ref)
+            claimed.append((ref, update))
+        except Exception:
+            logger.exception("Failed to process update %s", update.get("update_id"))
+            settle_update(update, handled=False)
+            failures.append(ref)
+
+    failed = set(router.flush())
+    for ref, update in claimed:
+        settle_update(update, handled=ref not in failed)
+    return failures + [ref for ref, _ in claimed if ref in failed]
+
+
+def handle_queued_updates(records):
+    """Process updates the fast-ack path queued; reports SQS batchItemFailures."""
+    logger.info("Received %d queued updates", len(records))
+    updates = []
+    failures = []
+    for record in records:
+        try:
+            updates.append((record["messageId"], json.loads(record["body"])))
+        except ValueError:
+            logger.exception("Dropping unreadable update")
+    failures.extend(process_updates(updates))
+    return {"batchItemFailures": [{"itemIdentifier": i} for i in failures]}
+
+
+def lambda_handler(event, context):
+    """Main handler for Telegram webhook Lambda.
+
+    Invoked through the function URL by Telegram, and, in fast-ack mode, by
+    the updates queue. In fast-ack mode the function URL only checks and
+    queues the raw update, answering Telegram before any DynamoDB work.
+    """
+    try:
+        if "Records" in event:
+            return handle_queued_updates(event["Records"])
+
+        body = event.get("body") or "{}"
+        update = json.loads(body)
+        if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+            # Not something Telegram would resend correctly; acknowledge it
+            logger.warning("Ignoring a request without an update_id")
+            return {"statusCode": 200, "body": json.dumps({"status": "ignored"})}
+
+        if FAST_ACK:
+            with metrics.timer("UpdateEnqueue"):
+                sqs.send_message(QueueUrl=UPDATES_SQS_URL, MessageBody=body)
+        # A concurrent delivery's own response decides whether Telegram retries
+        elif process_updates([(update["update_id"], update)], retry_held=False):
+            raise RuntimeError(f"Failed to process update {update['update_id']}")
 
         return {"statusCode": 200, "body": json.dumps({"status": "ok"})}
 
     except Exception as e:
         logger.exception("Failed to process Telegram webhook event")
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+    finally:
+        metrics.flush()
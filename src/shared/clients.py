@@ -0,0 +1,90 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Defaults for every client: fail fast on connect, keep connections alive,
+# and leave room in the pool for the handlers' worker threads
+DEFAULT_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=10,
+    max_pool_connections=25,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "max_attempts": 3},
+)
+
+# Per-service overrides; model calls are slow and throttled under load
+SERVICE_CONFIG = {
+    "bedrock-runtime": Config(
+        read_timeout=60,
+        retries={"mode": "adaptive", "max_attempts": 4},
+    ),
+}
+
+_clients = {}
+_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def config_for(service: str) -> Config:
+    override = SERVICE_CONFIG.get(service)
+    return DEFAULT_CONFIG.merge(override) if override else DEFAULT_CONFIG
+
+
+def client(service: str, region_name: str | None = None):
+    """Return the shared client for service, building it on first use.
+
+    Low-level clients are thread-safe, so one instance is shared by all
+    threads. Creation is serialized, as the default session is not.
+    """
+    key = (service, region_name)
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                _clients[key] = boto3.client(
+                    service, region_name=region_name, config=config_for(service)
+                )
+    return _clients[key]
+
+
+def table(name: str):
+    """Return a DynamoDB Table owned by the calling thread.
+
+    boto3 resources are not thread-safe, so each thread builds its own from
+    its own session, on first use. That costs a session and resource per
+    thread, so only use it from long-lived threads (the handler's own, or a
+    module-level executor); per-invocation worker threads should use the
+    shared low-level client instead.
+    """
+    if not hasattr(_thread_local, "tables"):
+        _thread_local.resource = None
+        _thread_local.tables = {}
+    if name not in _thread_local.tables:
+        if _thread_local.resource is None:
+            _thread_local.resource = boto3.session.Session().resource(
+                "dynamodb", config=config_for("dynamodb")
+            )
+        _thread_local.tables[name] = _thread_local.resource.Table(name)
+    return _thread_local.tables[name]
+
+
+class Lazy:
+    """Module-level stand-in for a client or table that is built on first use.
+
+    Attribute access is forwarded to whatever factory() returns, so call
+    sites such as s3.get_object(...) are unchanged.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+def lazy_client(service: str, region_name: str | None = None) -> Lazy:
+    return Lazy(lambda: client(service, region_name))
+
+
+def lazy_table(name: str) -> Lazy:
+    return Lazy(lambda: table(name))
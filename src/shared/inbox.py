@@ -0,0 +1,151 @@
+import base64
+import binascii
+import json
+from email.utils import getaddresses
+
+import clients
+from metrics import metrics
+from userdir import deserialize
+
+# Global secondary index on user_emails: (user_email, sender_timestamp)
+SENDER_INDEX = "sender_index"
+
+# Key attributes besides user_email, and so the fields of a cursor, for a
+# query of the table and of the sender index
+TABLE_KEYS = ("timestamp",)
+SENDER_INDEX_KEYS = ("sender_timestamp", "timestamp")
+
+# Separates the sender from the timestamp in sender_timestamp
+SENDER_SEPARATOR = "#"
+
+# Attributes returned for a listing; everything else stays in DynamoDB
+LISTING_ATTRIBUTES = ("#ts", "from_email", "display_name", "subject")
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+
+def normalize_address(address: str) -> str:
+    return address.strip().lower()
+
+
+def recipient_address(msg) -> str | None:
+    """Return the mailbox an email was delivered for, normalized.
+
+    Gmail's forwarding header names the forwarding account first, which is
+    the user even when the original To header lists several recipients.
+    Otherwise the first address in To is used.
+    """
+    for header in ("X-Forwarded-For", "To"):
+        value = msg.get(header)
+        if not value:
+            continue
+        if header == "X-Forwarded-For":
+            value = value.split()[0]
+        addresses = [addr for _, addr in getaddresses([str(value)]) if "@" in addr]
+        if addresses:
+            return normalize_address(addresses[0])
+    return None
+
+
+def sender_timestamp(from_email: str, timestamp: str) -> str:
+    """Sort key of the sender index: newest-first per sender within a user."""
+    return f"{normalize_address(from_email)}{SENDER_SEPARATOR}{timestamp}"
+
+
+def encode_cursor(last_key: dict | None) -> str | None:
+    """Turn a LastEvaluatedKey into an opaque cursor.
+
+    The user_email partition key is left out: it is filled back in from the
+    requesting user, so a cursor can never page through another mailbox.
+    """
+    if not last_key:
+        return None
+    position = {name: value for name, value in deserialize(last_key).items() if name != "user_email"}
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str | None, user_email: str, keys: tuple[str, ...]) -> dict | None:
+    """Turn a cursor back into an ExclusiveStartKey for the requesting user.
+
+    keys are the key attributes, besides user_email, of the table or index
+    being queried; a cursor with any other set of keys raises ValueError,
+    as DynamoDB would reject it as a start key.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if (
+        not isinstance(position, dict)
+        or set(position) != set(keys)
+        or not all(isinstance(v, str) and v for v in position.values())
+    ):
+        raise ValueError("Invalid cursor")
+    return {"user_email": {"S": user_email}, **{k: {"S": v} for k, v in position.items()}}
+
+
+class Inbox:
+    """Paginated reads of a user's received emails from the user_emails table.
+
+    Every read is a key-condition Query on the user's partition, either of
+    the table (newest first) or of the sender index, and projects only the
+    listing attributes, so cost tracks the page size rather than the size
+    of the mailbox. Pages are returned with an opaque cursor for the next.
+    """
+
+    def __init__(self, table_name, page_size=DEFAULT_PAGE_SIZE, client=None):
+        self.table_name = table_name
+        self.page_size = page_size
+        self.client = client or clients.lazy_client("dynamodb")
+
+    def recent(self, user_email: str, cursor: str | None = None, limit: int | None = None):
+        """Return (emails, next_cursor) for the user's newest emails."""
+        return self._query(
+            decode_cursor(cursor, user_email, TABLE_KEYS),
+            limit,
+            KeyConditionExpression="user_email = :email",
+            ExpressionAttributeValues={":email": {"S": user_email}},
+        )
+
+    def from_sender(
+        self, user_email: str, sender: str, cursor: str | None = None, limit: int | None = None
+    ):
+        """Return (emails, next_cursor) for the user's emails from sender.
+
+        A full address matches that sender only, newest first; anything else
+        is matched as a prefix of the sender address.
+        """
+        prefix = normalize_address(sender)
+        if "@" in prefix and not prefix.endswith("@"):
+            prefix += SENDER_SEPARATOR
+        start_key = decode_cursor(cursor, user_email, SENDER_INDEX_KEYS)
+        # A start key outside the sender's range fails the query
+        if start_key and not start_key["sender_timestamp"]["S"].startswith(prefix):
+            raise ValueError("Invalid cursor")
+        return self._query(
+            start_key,
+            limit,
+            IndexName=SENDER_INDEX,
+            KeyConditionExpression="user_email = :email AND begins_with(sender_timestamp, :sender)",
+            ExpressionAttributeValues={":email": {"S": user_email}, ":sender": {"S": prefix}},
+        )
+
+    def _query(self, start_key, limit, **query):
+        if start_key:
+            query["ExclusiveStartKey"] = start_key
+        with metrics.timer("DynamoDBQuery"):
+            response = self.client.query(
+                TableName=self.table_name,
+                ScanIndexForward=False,
+                Limit=min(limit or self.page_size, MAX_PAGE_SIZE),
+                ProjectionExpression=", ".join(LISTING_ATTRIBUTES),
+                ExpressionAttributeNames={"#ts": "timestamp"},
+                **query,
+            )
+        emails = [deserialize(item) for item in response.get("Items", [])]
+        return emails, encode_cursor(response.get("LastEvaluatedKey"))
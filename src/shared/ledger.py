@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+import clients
+from metrics import metrics
+from userdir import BATCH_GET_LIMIT, MAX_BATCH_GET_ATTEMPTS, deserialize
+
+logger = logging.getLogger()
+
+# Pipeline stages recorded per message, in order
+SANITIZED = "sanitized"
+CLASSIFIED = "classified"
+NOTIFIED = "notified"
+
+# Recorded by the webhook per Telegram update, keyed by telegram-update-<id>
+UPDATE_HANDLED = "handled"
+
+# Long enough to outlive SQS retention (4 days by default) plus redrives
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+# How long a claim blocks duplicates before a redelivery may take over
+DEFAULT_LEASE_SECONDS = 300
+
+
+class ClaimHeld(Exception):
+    """Raised when another delivery of a message holds the stage's lease."""
+
+
+class Ledger:
+    """Conditional-write record of which stages have completed for each email.
+
+    Entries are keyed by the correlation id (the SES object key) and hold a
+    <stage>_at timestamp per completed stage, a <stage>_lease while a stage is
+    in progress, and the classification result so replays never call the
+    model again. Writes are conditional, so two deliveries of the same message
+    cannot both claim a stage.
+
+    Ledger errors other than a lost claim are logged and treated as "not
+    recorded": duplicates are only suppressed while the ledger is reachable.
+    """
+
+    def __init__(
+        self,
+        table_name,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+        client=None,
+    ):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.client = client or clients.lazy_client("dynamodb")
+
+    def get_many(self, message_ids) -> dict:
+        """Return ledger entries for message_ids, keyed by id; missing ids are left out."""
+        ids = sorted({message_id for message_id in message_ids if message_id})
+        entries = {}
+        for start in range(0, len(ids), BATCH_GET_LIMIT):
+            chunk = ids[start : start + BATCH_GET_LIMIT]
+            request = {
+                self.table_name: {"Keys": [{"message_id": {"S": i}} for i in chunk]}
+            }
+            for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+                try:
+                    with metrics.timer("LedgerRead"):
+                        response = self.client.batch_get_item(RequestItems=request)
+                except ClientError:
+                    logger.exception("Failed to read the message ledger")
+                    break
+                for item in response.get("Responses", {}).get(self.table_name, []):
+                    entry = deserialize(item)
+                    entries[entry["message_id"]] = entry
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                time.sleep(0.05 * 2**attempt)
+        return entries
+
+    def claim(self, message_id: str, stage: str) -> bool:
+        """Claim stage for a message, returning False if the stage is already done.
+
+        Raises ClaimHeld if another delivery is working on the stage, in which
+        case the caller should let SQS redeliver the record later.
+        """
+        now = int(time.time())
+        try:
+            with metrics.timer("LedgerWrite"):
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key={"message_id": {"S": message_id}},
+                    UpdateExpression="SET #lease = :until, expires_at = :expires",
+                    ConditionExpression=(
+                        "attribute_not_exists(#done) AND "
+                        "(attribute_not_exists(#lease) OR #lease < :now)"
+                    ),
+                    ExpressionAttributeNames={
+                        "#done": f"{stage}_at",
+                        "#lease": f"{stage}_lease",
+                    },
+                    ExpressionAttributeValues={
+                        ":now": {"N": str(now)},
+                        ":until": {"N": str(now + self.lease_seconds)},
+                        ":expires": {"N": str(now + self.ttl_seconds)},
+                    },
+                    ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException as e:
+            metrics.record("DuplicateSuppressed", 1)
+            if is_done(deserialize(e.response.get("Item", {})), stage):
+                return False
+            raise ClaimHeld(f"{stage} for {message_id} is claimed by another delivery")
+        except ClientError:
+            logger.exception("Failed to claim %s for %s; proceeding", stage, message_id)
+            return True
+
+    def complete(self, message_id: str, stage: str, classification: dict | None = None):
+        """Mark stage done for a message, storing its classification if given."""
+        now = int(time.time())
+        update = "SET #done = :now, expires_at = :expires"
+        values = {
+            ":now": {"N": str(now)},
+            ":expires": {"N": str(now + self.ttl_seconds)},
+        }
+        if classification is not None:
+            update += ", classification = :classification"
+            values[":classification"] = {"S": json.dumps(classification)}
+        try:
+            with metrics.timer("LedgerWrite"):
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key={"message_id": {"S": message_id}},
+                    UpdateExpression=update + " REMOVE #lease",
+                    ExpressionAttributeNames={
+                        "#done": f"{stage}_at",
+                        "#lease": f"{stage}_lease",
+                    },
+                    ExpressionAttributeValues=values,
+                )
+        except ClientError:
+            logger.exception("Failed to record %s for %s", stage, message_id)
+
+    def release(self, message_id: str, stage: str):
+        """Drop a claim after a failure so a redelivery can retry straight away."""
+        try:
+            with metrics.timer("LedgerWrite"):
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key={"message_id": {"S": message_id}},
+                    UpdateExpression="REMOVE #lease",
+                    ExpressionAttributeNames={"#lease": f"{stage}_lease"},
+                )
+        except ClientError:
+            logger.exception("Failed to release %s for %s", stage, message_id)
+
+
+def is_done(entry: dict | None, stage: str) -> bool:
+    return bool(entry) and f"{stage}_at" in entry
+
+
+def stored_classification(entry: dict | None) -> dict | None:
+    """Return the classification recorded in a ledger entry, if any."""
+    if entry and entry.get("classification"):
+        return json.loads(entry["classification"])
+    return None
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "needl.email")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+
+# CloudWatch accepts at most 100 values per metric in one EMF record
+MAX_VALUES_PER_RECORD = 100
+
+# Fields carried on every message from the sanitizer to the notifier
+TRACE_FIELDS = ("correlation_id", "received_at")
+
+
+class Metrics:
+    """Collect timings and counts, and emit them as CloudWatch EMF records.
+
+    Values are buffered per metric and written by flush(), normally once at
+    the end of an invocation, as JSON log lines that CloudWatch turns into
+    metrics with a Function dimension. Safe to use from worker threads.
+    """
+
+    def __init__(self, function_name=FUNCTION_NAME, namespace=NAMESPACE):
+        self.function_name = function_name
+        self.namespace = namespace
+        self.sink = print
+        self._values = defaultdict(list)
+        self._units = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, value: float, unit: str = "Count"):
+        with self._lock:
+            self._values[name].append(value)
+            self._units[name] = unit
+
+    @contextmanager
+    def timer(self, name: str):
+        """Record the duration of the with block in milliseconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, "Milliseconds")
+
+    def flush(self):
+        with self._lock:
+            values, self._values = self._values, defaultdict(list)
+            units = dict(self._units)
+        if not values:
+            return
+
+        timestamp = int(time.time() * 1000)
+        chunks = max(len(v) for v in values.values())
+        for start in range(0, chunks, MAX_VALUES_PER_RECORD):
+            record = {"Function": self.function_name}
+            definitions = []
+            for name, metric_values in values.items():
+                chunk = metric_values[start : start + MAX_VALUES_PER_RECORD]
+                if chunk:
+                    record[name] = chunk
+                    definitions.append({"Name": name, "Unit": units[name]})
+            record["_aws"] = {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Function"]],
+                        "Metrics": definitions,
+                    }
+                ],
+            }
+            self.sink(json.dumps(record))
+
+
+def trace_fields(message: dict) -> dict:
+    """Return the correlation fields of a message, to copy onto the next one."""
+    return {field: message[field] for field in TRACE_FIELDS if field in message}
+
+
+def epoch_millis(timestamp: str | None = None) -> int:
+    """Convert an ISO 8601 event time (or now, if None) to epoch milliseconds."""
+    if not timestamp:
+        return int(time.time() * 1000)
+    return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def record_end_to_end(message: dict):
+    """Record receive-to-now latency for a message carrying received_at."""
+    received_at = message.get("received_at")
+    if received_at:
+        metrics.record("EndToEndLatency", epoch_millis() - received_at, "Milliseconds")
+
+
+# One collector per Lambda process
+metrics = Metrics()
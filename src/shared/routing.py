@@ -0,0 +1,72 @@
+import logging
+import threading
+
+from metrics import metrics
+
+logger = logging.getLogger()
+
+# send_message_batch accepts at most 10 entries per call
+MAX_BATCH_ENTRIES = 10
+
+
+class BatchSender:
+    """Buffer messages for one SQS queue and send them with send_message_batch.
+
+    Each message carries a caller-supplied reference (typically the SQS
+    messageId of the record it came from) so failed entries can be reported
+    back as batchItemFailures.
+    """
+
+    def __init__(self, sqs, queue_url: str):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, body: str, ref=None):
+        with self._lock:
+            self._pending.append((body, ref))
+
+    def flush(self) -> list:
+        """Send everything buffered and return the refs of messages that failed."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        failed = []
+        for start in range(0, len(pending), MAX_BATCH_ENTRIES):
+            chunk = pending[start : start + MAX_BATCH_ENTRIES]
+            entries = [
+                {"Id": str(i), "MessageBody": body} for i, (body, _) in enumerate(chunk)
+            ]
+            try:
+                with metrics.timer("SQSSend"):
+                    response = self.sqs.send_message_batch(
+                        QueueUrl=self.queue_url, Entries=entries
+                    )
+            except Exception:
+                logger.exception("Failed to send message batch to %s", self.queue_url)
+                failed.extend(ref for _, ref in chunk)
+                continue
+            for failure in response.get("Failed", []):
+                logger.error("SQS rejected message: %s", failure)
+                failed.append(chunk[int(failure["Id"])][1])
+        return failed
+
+
+class NotificationRouter:
+    """Route user-facing messages to the chat stage or straight to the notifier.
+
+    The chat Lambda only adds value once chat history is recorded, so unless
+    chat_history_enabled is set, messages skip it and go to the notify queue.
+    """
+
+    def __init__(self, sqs, chat_queue_url, notify_queue_url, chat_history_enabled):
+        use_chat = chat_history_enabled or not notify_queue_url
+        self.queue_url = chat_queue_url if use_chat else notify_queue_url
+        self.sender = BatchSender(sqs, self.queue_url)
+
+    def add(self, body: str, ref=None):
+        self.sender.add(body, ref)
+
+    def flush(self) -> list:
+        return self.sender.flush()
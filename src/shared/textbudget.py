@@ -0,0 +1,112 @@
+import re
+
+# Rough token estimate used across the pipeline
+CHARS_PER_TOKEN = 4
+
+# Lines longer than this are treated as flattened HTML text, not plain text lines
+MAX_LINE_CHARS = 200
+
+REPLY_HEADER_PATTERN = re.compile(r"^On\b.{0,300}\bwrote:\s*$", re.IGNORECASE)
+ORIGINAL_MESSAGE_PATTERN = re.compile(
+    r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.IGNORECASE
+)
+OUTLOOK_FROM_PATTERN = re.compile(r"^\*?From:\*?\s+\S")
+OUTLOOK_SENT_PATTERN = re.compile(r"^\*?(?:Sent|Date):\*?\s+\S")
+SIGNATURE_PATTERN = re.compile(
+    r"^(?:--\s?|_{5,}|Sent from my \w+.*|Get Outlook for \w+.*)$", re.IGNORECASE
+)
+FOOTER_PATTERN = re.compile(
+    r"unsubscribe|manage (?:your )?(?:email )?(?:preferences|subscriptions)"
+    r"|view (?:this email )?in (?:your |a )?browser|all rights reserved"
+    r"|privacy policy|you are receiving this|this (?:email|message) was sent to"
+    r"|©|copyright \d{4}",
+    re.IGNORECASE,
+)
+SENTENCE_END_PATTERN = re.compile(r"[.!?|]\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of model tokens in text."""
+    return len(text) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the start of text within max_tokens, cutting at a word boundary."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", max_chars - max_chars // 10, max_chars)
+    return text[: cut if cut > 0 else max_chars].rstrip()
+
+
+def strip_quoted_replies(text: str) -> str:
+    """Drop '>' quoted lines and everything after a reply or Outlook header."""
+    lines = text.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith(">"):
+            continue
+        if REPLY_HEADER_PATTERN.match(stripped) or ORIGINAL_MESSAGE_PATTERN.match(
+            stripped
+        ):
+            break
+        # Gmail wraps long reply headers onto a second line
+        if (
+            stripped.startswith("On ")
+            and i + 1 < len(lines)
+            and lines[i + 1].strip().lower().startswith("wrote:")
+        ):
+            break
+        if OUTLOOK_FROM_PATTERN.match(stripped) and any(
+            OUTLOOK_SENT_PATTERN.match(following.strip())
+            for following in lines[i + 1 : i + 4]
+        ):
+            break
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def strip_signature(text: str) -> str:
+    """Drop a trailing signature block and mobile 'Sent from' lines."""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if i > 0 and SIGNATURE_PATTERN.match(line.strip()):
+            return "\n".join(lines[:i])
+    return text
+
+
+def strip_footers(text: str) -> str:
+    """Drop boilerplate footer lines such as unsubscribe and copyright notices.
+
+    Flattened HTML arrives as one long line, so for long lines the text is cut
+    at the first footer marker in the final quarter instead.
+    """
+    kept = []
+    for line in text.splitlines():
+        if len(line) <= MAX_LINE_CHARS:
+            if not FOOTER_PATTERN.search(line):
+                kept.append(line)
+            continue
+
+        tail_start = len(line) - len(line) // 4
+        match = FOOTER_PATTERN.search(line, tail_start)
+        if match:
+            sentence_ends = list(
+                SENTENCE_END_PATTERN.finditer(line, tail_start - 100, match.start())
+            )
+            cut = sentence_ends[-1].start() + 1 if sentence_ends else match.start()
+            line = line[:cut]
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def classification_view(body: str, max_tokens: int) -> str:
+    """Reduce an email body to its most informative part within a token budget.
+
+    Quoted replies, the signature and boilerplate footers are removed before
+    the start of what remains is kept. If stripping leaves nothing, the
+    original body is truncated instead.
+    """
+    view = strip_footers(strip_signature(strip_quoted_replies(body))).strip()
+    return truncate_to_tokens(view or body.strip(), max_tokens)
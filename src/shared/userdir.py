@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+
+from boto3.dynamodb.types import TypeDeserializer
+
+import clients
+from metrics import metrics
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+MAX_BATCH_GET_ATTEMPTS = 5
+
+_deserializer = TypeDeserializer()
+
+
+def deserialize(item: dict) -> dict:
+    """Convert a low-level DynamoDB item into plain Python values."""
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value) for key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key, value, ttl_seconds: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class UserDirectory:
+    """Cached read access to the users and telegram tables.
+
+    Lives at module level so the cache persists across warm invocations. It
+    uses the shared low-level DynamoDB client, which unlike boto3 resources is
+    safe to share between threads, and is built on first lookup. Missing users are cached for a shorter time so
+    new signups are picked up quickly, as are re-reads that found a user
+    still lacking a required attribute.
+    """
+
+    def __init__(
+        self,
+        users_table="users",
+        telegram_table="telegram",
+        ttl_seconds=300,
+        missing_ttl_seconds=30,
+        max_size=4096,
+        client=None,
+    ):
+        self.users_table = users_table
+        self.telegram_table = telegram_table
+        self.ttl_seconds = ttl_seconds
+        self.missing_ttl_seconds = missing_ttl_seconds
+        self.client = client or clients.lazy_client("dynamodb")
+        self._users = TTLCache(max_size)
+        self._telegram = TTLCache(max_size)
+        # (email, attribute) pairs re-read recently and still missing it
+        self._rechecked = TTLCache(max_size)
+
+    def _remember(self, cache, key, item):
+        ttl = self.ttl_seconds if item is not None else self.missing_ttl_seconds
+        cache.put(key, item, ttl)
+
+    def get_user(self, email: str, require: str | None = None) -> dict | None:
+        """Return the user item for email, or None if there is no such user.
+
+        If require names an attribute that the cached item lacks, the item is
+        re-read, since it may have been set by another container since. A
+        re-read that still lacks it is trusted for missing_ttl_seconds, like
+        a missing user, so repeated lookups do not each go to DynamoDB.
+        """
+        found, user = self._users.get(email)
+        if found and (
+            user is None
+            or require is None
+            or require in user
+            or self._rechecked.get((email, require))[0]
+        ):
+            return user
+
+        with metrics.timer("DynamoDBLookup"):
+            response = self.client.get_item(
+                TableName=self.users_table, Key={"email": {"S": email}}
+            )
+        user = deserialize(response["Item"]) if "Item" in response else None
+        self._remember(self._users, email, user)
+        if user is not None and require is not None and require not in user:
+            self._rechecked.put((email, require), True, self.missing_ttl_seconds)
+        return user
+
+    def prefetch(self, emails):
+        """Load every uncached user in emails with as few BatchGetItem calls as possible."""
+        missing = sorted(
+            {email for email in emails if email and not self._users.get(email)[0]}
+        )
+        for start in range(0, len(missing), BATCH_GET_LIMIT):
+            chunk = missing[start : start + BATCH_GET_LIMIT]
+            found = {}
+            request = {
+                self.users_table: {"Keys": [{"email": {"S": email}} for email in chunk]}
+            }
+            for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+                with metrics.timer("DynamoDBLookup"):
+                    response = self.client.batch_get_item(RequestItems=request)
+                for item in response.get("Responses", {}).get(self.users_table, []):
+                    user = deserialize(item)
+                    found[user["email"]] = user
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                time.sleep(0.05 * 2**attempt)
+
+            unprocessed = {
+                key["email"]["S"]
+                for key in (request or {}).get(self.users_table, {}).get("Keys", [])
+            }
+            for email in chunk:
+                if email not in unprocessed:
+                    self._remember(self._users, email, found.get(email))
+
+    def get_telegram_link(self, chat_id: str) -> dict | None:
+        """Return the telegram table item for a chat id, or None if unlinked."""
+        found, link = self._telegram.get(chat_id)
+        if found:
+            return link
+
+        with metrics.timer("DynamoDBLookup"):
+            response = self.client.get_item(
+                TableName=self.telegram_table, Key={"telegram_id": {"S": chat_id}}
+            )
+        link = deserialize(response["Item"]) if "Item" in response else None
+        self._remember(self._telegram, chat_id, link)
+        return link
+
+    def invalidate_user(self, email: str):
+        self._users.invalidate(email)
+
+    def invalidate_telegram_link(self, chat_id: str):
+        self._telegram.invalidate(chat_id)
@@ -31,6 +31,20 @@ resource "aws_dynamodb_table" "user_emails" {
     type = "S"
   }
 
+  attribute {
+    name = "sender_timestamp"
+    type = "S"
+  }
+
+  # Per-user listing by sender; keys only plus what /from displays
+  global_secondary_index {
+    name               = "sender_index"
+    hash_key           = "user_email"
+    range_key          = "sender_timestamp"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["from_email", "display_name", "subject"]
+  }
+
   tags = {
     Name        = "user_emails"
     Environment = "prod"
@@ -70,4 +84,75 @@ resource "aws_dynamodb_table" "telegram" {
     Environment = "prod"
     App         = var.app_name
   }
-}
\ No newline at end of file
+}
+resource "aws_dynamodb_table" "classification_cache" {
+  name         = "classification_cache"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "fingerprint"
+
+  attribute {
+    name = "fingerprint"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "classification_cache"
+    Environment = "prod"
+    App         = var.app_name
+  }
+}
+
+resource "aws_dynamodb_table" "message_ledger" {
+  name         = "message_ledger"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "message_id"
+
+  attribute {
+    name = "message_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "message_ledger"
+    Environment = "prod"
+    App         = var.app_name
+  }
+}
+
+resource "aws_dynamodb_table" "notification_digest" {
+  name         = "notification_digest"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "user_email"
+  range_key    = "item_id"
+
+  attribute {
+    name = "user_email"
+    type = "S"
+  }
+
+  attribute {
+    name = "item_id"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "notification_digest"
+    Environment = "prod"
+    App         = var.app_name
+  }
+}
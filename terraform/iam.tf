@@ -80,6 +80,20 @@ resource "aws_iam_policy" "lambda_policy" {
         ],
         Resource = aws_dynamodb_table.user_emails.arn
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "sqs:SendMessage"
+        ],
+        Resource = aws_sqs_queue.sanitized_queue.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:UpdateItem"
+        ],
+        Resource = aws_dynamodb_table.message_ledger.arn
+      },
     ]
   })
 }
@@ -173,6 +187,13 @@ resource "aws_iam_policy" "classifier_lambda_policy" {
         ],
         Resource = "${aws_s3_bucket.s3_bucket_sanitized.arn}/*"
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "s3:PutObject"
+        ],
+        Resource = "${aws_s3_bucket.s3_bucket_sanitized.arn}/training/prefilter/*"
+      },
       {
         Effect = "Allow",
         Action = [
@@ -189,23 +210,45 @@ resource "aws_iam_policy" "classifier_lambda_policy" {
         ],
         Resource = [
           aws_sqs_queue.chat_queue.arn,
+          aws_sqs_queue.notify_queue.arn,
           aws_sqs_queue.url_visitor_queue.arn
         ]
       },
       {
         Effect = "Allow",
         Action = [
-          "dynamodb:GetItem"
+          "dynamodb:GetItem",
+          "dynamodb:BatchGetItem"
         ],
         Resource = aws_dynamodb_table.users.arn
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem"
+        ],
+        Resource = aws_dynamodb_table.classification_cache.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:BatchGetItem",
+          "dynamodb:UpdateItem"
+        ],
+        Resource = aws_dynamodb_table.message_ledger.arn
+      },
       {
         Sid    = "AllowInvokeBedrockModel",
         Effect = "Allow",
         Action = [
-          "bedrock:InvokeModel"
+          "bedrock:InvokeModel",
+          "bedrock:InvokeModelWithResponseStream"
         ],
-        Resource = "arn:aws:bedrock:us-east-1::foundation-model/${local.bedrock_model_id}"
+        Resource = compact([
+          "arn:aws:bedrock:us-east-1::foundation-model/${local.bedrock_model_id}",
+          var.bedrock_fast_model_id == "" ? "" : "arn:aws:bedrock:us-east-1::foundation-model/${var.bedrock_fast_model_id}"
+        ])
       }
     ]
   })
@@ -249,16 +292,35 @@ resource "aws_iam_policy" "notifier_lambda_policy" {
         Action = [
           "sqs:ReceiveMessage",
           "sqs:DeleteMessage",
-          "sqs:GetQueueAttributes"
+          "sqs:GetQueueAttributes",
+          "sqs:SendMessage"
         ],
         Resource = aws_sqs_queue.notify_queue.arn
       },
       {
         Effect = "Allow",
         Action = [
-          "dynamodb:GetItem"
+          "dynamodb:GetItem",
+          "dynamodb:BatchGetItem"
         ],
         Resource = aws_dynamodb_table.users.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:UpdateItem"
+        ],
+        Resource = aws_dynamodb_table.message_ledger.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:PutItem",
+          "dynamodb:DeleteItem",
+          "dynamodb:Query",
+          "dynamodb:BatchWriteItem"
+        ],
+        Resource = aws_dynamodb_table.notification_digest.arn
       }
     ]
   })
@@ -302,7 +364,20 @@ resource "aws_iam_policy" "webhook_lambda_policy" {
         Action = [
           "sqs:SendMessage"
         ],
-        Resource = aws_sqs_queue.chat_queue.arn
+        Resource = [
+          aws_sqs_queue.chat_queue.arn,
+          aws_sqs_queue.notify_queue.arn,
+          aws_sqs_queue.telegram_updates_queue.arn
+        ]
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ],
+        Resource = aws_sqs_queue.telegram_updates_queue.arn
       },
       {
         Effect = "Allow",
@@ -312,6 +387,13 @@ resource "aws_iam_policy" "webhook_lambda_policy" {
         ],
         Resource = aws_dynamodb_table.pending_links.arn
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:UpdateItem"
+        ],
+        Resource = aws_dynamodb_table.message_ledger.arn
+      },
       {
         Effect = "Allow",
         Action = [
@@ -327,6 +409,16 @@ resource "aws_iam_policy" "webhook_lambda_policy" {
           "dynamodb:PutItem"
         ],
         Resource = aws_dynamodb_table.telegram.arn
+      },
+      {
+        Effect = "Allow",
+        Action = [
+          "dynamodb:Query"
+        ],
+        Resource = [
+          aws_dynamodb_table.user_emails.arn,
+          "${aws_dynamodb_table.user_emails.arn}/index/sender_index"
+        ]
       }
     ]
   })
@@ -12,15 +12,19 @@ resource "aws_lambda_function" "needl_email_sanitizer" {
     variables = {
       OUTPUT_S3_BUCKET  = aws_s3_bucket.s3_bucket_sanitized.bucket
       USER_EMAILS_TABLE = aws_dynamodb_table.user_emails.name
+      CLASSIFY_SQS_URL  = aws_sqs_queue.sanitized_queue.url
+      INLINE_CLASSIFY   = var.inline_classify
+      LEDGER_TABLE      = aws_dynamodb_table.message_ledger.name
     }
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sqs_trigger" {
-  event_source_arn = aws_sqs_queue.ses_email_queue.arn
-  function_name    = aws_lambda_function.needl_email_sanitizer.arn
-  batch_size       = 10
-  enabled          = true
+  event_source_arn        = aws_sqs_queue.ses_email_queue.arn
+  function_name           = aws_lambda_function.needl_email_sanitizer.arn
+  batch_size              = 10
+  enabled                 = true
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 
@@ -35,20 +39,35 @@ resource "aws_lambda_function" "needl_email_classifier" {
 
   environment {
     variables = {
-      USER_EMAILS_TABLE    = aws_dynamodb_table.user_emails.name
-      BEDROCK_MODEL_ID     = local.bedrock_model_id
-      OUTPUT_SQS_URL       = aws_sqs_queue.chat_queue.url
-      OUTPUT_SQS_URL_GMAIL = aws_sqs_queue.url_visitor_queue.url
-      REGION               = var.aws_region
+      USER_EMAILS_TABLE               = aws_dynamodb_table.user_emails.name
+      BEDROCK_MODEL_ID                = local.bedrock_model_id
+      OUTPUT_SQS_URL                  = aws_sqs_queue.chat_queue.url
+      OUTPUT_SQS_URL_GMAIL            = aws_sqs_queue.url_visitor_queue.url
+      REGION                          = var.aws_region
+      CLASSIFIER_CONCURRENCY          = var.classifier_concurrency
+      CLASSIFIER_BATCH_SIZE           = var.classifier_batch_size
+      CLASSIFICATION_CACHE_TABLE      = aws_dynamodb_table.classification_cache.name
+      NOTIFY_SQS_URL                  = aws_sqs_queue.notify_queue.url
+      CHAT_HISTORY_ENABLED            = var.chat_history_enabled
+      LEDGER_TABLE                    = aws_dynamodb_table.message_ledger.name
+      BEDROCK_FAST_MODEL_ID           = var.bedrock_fast_model_id
+      CLASSIFIER_CONFIDENCE_THRESHOLD = var.classifier_confidence_threshold
+      BEDROCK_STREAM_RESPONSES        = var.bedrock_stream_responses
+      BEDROCK_PROMPT_CACHE_MODELS     = join(",", var.bedrock_prompt_cache_models)
+      PREFILTER_MODE                  = var.prefilter_mode
+      PREFILTER_MODEL_URI             = "s3://${aws_s3_bucket.s3_bucket_sanitized.bucket}/models/prefilter.bin"
+      PREFILTER_THRESHOLD             = var.prefilter_threshold
+      PREFILTER_TRAINING_BUCKET       = aws_s3_bucket.s3_bucket_sanitized.bucket
     }
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sqs_trigger_classifier" {
-  event_source_arn = aws_sqs_queue.sanitized_queue.arn
-  function_name    = aws_lambda_function.needl_email_classifier.arn
-  batch_size       = 10
-  enabled          = true
+  event_source_arn        = aws_sqs_queue.sanitized_queue.arn
+  function_name           = aws_lambda_function.needl_email_classifier.arn
+  batch_size              = 10
+  enabled                 = true
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 resource "aws_lambda_function" "needl_email_notifier" {
@@ -62,17 +81,22 @@ resource "aws_lambda_function" "needl_email_notifier" {
 
   environment {
     variables = {
-      USER_EMAILS_TABLE = aws_dynamodb_table.user_emails.name
-      TELEGRAM_BOT_ID   = var.telegram_id
+      USER_EMAILS_TABLE     = aws_dynamodb_table.user_emails.name
+      TELEGRAM_BOT_ID       = var.telegram_id
+      LEDGER_TABLE          = aws_dynamodb_table.message_ledger.name
+      DIGEST_TABLE          = aws_dynamodb_table.notification_digest.name
+      DIGEST_WINDOW_SECONDS = var.digest_window_seconds
+      NOTIFY_SQS_URL        = aws_sqs_queue.notify_queue.url
     }
   }
 }
 
 resource "aws_lambda_event_source_mapping" "sqs_trigger_notifier" {
-  event_source_arn = aws_sqs_queue.notify_queue.arn
-  function_name    = aws_lambda_function.needl_email_notifier.arn
-  batch_size       = 10
-  enabled          = true
+  event_source_arn        = aws_sqs_queue.notify_queue.arn
+  function_name           = aws_lambda_function.needl_email_notifier.arn
+  batch_size              = 10
+  enabled                 = true
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 resource "aws_lambda_function" "needl_email_webhook" {
@@ -86,7 +110,13 @@ resource "aws_lambda_function" "needl_email_webhook" {
 
   environment {
     variables = {
-      OUTPUT_SQS_URL = aws_sqs_queue.chat_queue.url
+      OUTPUT_SQS_URL       = aws_sqs_queue.chat_queue.url
+      NOTIFY_SQS_URL       = aws_sqs_queue.notify_queue.url
+      CHAT_HISTORY_ENABLED = var.chat_history_enabled
+      USER_EMAILS_TABLE    = aws_dynamodb_table.user_emails.name
+      UPDATES_SQS_URL      = aws_sqs_queue.telegram_updates_queue.url
+      WEBHOOK_FAST_ACK     = var.webhook_fast_ack
+      LEDGER_TABLE         = aws_dynamodb_table.message_ledger.name
     }
   }
 }
@@ -96,6 +126,14 @@ resource "aws_lambda_function_url" "needl_email_webhook_url" {
   authorization_type = "NONE"
 }
 
+resource "aws_lambda_event_source_mapping" "sqs_trigger_webhook_updates" {
+  event_source_arn        = aws_sqs_queue.telegram_updates_queue.arn
+  function_name           = aws_lambda_function.needl_email_webhook.arn
+  batch_size              = 10
+  enabled                 = true
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
 resource "aws_lambda_function" "needl_email_chat" {
   function_name    = "needl-email-chat"
   filename         = "${path.module}/../build/chat.zip"
@@ -113,10 +151,11 @@ resource "aws_lambda_function" "needl_email_chat" {
 }
 
 resource "aws_lambda_event_source_mapping" "sqs_trigger_chat" {
-  event_source_arn = aws_sqs_queue.chat_queue.arn
-  function_name    = aws_lambda_function.needl_email_chat.arn
-  batch_size       = 10
-  enabled          = true
+  event_source_arn        = aws_sqs_queue.chat_queue.arn
+  function_name           = aws_lambda_function.needl_email_chat.arn
+  batch_size              = 10
+  enabled                 = true
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 resource "aws_lambda_function" "needl_email_url_visitor" {
@@ -130,8 +169,9 @@ resource "aws_lambda_function" "needl_email_url_visitor" {
 }
 
 resource "aws_lambda_event_source_mapping" "sqs_trigger_url_visitor" {
-  event_source_arn = aws_sqs_queue.url_visitor_queue.arn
-  function_name    = aws_lambda_function.needl_email_url_visitor.arn
-  batch_size       = 10
-  enabled          = true
+  event_source_arn        = aws_sqs_queue.url_visitor_queue.arn
+  function_name           = aws_lambda_function.needl_email_url_visitor.arn
+  batch_size              = 10
+  enabled                 = true
+  function_response_types = ["ReportBatchItemFailures"]
 }
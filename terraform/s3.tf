@@ -22,9 +22,11 @@ resource "aws_s3_bucket" "s3_bucket_sanitized" {
 resource "aws_s3_bucket_notification" "sanitized_event_to_sns" {
   bucket = aws_s3_bucket.s3_bucket_sanitized.bucket
 
+  # Only the trimmed classification views trigger the classifier
   topic {
-    topic_arn = aws_sns_topic.email_events.arn
-    events    = ["s3:ObjectCreated:*"]
+    topic_arn     = aws_sns_topic.email_events.arn
+    events        = ["s3:ObjectCreated:*"]
+    filter_prefix = "classify/"
   }
 
   depends_on = [aws_sns_topic_policy.allow_sanitized_s3_publish]
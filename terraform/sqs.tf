@@ -1,24 +1,87 @@
+# Every queue redrives to its own dead-letter queue after
+# sqs_max_receive_count receives, so a record that always fails stops being
+# retried (and, for the classifier, stops paying for Bedrock calls)
+
 resource "aws_sqs_queue" "ses_email_queue" {
   name                       = "${var.app_name}-raw"
   visibility_timeout_seconds = 60
+  redrive_policy             = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.ses_email_dlq.arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "ses_email_dlq" {
+  name                      = "${var.app_name}-raw-dlq"
+  message_retention_seconds = 1209600
 }
 
 resource "aws_sqs_queue" "sanitized_queue" {
   name                       = "${var.app_name}-sanitized"
   visibility_timeout_seconds = 60
+  redrive_policy             = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.sanitized_dlq.arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "sanitized_dlq" {
+  name                      = "${var.app_name}-sanitized-dlq"
+  message_retention_seconds = 1209600
 }
 
 resource "aws_sqs_queue" "chat_queue" {
   name                       = "${var.app_name}-chat"
   visibility_timeout_seconds = 60
+  redrive_policy             = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.chat_dlq.arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "chat_dlq" {
+  name                      = "${var.app_name}-chat-dlq"
+  message_retention_seconds = 1209600
 }
 
 resource "aws_sqs_queue" "notify_queue" {
   name                       = "${var.app_name}-notify"
   visibility_timeout_seconds = 60
+  redrive_policy             = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.notify_dlq.arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "notify_dlq" {
+  name                      = "${var.app_name}-notify-dlq"
+  message_retention_seconds = 1209600
 }
 
 resource "aws_sqs_queue" "url_visitor_queue" {
   name                       = "${var.app_name}-url-visitor"
   visibility_timeout_seconds = 60
-}
\ No newline at end of file
+  redrive_policy             = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.url_visitor_dlq.arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "url_visitor_dlq" {
+  name                      = "${var.app_name}-url-visitor-dlq"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "telegram_updates_queue" {
+  name                       = "${var.app_name}-telegram-updates"
+  visibility_timeout_seconds = 60
+  redrive_policy             = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.telegram_updates_dlq.arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "telegram_updates_dlq" {
+  name                      = "${var.app_name}-telegram-updates-dlq"
+  message_retention_seconds = 1209600
+}
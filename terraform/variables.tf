@@ -16,6 +16,84 @@ variable "telegram_id" {
   default     = ""
 }
 
+variable "classifier_concurrency" {
+  description = "Maximum number of SQS records the classifier processes concurrently"
+  type        = number
+  default     = 10
+}
+
+variable "classifier_batch_size" {
+  description = "Maximum number of emails packed into one Bedrock classification request (1 disables batching)"
+  type        = number
+  default     = 1
+}
+
+variable "inline_classify" {
+  description = "Send sanitized emails to the classifier inline over SQS instead of through S3 events"
+  type        = bool
+  default     = false
+}
+
+variable "chat_history_enabled" {
+  description = "Route notifications through the chat Lambda (needed once chat history is recorded)"
+  type        = bool
+  default     = false
+}
+
+variable "digest_window_seconds" {
+  description = "Seconds to hold non-urgent notifications and send them to each user as one digest (0 sends each immediately; at most 900)"
+  type        = number
+  default     = 0
+}
+
+variable "bedrock_fast_model_id" {
+  description = "Smaller Bedrock model (Anthropic messages API) tried before bedrock_model_id; empty sends every email to bedrock_model_id"
+  type        = string
+  default     = ""
+}
+
+variable "classifier_confidence_threshold" {
+  description = "Fast-tier verdicts with a lower confidence are escalated to bedrock_model_id"
+  type        = number
+  default     = 0.8
+}
+
+variable "bedrock_stream_responses" {
+  description = "Stream single-email classifications and stop reading once the JSON verdict closes"
+  type        = bool
+  default     = false
+}
+
+variable "bedrock_prompt_cache_models" {
+  description = "Model IDs whose requests mark the classifier's instructions for Bedrock prompt caching, once they reach the model's minimum cacheable length"
+  type        = list(string)
+  default     = []
+}
+
+variable "prefilter_mode" {
+  description = "Local prefilter trained on past verdicts: off, shadow (compare only) or enforce"
+  type        = string
+  default     = "off"
+}
+
+variable "prefilter_threshold" {
+  description = "Prefilter scores at least this sure either way are decided without Bedrock in enforce mode"
+  type        = number
+  default     = 0.97
+}
+
+variable "sqs_max_receive_count" {
+  description = "Receives after which a record that keeps failing is moved to its queue's dead-letter queue"
+  type        = number
+  default     = 3
+}
+
+variable "webhook_fast_ack" {
+  description = "Answer Telegram as soon as an update is queued, and process it from the updates queue"
+  type        = bool
+  default     = false
+}
+
 locals {
   bucket           = "${var.app_name}-storage-raw"
   bedrock_model_id = "anthropic.claude-3-haiku-20240307-v1:0"
@@ -0,0 +1,452 @@
+"""Re-classify stored emails offline and diff the verdicts against earlier ones.
+
+    python tools/reclassify.py --source s3://needl-email-storage-sanitized/ \
+        --output verdicts.jsonl.gz --baseline-ledger message_ledger
+    python tools/reclassify.py --source s3://needl-email-storage-raw/ --raw \
+        --output verdicts.jsonl.gz --resume --baseline previous.jsonl.gz
+
+Emails are listed from the bucket and fetched by a pool of threads. They are
+parsed in a process pool: JSON for sanitized emails, or the sanitizer's MIME
+parsing for raw SES objects with --raw. Each email is then classified by the
+classifier's own rules and classify_email, so prompt, criteria and model
+changes apply as they would live. Every Bedrock call passes a token-bucket
+rate limit and a concurrency bound, and the rate backs off when Bedrock
+throttles. Verdicts are appended to --output as gzipped JSON Lines, one gzip
+member per checkpoint, so an interrupted run restarts where it left off with
+--resume. The diff report compares worth_reading and urgent with a previous
+run's output or with the classifications in the message ledger.
+
+Both tiers of the classification cache, the ledger and the prefilter are
+left off, so every email is classified afresh and nothing live is written.
+"""
+
+import argparse
+import gzip
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "src", "lambda")
+sys.path[:0] = [
+    os.path.join(LAMBDA_DIR, "sanitizer"),
+    os.path.join(LAMBDA_DIR, "classifier"),
+    os.path.join(ROOT, "src", "shared"),
+]
+
+# Error codes Bedrock answers with when it is over its throughput limits
+THROTTLING_CODES = {"ThrottlingException", "ServiceUnavailableException", "TooManyRequestsException"}
+MAX_THROTTLED_ATTEMPTS = 6
+
+# Keys of the diff report, by (previously worth reading, now worth reading)
+CHANGES = {
+    (True, True): "still_worth_reading",
+    (False, False): "still_routine",
+    (False, True): "now_worth_reading",
+    (True, False): "no_longer_worth_reading",
+}
+
+_lambdas = {}
+
+
+def lambda_environment(args):
+    """Environment the Lambdas are imported with; nothing live is written."""
+    return {
+        "REGION": os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION", "us-east-1")),
+        "OUTPUT_S3_BUCKET": "",
+        "USER_EMAILS_TABLE": "",
+        "OUTPUT_SQS_URL": "",
+        "OUTPUT_SQS_URL_GMAIL": "",
+        "BEDROCK_MODEL_ID": args.model,
+        "BEDROCK_FAST_MODEL_ID": args.fast_model or "",
+        "BEDROCK_PROMPT_CACHE_MODELS": ",".join(args.prompt_cache or []),
+        "CLASSIFICATION_CACHE_TABLE": "",
+        "CLASSIFICATION_CACHE_SIZE": "0",
+        "LEDGER_TABLE": "",
+        "PREFILTER_MODE": "off",
+        "PREFILTER_TRAINING_BUCKET": "",
+    }
+
+
+def load_lambda(name):
+    """Import a Lambda's handler module; Lambdas share the module name handler."""
+    if name not in _lambdas:
+        spec = importlib.util.spec_from_file_location(
+            f"{name}_handler", os.path.join(LAMBDA_DIR, name, "handler.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _lambdas[name] = module
+    return _lambdas[name]
+
+
+def init_worker(environment):
+    os.environ.update(environment)
+    load_lambda("sanitizer").metrics.sink = lambda line: None
+
+
+def parse_object(key: str, data: bytes, raw: bool) -> dict:
+    """Turn a stored object into the email the classifier sees (process pool)."""
+    sanitizer = load_lambda("sanitizer")
+    if raw:
+        msg = sanitizer.parse_email_stream([data])
+        trace = {"correlation_id": os.path.basename(key), "received_at": None}
+        email_json = sanitizer.sanitize(msg, trace)
+    else:
+        email_json = json.loads(data)
+    sanitizer.metrics.flush()
+    body = sanitizer.classification_view(
+        email_json.get("body", ""), sanitizer.CLASSIFICATION_BODY_TOKENS
+    )
+    return dict(email_json, body=body)
+
+
+class RateLimiter:
+    """Token bucket shared by the Bedrock workers.
+
+    The rate halves whenever Bedrock throttles and creeps back up towards
+    the configured rate on success, so a run settles just under the limit.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.rate / 2, self.max_rate / 64)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class ThrottledBedrock:
+    """Stand-in for the classifier's Bedrock client that paces every call."""
+
+    def __init__(self, client, limiter: RateLimiter, concurrency: int):
+        self.client = client
+        self.limiter = limiter
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+    def invoke_model(self, **kwargs):
+        return self._call(self.client.invoke_model, kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self._call(self.client.invoke_model_with_response_stream, kwargs)
+
+    def _call(self, fn, kwargs):
+        from botocore.exceptions import ClientError
+
+        for attempt in range(MAX_THROTTLED_ATTEMPTS):
+            self.limiter.acquire()
+            with self.slots:
+                try:
+                    response = fn(**kwargs)
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in THROTTLING_CODES:
+                        raise
+                    if attempt == MAX_THROTTLED_ATTEMPTS - 1:
+                        raise
+                    self.limiter.throttled()
+                else:
+                    self.limiter.succeeded()
+                    return response
+            time.sleep(min(0.5 * 2**attempt, 30))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def list_keys(s3, source: str, raw: bool):
+    """Yield (bucket, key) for each stored email under source."""
+    bucket, _, prefix = source[len("s3://") :].partition("/")
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            # Sanitized emails sit at the top level, next to classify/,
+            # training/ and models/ prefixes
+            if raw or (key.endswith(".json") and "/" not in key[len(prefix) :]):
+                yield bucket, key
+
+
+def read_output(path: str) -> list[dict]:
+    """Read every record in an output file, ignoring a half-written last member."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+        pass
+    return records
+
+
+class OutputWriter:
+    """Append records to a gzipped JSONL file, one gzip member per checkpoint."""
+
+    def __init__(self, path: str, checkpoint_every: int):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        with self._lock:
+            self._lines.append(json.dumps(record) + "\n")
+            if len(self._lines) >= self.checkpoint_every:
+                self._checkpoint()
+
+    def close(self):
+        with self._lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        if not self._lines:
+            return
+        data = gzip.compress("".join(self._lines).encode("utf-8"))
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines = []
+
+
+def classify(classifier, email_data: dict) -> tuple[dict, str]:
+    """Classify an email as the classifier does: rules first, then the model.
+
+    Users are not looked up, so per-user allowed and blocked senders are not
+    applied.
+    """
+    preclassified = classifier.preclassify(email_data)
+    if preclassified:
+        result, rule = preclassified
+        return result, f"rule:{rule}"
+    return classifier.classify_email(email_data)[0], "model"
+
+
+def email_id(record: dict) -> str:
+    """Identify an email across runs; raw and sanitized keys share the correlation id."""
+    return record.get("correlation_id") or record["key"]
+
+
+def baseline_verdicts(args, records) -> dict:
+    """Return earlier verdicts keyed by email_id."""
+    if args.baseline:
+        return {email_id(r): r["verdict"] for r in read_output(args.baseline) if "verdict" in r}
+    if args.baseline_ledger:
+        from ledger import Ledger, stored_classification
+
+        entries = Ledger(args.baseline_ledger).get_many(r.get("correlation_id") for r in records)
+        verdicts = {}
+        for correlation_id, entry in entries.items():
+            stored = stored_classification(entry)
+            if stored is not None:
+                verdicts[correlation_id] = stored
+        return verdicts
+    return {}
+
+
+def diff_report(records: list[dict], baseline: dict, samples: int) -> dict:
+    """Count how verdicts moved since the baseline, with examples of each move."""
+    report = {"classified": 0, "errors": 0, "skipped": 0, "no_baseline": 0, "urgent_changed": 0}
+    report.update({name: 0 for name in CHANGES.values()})
+    examples = {"now_worth_reading": [], "no_longer_worth_reading": []}
+    for record in records:
+        if "error" in record:
+            report["errors"] += 1
+            continue
+        if "skipped" in record:
+            report["skipped"] += 1
+            continue
+        report["classified"] += 1
+        before = baseline.get(email_id(record))
+        if before is None:
+            report["no_baseline"] += 1
+            continue
+        after = record["verdict"]
+        change = CHANGES[(bool(before.get("worth_reading")), bool(after.get("worth_reading")))]
+        report[change] += 1
+        if bool(before.get("urgent")) != bool(after.get("urgent")):
+            report["urgent_changed"] += 1
+        if change in examples and len(examples[change]) < samples:
+            examples[change].append(
+                {
+                    "key": record["key"],
+                    "from": record.get("from"),
+                    "subject": record.get("subject"),
+                    "before": before.get("reason"),
+                    "after": after.get("reason"),
+                }
+            )
+    report["examples"] = examples
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", required=True, help="s3://bucket/prefix of the emails")
+    parser.add_argument("--raw", action="store_true", help="source holds raw SES objects")
+    parser.add_argument("--output", required=True, help="gzipped JSONL of verdicts")
+    parser.add_argument("--resume", action="store_true", help="skip keys already in --output")
+    parser.add_argument("--model", default="anthropic.claude-3-haiku-20240307-v1:0")
+    parser.add_argument("--fast-model", help="fast tier, as BEDROCK_FAST_MODEL_ID")
+    parser.add_argument("--prompt-cache", nargs="*", metavar="MODEL_ID",
+                        help="models to use prompt caching with, as BEDROCK_PROMPT_CACHE_MODELS")
+    parser.add_argument("--rate", type=float, default=5.0, help="Bedrock requests per second")
+    parser.add_argument("--bedrock-concurrency", type=int, default=8)
+    parser.add_argument("--fetch-concurrency", type=int, default=32)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--checkpoint-every", type=int, default=200, help="records per gzip member")
+    parser.add_argument("--limit", type=int, help="stop after this many emails")
+    baseline = parser.add_mutually_exclusive_group()
+    baseline.add_argument("--baseline", help="a previous run's --output to diff against")
+    baseline.add_argument("--baseline-ledger", help="message ledger table to diff against")
+    parser.add_argument("--report", help="write the diff report here as JSON")
+    parser.add_argument("--samples", type=int, default=10, help="examples per change in the report")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output) and not args.resume:
+        sys.exit(f"{args.output} exists; pass --resume to continue it")
+
+    environment = lambda_environment(args)
+    os.environ.update(environment)
+    classifier = load_lambda("classifier")
+    limiter = RateLimiter(args.rate, burst=args.bedrock_concurrency)
+    classifier.bedrock = ThrottledBedrock(classifier.bedrock, limiter, args.bedrock_concurrency)
+    tokens = {
+        "BedrockInputTokens": 0,
+        "BedrockOutputTokens": 0,
+        "BedrockCacheReadTokens": 0,
+        "BedrockCacheWriteTokens": 0,
+    }
+
+    def collect(line):
+        record = json.loads(line)
+        for name in tokens:
+            tokens[name] += sum(record.get(name, []))
+
+    classifier.metrics.sink = collect
+
+    done = {r["key"] for r in read_output(args.output) if "error" not in r}
+    if done:
+        print(f"Resuming; {len(done)} emails already done", file=sys.stderr)
+
+    import clients
+
+    s3 = clients.client("s3")
+    writer = OutputWriter(args.output, args.checkpoint_every)
+    workers = args.fetch_concurrency + args.bedrock_concurrency
+    counts = {"done": 0, "errors": 0}
+    started = time.perf_counter()
+
+    # Workers are spawned rather than forked from this multi-threaded process
+    parse_pool = ProcessPoolExecutor(
+        args.processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(environment,),
+    )
+    with parse_pool, ThreadPoolExecutor(workers) as pool:
+
+        def process(bucket, key):
+            with classifier.metrics.timer("S3Fetch"):
+                data = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+            email_data = parse_pool.submit(parse_object, key, data, args.raw).result()
+            record = {
+                "key": key,
+                "correlation_id": email_data.get("correlation_id"),
+                "from": email_data.get("from"),
+                "subject": email_data.get("subject"),
+            }
+            if not email_data.get("to") or email_data["to"] == "unknown":
+                return dict(record, skipped="no recipient")
+            verdict, source = classify(classifier, email_data)
+            if source == "model":
+                record["model"] = args.model
+            return dict(record, verdict=verdict, source=source, classified_at=int(time.time()))
+
+        def settle(futures):
+            finished, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = futures.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {"key": key, "error": f"{type(e).__name__}: {e}"}
+                    counts["errors"] += 1
+                writer.write(record)
+                counts["done"] += 1
+                if counts["done"] % 100 == 0:
+                    classifier.metrics.flush()
+                    rate = counts["done"] / (time.perf_counter() - started)
+                    print(
+                        f"{counts['done']} emails, {rate:.1f}/s, {counts['errors']} errors, "
+                        f"{limiter.throttles} throttles, Bedrock at {limiter.rate:.1f}/s",
+                        file=sys.stderr,
+                    )
+
+        # Keep a bounded number of emails in flight, so listing never runs
+        # far ahead of classification
+        futures = {}
+        submitted = 0
+        for bucket, key in list_keys(s3, args.source, args.raw):
+            if key in done:
+                continue
+            if args.limit is not None and submitted >= args.limit:
+                break
+            futures[pool.submit(process, bucket, key)] = key
+            submitted += 1
+            while len(futures) >= workers * 2:
+                settle(futures)
+        while futures:
+            settle(futures)
+
+    writer.close()
+    classifier.metrics.flush()
+    elapsed = time.perf_counter() - started
+    print(
+        f"Classified {counts['done']} emails in {elapsed:.1f}s with {counts['errors']} errors; "
+        f"{limiter.throttles} throttles; Bedrock tokens {tokens['BedrockInputTokens']:.0f} in, "
+        f"{tokens['BedrockOutputTokens']:.0f} out, {tokens['BedrockCacheReadTokens']:.0f} cache read, "
+        f"{tokens['BedrockCacheWriteTokens']:.0f} cache write",
+        file=sys.stderr,
+    )
+
+    # A key retried after an error appears twice; its latest record counts
+    records = list({r["key"]: r for r in read_output(args.output)}.values())
+    report = diff_report(records, baseline_verdicts(args, records), args.samples)
+    print(json.dumps({k: v for k, v in report.items() if k != "examples"}, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Train the classifier's prefilter on logged Bedrock verdicts.
+
+    python tools/train_prefilter.py --source s3://needl-email-sanitized/training/prefilter/ \
+        --output prefilter.bin --upload s3://needl-email-sanitized/models/prefilter.bin
+    python tools/train_prefilter.py --source path/to/examples --output prefilter.bin
+
+The classifier logs each verdict it got from Bedrock, with the hashed
+features of the email, as gzipped JSONL (see TrainingLog in
+src/lambda/classifier/prefilter.py). This fits a logistic regression over
+those features with full-batch gradient descent in NumPy, reports how it
+does on a held-out split at a range of thresholds, and writes the artifact
+the classifier loads from PREFILTER_MODEL_URI.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "src", "lambda", "classifier"), os.path.join(ROOT, "src", "shared")]
+
+from prefilter import FEATURE_BITS, FEATURE_VERSION, dumps_model, read_examples  # noqa: E402
+
+THRESHOLDS = (0.8, 0.9, 0.95, 0.97, 0.99)
+
+
+def load_examples(source):
+    """Read every example of the current feature version under source."""
+    examples = []
+    if source.startswith("s3://"):
+        import boto3
+
+        s3 = boto3.client("s3")
+        bucket, _, prefix = source[len("s3://") :].partition("/")
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(".jsonl.gz"):
+                    data = s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+                    examples.extend(read_examples(data))
+    else:
+        for path in sorted(glob.glob(os.path.join(source, "**", "*.jsonl.gz"), recursive=True)):
+            with open(path, "rb") as f:
+                examples.extend(read_examples(f.read()))
+    return [e for e in examples if e.get("v") == FEATURE_VERSION]
+
+
+class Examples:
+    """Examples as flat (row, feature) index arrays, a sparse binary matrix."""
+
+    def __init__(self, examples):
+        lengths = np.array([len(e["f"]) for e in examples], dtype=np.int64)
+        self.n = len(examples)
+        self.rows = np.repeat(np.arange(self.n), lengths)
+        self.features = np.fromiter(
+            (i for e in examples for i in e["f"]), dtype=np.int64, count=int(lengths.sum())
+        )
+        self.labels = np.array([e["y"] for e in examples], dtype=np.float64)
+
+    def predict(self, weights, bias):
+        z = bias + np.bincount(self.rows, weights=weights[self.features], minlength=self.n)
+        return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+
+def fit(data, epochs, learning_rate, l2):
+    """Minimize L2-regularized log loss with Adam over the whole set each step."""
+    size = 1 << FEATURE_BITS
+    weights = np.zeros(size)
+    positive = min(max(data.labels.mean(), 1e-3), 1 - 1e-3)
+    bias = float(np.log(positive / (1 - positive)))
+    m, v = np.zeros(size + 1), np.zeros(size + 1)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        error = data.predict(weights, bias) - data.labels
+        grad = np.empty(size + 1)
+        grad[:size] = np.bincount(data.features, weights=error[data.rows], minlength=size) / data.n
+        grad[:size] += l2 * weights
+        grad[size] = error.mean()
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad**2
+        update = learning_rate * (m / (1 - beta1**step)) / (np.sqrt(v / (1 - beta2**step)) + eps)
+        weights -= update[:size]
+        bias -= update[size]
+    return weights, bias
+
+
+def evaluate(data, weights, bias):
+    """Return accuracy and log loss, and coverage and accuracy per threshold."""
+    p = data.predict(weights, bias)
+    predicted = p >= 0.5
+    correct = predicted == (data.labels == 1)
+    eps = 1e-12
+    log_loss = -np.mean(data.labels * np.log(p + eps) + (1 - data.labels) * np.log(1 - p + eps))
+    report = {"examples": data.n, "accuracy": float(correct.mean()), "log_loss": float(log_loss)}
+    report["thresholds"] = {}
+    for threshold in THRESHOLDS:
+        confident = np.maximum(p, 1 - p) >= threshold
+        report["thresholds"][str(threshold)] = {
+            "coverage": float(confident.mean()),
+            "accuracy": float(correct[confident].mean()) if confident.any() else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", required=True, help="s3://bucket/prefix or a local directory")
+    parser.add_argument("--output", required=True, help="where to write the model artifact")
+    parser.add_argument("--upload", help="s3://bucket/key to upload the artifact to")
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--learning-rate", type=float, default=0.05)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of examples held out")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    examples = load_examples(args.source)
+    if not examples:
+        sys.exit(f"No version {FEATURE_VERSION} examples under {args.source}")
+    random.Random(args.seed).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout)) if len(examples) > 1 else 1
+    train, test = Examples(examples[:split]), Examples(examples[split:] or examples[:split])
+    print(f"Training on {train.n} examples ({train.labels.mean():.1%} worth reading), testing on {test.n}")
+
+    started = time.perf_counter()
+    weights, bias = fit(train, args.epochs, args.learning_rate, args.l2)
+    print(f"Fit in {time.perf_counter() - started:.1f}s")
+
+    report = evaluate(test, weights, bias)
+    print(f"Held-out accuracy {report['accuracy']:.3f}, log loss {report['log_loss']:.3f}")
+    print(f"{'threshold':>10}{'coverage':>10}{'accuracy':>10}")
+    for threshold, row in report["thresholds"].items():
+        accuracy = "-" if row["accuracy"] is None else f"{row['accuracy']:.3f}"
+        print(f"{threshold:>10}{row['coverage']:>10.1%}{accuracy:>10}")
+
+    # Retrain on everything for the shipped model; the report stands for it
+    weights, bias = fit(Examples(examples), args.epochs, args.learning_rate, args.l2)
+    info = {"trained_at": int(time.time()), "examples": len(examples), "holdout": report}
+    artifact = dumps_model(weights.astype("<f4").tobytes(), float(bias), info)
+    with open(args.output, "wb") as f:
+        f.write(artifact)
+    print(f"Wrote {args.output} ({len(artifact) / 1024:.0f} KiB)")
+
+    if args.upload:
+        import boto3
+
+        bucket, _, key = args.upload[len("s3://") :].partition("/")
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=artifact)
+        print(f"Uploaded to {args.upload}")
+
+
+if __name__ == "__main__":
+    main()